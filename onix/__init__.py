@@ -1,7 +1,15 @@
-from . import couple
 from onix.passport import *
 from onix.sequence import *
 from onix.cell import *
 from onix.system import *
 from onix.passlist import *
-from onix.standalone import *
\ No newline at end of file
+from onix.standalone import *
+
+# The coupling module needs OpenMC, it is only imported when onix.couple is first accessed
+def __getattr__(name):
+
+    if name == 'couple':
+        import importlib
+        return importlib.import_module('.couple', __name__)
+
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
@@ -2,11 +2,12 @@ from .sequence import Sequence as seq
 from .passlist import Passlist as pl
 from .passport import Passport as pp
 from . import data
+from .salameche import cram
+from .salameche import mat_builder as mb
 import onix.utils as utils
 import copy
 import os
 import shutil
-import operator
 import time
 
 
@@ -43,6 +44,13 @@ class Cell(object):
         # self._flux = None
         self._FMF = None
         self._output_summary_path = None
+        self._solver = None
+        self._density_check_stats = None
+        self._solver_stats = None
+        # Indexes of the nuclides kept in the depletion system when the network is reduced
+        self._reduced_index = None
+        # Number of top producers and destroyers kept per nuclide when reaction rates are ranked (None keeps all reactions in memory)
+        self._reac_rank_top = None
 
     # Mainly designed for the code. Used when the user use text input rather than python module
     # probably obsolete
@@ -136,11 +144,7 @@ class Cell(object):
     def _set_step_dens(self):
 
         passlist = self.passlist
-        passport_list = passlist.passport_list
-
-        for i in range(len(passport_list)):
-            nuc_pass = passport_list[i]
-            nuc_pass._set_step_dens()
+        passlist._set_step_dens()
 
     # This is effectively set_substep_dens
     def _update_dens(self, N, ss, ssn):
@@ -150,11 +154,7 @@ class Cell(object):
         # (the argument passport_list is a pointer to the object, not a copy of the object)
         # You need to be sure that N and passport_list are ordered in the same
         passlist = self.passlist
-        passport_list = passlist.passport_list
-
-        for i in range(len(passport_list)):
-            nuc_pass = passport_list[i]
-            nuc_pass._set_substep_dens(N[i], ss)
+        passlist._set_substep_dens(N, ss)
 
     @property
     def initial_nucl(self):
@@ -468,6 +468,37 @@ class Cell(object):
 
         return self._sequence
 
+    @property
+    def density_check_stats(self):
+        """Returns the onix.salameche.Density_check_stats object of the last microstep. It counts the negative and extremely small densities set to zero after the depletion solve."""
+        return self._density_check_stats
+
+    @property
+    def solver_stats(self):
+        """Returns the onix.salameche.Solver_stats object of the last macrostep. It counts the depletion solves, their duration and the solves that reused CRAM LU factors.
+        In batch mode, the BUCells depleted together share the same object."""
+        return self._solver_stats
+
+    @property
+    def solver(self):
+        """Returns the solver used for the depletion equation of this cell. If no solver has been set for the cell, the solver of its sequence is returned."""
+        if self._solver is None:
+            return self.sequence.solver
+        return self._solver
+
+    @solver.setter
+    def solver(self, solver):
+        """Sets the solver used for the depletion equation of this cell. This overrides the solver of the sequence for this cell only.
+
+        Parameters
+        ----------
+        solver: str
+            'cram16', 'cram48', 'ipf16', 'ipf48', 'expm_multiply' or 'pade'
+        """
+        if solver not in cram.solver_list:
+            raise cram.Unknown_solver('Solver {} is not supported, choose among {}'.format(solver, cram.solver_list))
+        self._solver = solver
+
 
 
 
@@ -543,21 +574,9 @@ class Cell(object):
     def _update_pow_dens(self, flux):
 
         passlist = self.passlist
-        fission_energy_rate = 0
         conv_Mev_J = 1.60218e-13
-        for i in passlist.passport_list:
-            if i.current_xs != None:
-                if i.fission_E != None and 'fission' in i.current_xs:
-                    fission_xs = i.current_xs['fission'][0] # cm2 10^-24
-                    fission_E = i.fission_E # MeV
-                    dens = i.current_dens # cm-1 barn-1 (cm-3 10+24)
-
-                    # print (i.name)
-                    # print (fission_E)
-                    # print (fission_xs)
-                    # print (dens)
-
-                    fission_energy_rate += fission_xs*fission_E*dens
+        # Sum of fission xs (cm2 10^-24) * fission energy (MeV) * density (cm-1 barn-1 (cm-3 10+24))
+        fission_energy_rate = passlist.get_fission_energy_rate()
 
 
         # print ('fission_energy_rate',fission_energy_rate)
@@ -572,18 +591,21 @@ class Cell(object):
     def _update_flux(self, pow_dens):
 
         passlist = self.passlist
-        passport_list = passlist.passport_list
         print('update_flux called')
-        fission_energy_rate = 0
         conv_Mev_J = 1.60218e-13
-        for i in passport_list:
-            if i.fission_E != None and i.current_xs != None:
-                if 'fission' in i.current_xs:
-                    fission_xs = i.current_xs['fission'][0]
-                    fission_E = i.fission_E
-                    dens = i.current_dens
+        fission_energy_rate = passlist.get_fission_energy_rate()
+
+        new_flux = pow_dens/(fission_energy_rate*conv_Mev_J)
+
+        return new_flux
 
-                    fission_energy_rate += fission_xs*fission_E*dens
+    # Flux yielding power density pow_dens for a density vector ordered as the passlist
+    # Used by the predictor-corrector schemes to evaluate the flux at predicted densities
+    def _get_flux_from_vect(self, N, pow_dens):
+
+        passlist = self.passlist
+        conv_Mev_J = 1.60218e-13
+        fission_energy_rate = passlist.get_fission_energy_rate(N)
 
         new_flux = pow_dens/(fission_energy_rate*conv_Mev_J)
 
@@ -707,8 +729,9 @@ class Cell(object):
             Path to the decay library provided by the user
         """
 
-        decay_b = data.read_lib_functions.read_decay_lib(decay_lib_path)
-        decay_a = data.read_lib_functions.conv_decay_b_a(decay_b)
+        # All the BUCells using this library share the same memory-mapped store
+        decay_b = data.get_lib_store(decay_lib_path, 'decay_b')
+        decay_a = data.get_lib_store(decay_lib_path, 'decay_a')
 
         nucl_list = list(decay_a.keys())
 
@@ -737,11 +760,12 @@ class Cell(object):
         #__file__path = os.path.abspath(os.path.dirname(__file__))
 
         #default_decay_lib_path = __file__path+ '/data/default_libs/decay_lib'
-        default_decay_lib_path = data.default_decay_b_lib_path
         #default_decay_lib_path = '/home/julien/Open-Burnup.dev/onix/data/default_libs/decay_lib'
 
-        decay_b = data.read_lib_functions.read_decay_lib(default_decay_lib_path)
-        decay_a = data.read_lib_functions.conv_decay_b_a(decay_b)
+        # The default library is already loaded by onix.data. All the BUCells share the same library objects
+        # so that the decay matrix only needs to be built once (see onix.salameche.get_decay_mat_cached)
+        decay_b = data.default_decay_lib_b
+        decay_a = data.default_decay_lib_a
 
         nucl_list = list(decay_a.keys())
 
@@ -841,7 +865,8 @@ class Cell(object):
             Path to the cross section library provided by the user
         """
 
-        xs_dic = data.read_lib_functions.read_xs_lib(xs_lib_path)
+        # All the BUCells using this library share the same memory-mapped store
+        xs_dic = data.get_lib_store(xs_lib_path, 'xs')
 
         nucl_list = list(xs_dic.keys())
 
@@ -869,7 +894,8 @@ class Cell(object):
         # default_xs_lib_path = '/home/julien/Open-Burnup.dev/onix/data/default_libs/xs_lib'
         # pupu_xs_lib_path = '/home/julien/Open-Burnup.dev/onix/data/default_libs/xs_lib_pupu'
 
-        xs_dic = data.read_lib_functions.read_xs_lib(default_xs_lib_path)
+        # The default library is shared by all the BUCells
+        xs_dic = data.default_xs_lib
 
         nucl_list = list(xs_dic.keys())
 
@@ -978,7 +1004,8 @@ class Cell(object):
 
         if complete == False:
 
-            fy_dic = data.read_lib_functions.read_fy_lib(fy_lib_path)
+            # All the BUCells using this library share the same memory-mapped store
+            fy_dic = data.get_lib_store(fy_lib_path, 'fy')
 
             nucl_list = list(fy_dic.keys())
 
@@ -1030,9 +1057,8 @@ class Cell(object):
 
         elif complete == True:
                     fy_dic = {}
-                    user_fy_dic = data.read_lib_functions.read_fy_lib(fy_lib_path)
-                    default_fy_lib_path = data.default_fy_lib_path
-                    default_fy_dic = data.read_lib_functions.read_fy_lib(default_fy_lib_path)
+                    user_fy_dic = data.get_lib_store(fy_lib_path, 'fy')
+                    default_fy_dic = data.default_fy_lib
                     # Create list of actinides in user fy
                     user_fy_nucl_list = list(user_fy_dic.keys())
                     user_act = []
@@ -1098,7 +1124,8 @@ class Cell(object):
 
         #default_fy_lib_path = '/home/julien/Open-Burnup.dev/onix/data/default_libs/fy_lib'
 
-        fy_dic = data.read_lib_functions.read_fy_lib(default_fy_lib_path)
+        # The default library is shared by all the BUCells
+        fy_dic = data.default_fy_lib
 
         nucl_list = list(fy_dic.keys())
 
@@ -1409,13 +1436,14 @@ class Cell(object):
 
         txt += '\n\n'
 
-        for nucl in passport_list:
-            zamid = nucl.zamid
-            dens = nucl.get_dens_subseq(s)
+        # The micro sequence of step s is the last one stored (worker processes of parallel_on() only store this one)
+        dens_subseq_mat = passlist.get_dens_subseq_mat(-1)
+        for i in range(len(passport_list)):
+            zamid = passport_list[i].zamid
             txt += '{:<10}'.format(zamid)
 
             for ss in range(substeps):
-                txt += '{:<13.5E}'.format(dens[ss])
+                txt += '{:<13.5E}'.format(dens_subseq_mat[ss, i])
 
             txt += '\n'
 
@@ -1498,18 +1526,19 @@ class Cell(object):
 
         txt += '\n\n'
 
-        for nucl in passport_list:
-            zamid = nucl.zamid
+        init_dens_vect = passlist.get_dens_seq_mat()[0]
+        dens_subseq_mat_list = [passlist.get_dens_subseq_mat(s+1) for s in range(steps_number)]
+        for i in range(len(passport_list)):
+            zamid = passport_list[i].zamid
 
-            dens = nucl.dens_subseq_mat[s+1]
             txt += '{:<10}'.format(zamid)
-            init_dens = nucl.dens_seq[0]
+            init_dens = init_dens_vect[i]
             txt += '{:<13.5E}'.format(init_dens)
             for s in range(steps_number):
                 substeps_number = sequence.microsteps_number(s)
+                dens_subseq_mat = dens_subseq_mat_list[s]
                 for ss in range(substeps_number):
-                    dens = nucl.dens_subseq_mat[s+1]
-                    txt += '{:<13.5E}'.format(dens[ss])
+                    txt += '{:<13.5E}'.format(dens_subseq_mat[ss, i])
 
             txt += '\n'
 
@@ -1583,17 +1612,19 @@ class Cell(object):
 
         txt += '\n\n'
 
-        for nucl in passport_list:
+        dens_seq_mat = passlist.get_dens_seq_mat()
+        for i in range(len(passport_list)):
+            nucl = passport_list[i]
             zamid = nucl.zamid
             name = nucl.name
 
             txt += '{:<10}'.format(name)
             txt += '{:<10}'.format(zamid)
             txt += '{:^13}'.format('')
-            init_dens = nucl.dens_seq[0]
+            init_dens = dens_seq_mat[0, i]
             txt += '{:<13.5E}'.format(init_dens)
             for s in range(steps_number):
-                dens = nucl.dens_seq[s+1]
+                dens = dens_seq_mat[s+1, i]
                 txt += '{:<13.5E}'.format(dens)
 
             txt += '\n'
@@ -1669,7 +1700,9 @@ class Cell(object):
 
         txt += '\n\n'
 
-        for nucl in passport_list:
+        dens_seq_mat = passlist.get_dens_seq_mat()
+        for i in range(len(passport_list)):
+            nucl = passport_list[i]
             zamid = nucl.zamid
             name = nucl.name
             decay = nucl.decay_a
@@ -1707,11 +1740,11 @@ class Cell(object):
                 txt += '{:<10}'.format(name)
                 txt += '{:<10}'.format(zamid)
                 txt += '{:<13.5E}'.format(hl)
-                init_act = nucl.dens_seq[0]*decay_val
+                init_act = dens_seq_mat[0, i]*decay_val
                 txt += '{:<13}'.format('')
                 txt += '{:<13.5E}'.format(init_act)
                 for s in range(steps_number):
-                    dens = nucl.dens_seq[s+1]
+                    dens = dens_seq_mat[s+1, i]
                     act = dens*decay_val
                     txt += '{:<13.5E}'.format(act)
 
@@ -2140,10 +2173,8 @@ class Cell(object):
 
     def _set_allreacs_dic(self, s, ss, ssn):
 
-
         passlist = self.passlist
         passport_list = passlist.passport_list
-        passport_dict = passlist._get_zamid_passport_dict()
 
         sequence = self.sequence
 
@@ -2151,6 +2182,19 @@ class Cell(object):
         flux = sequence.current_flux
         N = len(passport_list)
 
+        # Reaction rates of the creation and destruction terms of all nuclides are computed and ranked at once
+        topology = mb.get_reaction_rate_topology(passlist)
+        rates = topology.get_reaction_rates(passlist, flux)
+
+        if self._reac_rank_top is not None:
+            self._write_allreacs_rank_top(topology, rates, ss)
+            return None
+
+        ranked_term = topology.get_ranked_terms(rates).tolist()
+        allreacs_indptr = topology.allreacs_indptr.tolist()
+        label_list = topology.label_list
+        rate_list = list(rates)
+
         # EOS = 1 means that the sequence reached end of step
         EOS = 0
         if ss == ssn - 1:
@@ -2158,98 +2202,9 @@ class Cell(object):
 
         for row in range(N):
             nuc_pass = passport_list[row]
-            nuc_zamid = nuc_pass.zamid
-            nuc_name = nuc_pass.name
-            nuc_dens = nuc_pass.current_dens
-            creation_dic = {}
-            destruction_dic = {}
-            allreacs_dic = {}
-
-            if nuc_pass.decay_a != None and nuc_pass.decay_a != 'stable':
-                decay = nuc_pass.decay_a
-                decay_rate = decay.copy()
-                del decay_rate['total decay']
-                del decay_rate['half-life']
-                for i in decay_rate:
-                    decay_rate[i] = decay_rate[i]*nuc_dens
-                destruction_dic = decay_rate.copy()
-
-
-
-            # Multiply xs by flux
-            if nuc_pass.current_xs != None:
-                xs = nuc_pass.current_xs
-                xs_rate = {}
-                for i in xs:
-                    xs_rate[i] = xs[i][0]*flux*1e-24*nuc_dens
-                destruction_dic.update(xs_rate)
-                del destruction_dic['removal']
-
-            # Multiply fy by xs fission of father and phi
-            if nuc_pass.fy != None:
-                fy = nuc_pass.fy
-                fy_rate = {}
-                for i in fy:
-                    if i in passport_dict:
-                        father_pass = passport_dict[i]
-                        father_dens = father_pass.current_dens
-                        father_name = father_pass.name
-                        if father_pass.current_xs == None:
-                            continue
-                        if 'fission' not in father_pass.current_xs:
-                            continue
-                        father_fission_xs = father_pass.current_xs['fission'][0]
-                        entry = '{} fission'.format(father_name)
-                        fy_rate[entry] = fy[i][0]*1e-2*father_fission_xs*flux*1e-24*father_dens
-                creation_dic = fy_rate.copy()
-
-            # Now we gather the creation terms (excluding fission as it has been already collected in fyxsphi)
-            xs_parent = nuc_pass.xs_parent
-            decay_parent = nuc_pass.decay_parent
-
-            xs_parent_val = {}
-            for i in xs_parent:
-                father_zamid = xs_parent[i]
-                if father_zamid in passport_dict:
-                    father_pass = passport_dict[father_zamid]
-                    father_dens = father_pass.current_dens
-                    father_state = father_pass.state
-                    father_name = father_pass.name
-                    # The reacname from xs_parent is different from parent_xs in case parent is in excited state
-                    if father_state == 1:
-                        reac_name = i[1:]
-                    elif father_state == 0:
-                        reac_name = i
-                    if father_pass.current_xs != None:
-                        if reac_name in father_pass.current_xs:
-                            father_xs_rate = father_pass.current_xs[reac_name][0]*flux*1e-24*father_dens
-
-                            entry = '{} {}'.format(father_name, reac_name)
-
-                            xs_parent_val[entry] = father_xs_rate
-            creation_dic.update(xs_parent_val)
-
-            decay_parent_val = {}
-            for i in decay_parent:
-                father_zamid = decay_parent[i]
-                if father_zamid in passport_dict:
-                    father_pass = passport_dict[father_zamid]
-                    father_dens = father_pass.current_dens
-                    father_state = father_pass.state
-                    father_name = father_pass.name
-                    # The reacname from xs_parent is different from parent_xs in case parent is in excited state
-                    if father_state == 1:
-                        reac_name = i[1:]
-                    elif father_state == 0:
-                        reac_name = i
-                    if father_pass.decay_a != None and father_pass.decay_a != 'stable':
-                        if reac_name in father_pass.decay_a:
-                            father_decay = father_pass.decay_a[reac_name]*father_dens
-
-                            entry = '{} {}'.format(father_name, reac_name)
-
-                            decay_parent_val[entry] = father_decay
-            creation_dic.update(decay_parent_val)
+
+            destruction_dic = {label_list[k]: rate_list[k] for k in topology.destruction_term_list[row]}
+            creation_dic = {label_list[k]: rate_list[k] for k in topology.creation_term_list[row]}
 
             allreacs_dic = destruction_dic.copy()
             allreacs_dic.update(creation_dic)
@@ -2259,15 +2214,48 @@ class Cell(object):
             nuc_pass.allreacs_dic = allreacs_dic
             nuc_pass._allreacs_dic_list_append(allreacs_dic)
 
-            sorted_allreacs = sorted(list(allreacs_dic.items()), key=operator.itemgetter(1))
+            sorted_allreacs = [(label_list[k], rate_list[k]) for k in ranked_term[allreacs_indptr[row]:allreacs_indptr[row+1]]]
 
             nuc_pass._append_current_sorted_allreacs_tuple_list(sorted_allreacs, ss)
 
             if EOS == 1:
                 nuc_pass._append_sorted_allreacs_tuple_mat()
 
+    def _write_allreacs_rank_top(self, topology, rates, ss):
+        """Appends the top producers and destroyers of each nuclide for microstep ss to the reaction rates ranking file of the BUCell folder."""
+
+        passport_list = self.passlist.passport_list
+        dens_vect = self.passlist.get_dens_vect()
+        label_list = topology.label_list
+        (destruction_indptr, destruction_term), (creation_indptr, creation_term) = topology.get_top_terms(rates, self._reac_rank_top)
+        destruction_indptr = destruction_indptr.tolist()
+        destruction_term = destruction_term.tolist()
+        creation_indptr = creation_indptr.tolist()
+        creation_term = creation_term.tolist()
+
+        file_name = self.folder_path +'/cell_{}_reacs_rank_top'.format(self.id)
+        file = open(file_name, 'a')
+
+        txt = 'substep = {}\n'.format(ss)
+        for i in range(len(passport_list)):
+            destruction_top = destruction_term[destruction_indptr[i]:destruction_indptr[i+1]]
+            creation_top = creation_term[creation_indptr[i]:creation_indptr[i+1]]
+            if not destruction_top and not creation_top:
+                continue
+            nucl = passport_list[i]
+            txt += '{:<10}{:<10}{:<13.5E}'.format(nucl.name, nucl.zamid, dens_vect[i])
+            txt += 'D: {}'.format('; '.join(['{} {:.5E}'.format(label_list[k], rates[k]) for k in destruction_top]))
+            txt += ' | C: {}\n'.format('; '.join(['{} {:.5E}'.format(label_list[k], rates[k]) for k in creation_top]))
+
+        file.write(txt)
+        file.close()
+
     def _print_current_allreacs_rank(self):
 
+        # With a top ranking, the ranking has already been written at each microstep
+        if self._reac_rank_top is not None:
+            return None
+
         passport_list = self.passlist.passport_list
         cell_id = self.id
         cell_folder_path = self.folder_path
@@ -2276,11 +2264,13 @@ class Cell(object):
         file = open(file_name, 'w')
 
         txt = ''
-        for nucl in passport_list:
+        dens_subseq_mat = self.passlist.get_dens_subseq_mat(-1)
+        for i in range(len(passport_list)):
+            nucl = passport_list[i]
             reacs_rank = nucl.current_sorted_allreacs_tuple_list
             txt += '\n{}({})\n'.format(nucl.name, nucl.zamid)
             for ss in range(len(reacs_rank)):
-                txt += 'substep = {} | dens = {}\n'.format(ss, nucl.get_current_dens_subseq()[ss])
+                txt += 'substep = {} | dens = {}\n'.format(ss, dens_subseq_mat[ss, i])
                 txt += '{}\n'.format(reacs_rank[ss])
 
         file.write(txt)
@@ -2288,6 +2278,10 @@ class Cell(object):
 
     def _print_summary_allreacs_rank(self, summary_path):
 
+        if self._reac_rank_top is not None:
+            self._print_summary_allreacs_rank_top(summary_path)
+            return None
+
         passport_list = self.passlist.passport_list
         cell_name = self.name
 
@@ -2295,19 +2289,40 @@ class Cell(object):
         file = open(file_name, 'w')
 
         txt = ''
-        for nucl in passport_list:
+        steps_number = self.sequence.macrosteps_number
+        dens_subseq_mat_list = [self.passlist.get_dens_subseq_mat(s+1) for s in range(steps_number)]
+        for i in range(len(passport_list)):
+            nucl = passport_list[i]
             reacs_rank = nucl.sorted_allreacs_tuple_mat
             txt += '\n ==={}({}) ===\n'.format(nucl.name, nucl.zamid)
             for s in range(len(reacs_rank)):
                 txt += '\nSTEP {}\n'.format(s+1)
                 for ss in range(len(reacs_rank[s])):
                     # subseq has s+1 elements because of the initial element 
-                    txt += 'substep = {} | dens = {}\n'.format(ss, nucl.dens_subseq_mat[s+1][ss])
+                    txt += 'substep = {} | dens = {}\n'.format(ss, dens_subseq_mat_list[s][ss, i])
                     txt += '{}\n'.format(reacs_rank[s][ss])
 
         file.write(txt)
         file.close()
 
+    def _print_summary_allreacs_rank_top(self, summary_path):
+        """Gathers the top reaction rates ranking files of all steps into the output summary folder without loading them in memory."""
+
+        steps_number = self.sequence.macrosteps_number
+        file_name = summary_path +'/cell_{}_reacs_rank_top'.format(self.name)
+        file = open(file_name, 'w')
+
+        for s in range(1, steps_number+1):
+            step_file_name = self._get_step_folder_path(s) + '/cell_{}_reacs_rank_top'.format(self.id)
+            if not os.path.isfile(step_file_name):
+                continue
+            file.write('\nSTEP {}\n'.format(s))
+            step_file = open(step_file_name, 'r')
+            shutil.copyfileobj(step_file, file)
+            step_file.close()
+
+        file.close()
+
     # This is probably the method that generate the nuclide list that will then be used to produce reduced libraries
     def _reduce_nucl_set(self):
 
@@ -2626,10 +2641,15 @@ class Cell(object):
         utils.gen_cell_folder(cell_name)
         self._folder_path = utils.get_cell_folder_path(cell_name)
 
+    def _get_step_folder_path(self, s):
+
+        # The step folders are generated next to the folder of the BUCell
+        return os.path.dirname(self.folder_path) + '/step_{}/{}_cell'.format(s, self.name)
+
     def _copy_cell_folders_to_step_folder(self, s):
 
         cell_folder_path = self.folder_path
-        shutil.copytree(cell_folder_path, os.getcwd() + '/step_{}/{}_cell'.format(s, self.name))
+        shutil.copytree(cell_folder_path, self._get_step_folder_path(s))
         shutil.rmtree(cell_folder_path)
 
     # def _gen_output_summary_folder(self):
@@ -2657,4 +2677,4 @@ class Nuclide_list_redundant(Exception):
 
 class Passlist_not_defined(Exception):
     """Raise when the user forgot to defined passlist for a cell"""
-    pass
\ No newline at end of file
+    pass
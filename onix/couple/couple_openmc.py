@@ -1,5 +1,4 @@
 import numpy as np
-import matplotlib.pyplot as plt
 import shutil
 import os
 import copy
@@ -12,7 +11,7 @@ from copy import deepcopy
 import openmc
 import openmc.mgxs as mgxs
 from onix.cell import Cell
-from onix.system import System
+from onix.system import System, Incompatible_depletion_modes
 from onix import salameche
 from .openmc_fix import *
 
@@ -125,6 +124,12 @@ class Couple_openmc(object):
 
         # By default, ONIX does not compute reactions rates ranking (it takes a lot of memory)
         self._reac_rank = 'off'
+        self._reac_rank_top = None
+
+        # By default, ONIX depletes BUCells one after the other
+        self._batch_cram = 'off'
+        self._parallel = 'off'
+        self._processes = None
 
         # By default tolerance value is set to 500 K for treating intermediate temperatures.
         self._tolerance = 500.0
@@ -192,14 +197,54 @@ class Couple_openmc(object):
 
         return self._reac_rank
     
-    def reac_rank_on(self):
+    def reac_rank_on(self, top = None):
         """Calling this function will tell ONIX to produce reaction rates ranking and print them for each BUCells
         By default ONIX does not produce reaction rates ranking as it takes a lot of memory.
 
         Important: In the current version of ONIX, this function needs to be called before couple.import_openmc() is called other
         wise the function will not work.
+
+        Parameters
+        ----------
+        top: int
+            (Optional) If set, only the top producers and the top destroyers of each nuclide are kept and the ranking is streamed to disk
+            (see onix.System.reac_rank_on)
         """
         self._reac_rank = 'on'
+        self._reac_rank_top = top
+
+    @property
+    def batch_cram(self):
+
+        return self._batch_cram
+
+    def batch_cram_on(self):
+        """Calling this function will tell ONIX to solve the depletion equations of all BUCells together at each microstep.
+        BUCells whose depletion matrices are identical are then depleted with a single factorization per pole.
+
+        This option cannot be used together with parallel_on().
+
+        Important: this function needs to be called before couple.import_openmc() is called otherwise the function will not work.
+        """
+        if self._parallel == 'on':
+            raise Incompatible_depletion_modes('batch_cram_on() cannot be called as parallel_on() has already been called')
+        self._batch_cram = 'on'
+
+    @property
+    def parallel(self):
+
+        return self._parallel
+
+    def parallel_on(self, processes = None):
+        """Calling this function will tell ONIX to deplete the BUCells in parallel over a pool of processes.
+        If processes is None (default), one process per processor of the machine is used. This option cannot be used together with batch_cram_on().
+
+        Important: this function needs to be called before couple.import_openmc() is called otherwise the function will not work.
+        """
+        if self._batch_cram == 'on':
+            raise Incompatible_depletion_modes('parallel_on() cannot be called as batch_cram_on() has already been called')
+        self._parallel = 'on'
+        self._processes = processes
 
     def select_bucells(self, bucell_list):
         """Selects the cells from the OpenMC input that should be depleted.
@@ -300,7 +345,11 @@ class Couple_openmc(object):
         #Instantiate a system
         system = System(1)
         if self.reac_rank == 'on':
-            system.reac_rank_on()
+            system.reac_rank_on(self._reac_rank_top)
+        if self.batch_cram == 'on':
+            system.batch_cram_on()
+        if self.parallel == 'on':
+            system.parallel_on(self._processes)
         self.system = system
 
         # read periodic surfaces  (openmc summary forgets the periodic surfaces coupling)
@@ -1346,16 +1395,8 @@ class Couple_openmc(object):
     def _set_sampled_isomeric_branching_data(self):
 
         print ('\n\n\n***********Sampling isomeric branching data***********\n\n\n')
-        isomeric_branching_data = data.read_isomeric_data()
-        sampled_isomeric_branching_data = {}
-
-        for nucl in isomeric_branching_data:
-            nucl_data = isomeric_branching_data[nucl]
-
-            # print (nucl_data['0'])
-            sampled_isomeric_branching_data[nucl] = {}
-            sampled_isomeric_branching_data[nucl]['0'] = nucl_data['0'](self.mg_energy_mid_points)
-            sampled_isomeric_branching_data[nucl]['1'] = nucl_data['1'](self.mg_energy_mid_points)
+        # Sampled data are cached for each multigroup energy grid (see onix.data.get_sampled_isomeric_branching_data)
+        sampled_isomeric_branching_data = data.get_sampled_isomeric_branching_data(self.mg_energy_mid_points)
 
         self._sampled_isomeric_branching_data = sampled_isomeric_branching_data
 
@@ -1633,20 +1674,24 @@ class Couple_openmc(object):
         #steps_number = sequence.steps_number
         steps_number = sequence.macrosteps_number
         # Shift loop from 1 in order to align loop s and step indexes
-        for s in range(1, steps_number+1):
-
-            print ('\n\n\n\n====== STEP {}======\n\n\n\n'.format(s))
-            sequence._gen_step_folder(s)
-            print (('\n\n\n=== OpenMC Transport {}===\n\n\n'.format(s)))
-            self._change_temperature(s)
-            self._run_openmc()
-            self._set_tallies_to_bucells(s)
-            self._step_normalization(s)
-            self._copy_MC_files(s)
-            print (('\n\n\n=== Salameche Burn {} ===\n\n\n'.format(s)))
-            print (utils.printer.salameche_header)
-            salameche.burn_step(system, s, 'couple')
-            self._set_dens_to_cells()
+        try:
+            for s in range(1, steps_number+1):
+
+                print ('\n\n\n\n====== STEP {}======\n\n\n\n'.format(s))
+                sequence._gen_step_folder(s)
+                print (('\n\n\n=== OpenMC Transport {}===\n\n\n'.format(s)))
+                self._change_temperature(s)
+                self._run_openmc()
+                self._set_tallies_to_bucells(s)
+                self._step_normalization(s)
+                self._copy_MC_files(s)
+                print (('\n\n\n=== Salameche Burn {} ===\n\n\n'.format(s)))
+                print (utils.printer.salameche_header)
+                salameche.burn_step(system, s, 'couple')
+                self._set_dens_to_cells()
+        finally:
+            # The worker processes of parallel_on() are only kept during the depletion steps
+            system._shutdown_process_pool()
         
         # This last openmc_run is used to compute the last burnup/time point kinf
         print ('\n\n\n=== OpenMC Transport for Final Point ===\n\n\n')
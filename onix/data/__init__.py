@@ -3,6 +3,8 @@
 import os
 import math as m
 from .read_lib_functions import *
+from .lib_store import *
+from .isomeric_store import *
 from . import list_and_dict
 
 
@@ -16,12 +18,48 @@ default_xs_lib_path = os.path.join(os.path.dirname(__file__), 'default_libs/xs_l
 default_fy_lib_path = os.path.join(os.path.dirname(__file__), 'default_libs/fy_lib_reduced')
 
 # Default libraries data
+# The default libraries are parsed the first time they are accessed (ex: onix.data.default_xs_lib) and then stored as regular attributes of the module
+# Decay, cross section and fission yield libraries are memory-mapped stores (see onix.data.Lib_store)
 
-default_atm_mass_lib = read_mass_lib(default_atm_mass_lib_path)
-default_decay_lib_b = read_decay_lib(default_decay_b_lib_path)
-default_decay_lib_a = conv_decay_b_a(default_decay_lib_b)
-default_xs_lib = read_xs_lib(default_xs_lib_path)
-default_fy_lib = read_fy_lib(default_fy_lib_path)
+def _load_default_atm_mass_lib():
+    return read_mass_lib(default_atm_mass_lib_path)
+
+def _load_default_decay_lib_b():
+    return get_lib_store(default_decay_b_lib_path, 'decay_b')
+
+def _load_default_decay_lib_a():
+    return get_lib_store(default_decay_b_lib_path, 'decay_a')
+
+def _load_default_xs_lib():
+    return get_lib_store(default_xs_lib_path, 'xs')
+
+def _load_default_fy_lib():
+    return get_lib_store(default_fy_lib_path, 'fy')
+
+_default_lib_loader_dict = {
+    'default_atm_mass_lib': _load_default_atm_mass_lib,
+    'default_decay_lib_b': _load_default_decay_lib_b,
+    'default_decay_lib_a': _load_default_decay_lib_a,
+    'default_xs_lib': _load_default_xs_lib,
+    'default_fy_lib': _load_default_fy_lib,
+}
+
+def __getattr__(name):
+    """Parses a default library the first time it is accessed."""
+
+    if name in globals():
+        return globals()[name]
+
+    if name in _default_lib_loader_dict:
+        lib = _default_lib_loader_dict[name]()
+        globals()[name] = lib
+        return lib
+
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
+
+def __dir__():
+
+    return sorted(list(globals().keys()) + list(_default_lib_loader_dict.keys()))
 
 
 ### Generate the default matrices and nuclide lists
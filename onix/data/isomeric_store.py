@@ -0,0 +1,261 @@
+import os
+import hashlib
+import pickle
+from collections.abc import Mapping
+import numpy as np
+from .read_lib_functions import get_lib_cache_dir
+from .lib_store import _is_lib_store_complete, _load_lib_store, _write_lib_store
+
+### Isomeric branching data
+
+# Point-wise isomeric branching ratios of (n,gamma) reactions from EAF-2010
+_isomeric_data_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'isomeric_data', 'eaf-2010-multiplicities')
+
+# Increase this number when the layout of the store or of the sampled tables changes
+_isomeric_store_version = 1
+
+_isomeric_store_file_list = ['nucl.npy', 'state.npy', 'indptr.npy', 'data.npy']
+
+# Store already opened in this process
+_isomeric_store = None
+
+def read_isomeric_data():
+
+    """Reads the EAF-2010 activation transmutation neutron
+nuclear data library and returns a point-wise isomeric branching dictionnary for (n,gamma) reactions. The keys of the dictionnary are nuclides and entries are isomeric branching subdictionnaries. The keys of these subdictionnaries are the state of the product daughter (ground state or first excited state) and the entries are the corresponding point-wise isomeric branching ratio.
+
+    The returned dictionnary is an onix.data.Isomeric_store: the data are packed once in the library cache folder and the openmc.data.Tabulated1D of a nuclide are only built when the nuclide is accessed.
+    """
+
+    return get_isomeric_store()
+
+def get_isomeric_store():
+
+    """Returns the onix.data.Isomeric_store of the EAF-2010 isomeric branching data.
+
+    The CSV files of the data are packed into flat arrays the first time and saved in the library cache folder (see :func:`set_lib_cache_dir`), where they are memory-mapped
+    by the following runs. The packed arrays are rebuilt if the CSV files are modified. If the library cache is off, the arrays are built in memory.
+    """
+
+    global _isomeric_store
+
+    file_name_list = _get_isomeric_file_name_list()
+    signature = _get_isomeric_signature(file_name_list)
+    if _isomeric_store is not None and _isomeric_store.signature == signature:
+        return _isomeric_store
+
+    cache_dir = get_lib_cache_dir()
+    if cache_dir is None:
+        array_dict = _get_isomeric_store_arrays(file_name_list)
+    else:
+        store_path = os.path.join(cache_dir, 'isomeric_store_v{}_{}'.format(_isomeric_store_version, signature))
+        if not _is_lib_store_complete(store_path, _isomeric_store_file_list):
+            _write_lib_store(store_path, _get_isomeric_store_arrays(file_name_list))
+
+        if _is_lib_store_complete(store_path, _isomeric_store_file_list):
+            array_dict = _load_lib_store(store_path, _isomeric_store_file_list)
+        # The store could not be written, it is kept in memory
+        else:
+            array_dict = _get_isomeric_store_arrays(file_name_list)
+
+    _isomeric_store = Isomeric_store(array_dict, signature)
+
+    return _isomeric_store
+
+def get_sampled_isomeric_branching_data(energy_points):
+
+    """Returns the isomeric branching ratios of all nuclides sampled on a list of energy points. The keys of the returned dictionnary are nuclides and the entries are
+    dictionnaries with the state of the product daughter as keys ('0' or '1') and the sampled branching ratios as entries.
+
+    Sampled tables are saved in the library cache folder under a name built from the hash of the energy points so that later runs with the same energy points skip the sampling.
+
+    Parameters
+    ----------
+    energy_points: list
+        Energy points (eV) on which the branching ratios are sampled
+    """
+
+    energy_points = np.asarray(energy_points, dtype = np.float64)
+    store = get_isomeric_store()
+    cache_dir = get_lib_cache_dir()
+
+    if cache_dir is not None:
+        grid_hash = hashlib.sha1(energy_points.tobytes()).hexdigest()
+        cache_path = os.path.join(cache_dir, 'isomeric_sampled_v{}_{}_{}.pkl'.format(_isomeric_store_version, store.signature, grid_hash))
+        if os.path.isfile(cache_path):
+            try:
+                with open(cache_path, 'rb') as cache_file:
+                    return pickle.load(cache_file)
+            # A truncated or unreadable cache file is simply rebuilt
+            except (OSError, EOFError, pickle.UnpicklingError):
+                pass
+
+    sampled_isomeric_branching_data = {}
+    for nucl in store:
+        nucl_data = store[nucl]
+        sampled_isomeric_branching_data[nucl] = {}
+        sampled_isomeric_branching_data[nucl]['0'] = nucl_data['0'](energy_points)
+        sampled_isomeric_branching_data[nucl]['1'] = nucl_data['1'](energy_points)
+
+    if cache_dir is not None:
+        tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        try:
+            os.makedirs(cache_dir, exist_ok = True)
+            with open(tmp_path, 'wb') as cache_file:
+                pickle.dump(sampled_isomeric_branching_data, cache_file, protocol = pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            print ('\n\n WARNING: could not write the sampled isomeric branching data to the cache folder {} \n\n'.format(cache_dir))
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+
+    return sampled_isomeric_branching_data
+
+def _get_isomeric_file_name_list():
+
+    # onix does not consider branching that goes to 2nd excited state, nor branching from a target in 2nd excited state
+    # (these would otherwise overwrite the data of the ground state target)
+    # Lock files of spreadsheet softwares (ex: .~lock.I129) are also left out
+    file_name_list = []
+    for x in os.listdir(_isomeric_data_path):
+        if 'lock' in x or not x.endswith('.csv'):
+            continue
+        if x.replace('.csv', '').split('_')[1] == '2' or '_2.' in x:
+            continue
+        file_name_list.append(x)
+    file_name_list.sort()
+
+    return file_name_list
+
+def _get_isomeric_signature(file_name_list):
+
+    # The signature only relies on the names, sizes and modification times of the files so that it is cheap to compute at each run
+    hasher = hashlib.sha1()
+    for file_name in file_name_list:
+        file_stat = os.stat(os.path.join(_isomeric_data_path, file_name))
+        hasher.update('{} {} {}\n'.format(file_name, file_stat.st_size, file_stat.st_mtime_ns).encode())
+
+    return hasher.hexdigest()
+
+def _get_isomeric_store_arrays(file_name_list):
+
+    nucl_list = []
+    state_list = []
+    indptr_list = [0]
+    energy_list = []
+    ratio_list = []
+    for file_name in file_name_list:
+        name = file_name.replace('.csv', '')
+        target_name = name.split('_')[0]
+        target_state = name.split('_')[1]
+        daughter_state = name.split('_')[3]
+        if target_state == '1':
+            nucl_name = target_name + '_m1'
+        else:
+            nucl_name = target_name
+
+        with open(os.path.join(_isomeric_data_path, file_name), 'r') as isomeric_file:
+            # The first line is the header
+            next(isomeric_file)
+            for line in isomeric_file:
+                line = line.split(',')
+                energy_list.append(float(line[1]))
+                ratio_list.append(float(line[2]))
+
+        nucl_list.append(nucl_name)
+        state_list.append(daughter_state)
+        indptr_list.append(len(energy_list))
+
+    array_dict = {}
+    array_dict['nucl'] = np.array(nucl_list, dtype = str)
+    array_dict['state'] = np.array(state_list, dtype = str)
+    array_dict['indptr'] = np.array(indptr_list, dtype = np.int64)
+    array_dict['data'] = np.array([energy_list, ratio_list], dtype = np.float64)
+
+    return array_dict
+
+class Isomeric_store(Mapping):
+    """Read-only dictionnary view of the EAF-2010 isomeric branching data packed in flat arrays.
+
+    Each table is a pair (nuclide, daughter state) whose energy points and branching ratios are the columns between indptr[i] and indptr[i+1] of the data array.
+    The store behaves like the dictionnary previously returned by onix.data.read_isomeric_data: its keys are nuclides and its entries are dictionnaries with the daughter
+    state as keys and openmc.data.Tabulated1D as entries. These are only built when a nuclide is accessed.
+
+    Attributes
+    ----------
+    signature: str
+        Hash of the names, sizes and modification times of the CSV files the store has been packed from
+    nucl: numpy.array
+        Nuclide of each table
+    state: numpy.array
+        Daughter state of each table
+    indptr: numpy.array
+        Index of the first point of each table (the last element is the total number of points)
+    data: numpy.array
+        Energy points (first row) and branching ratios (second row)
+
+    Parameters
+    ----------
+    array_dict: dict
+        Arrays of the store
+    signature: str
+        Hash of the CSV files the store has been packed from
+    """
+
+    def __init__(self, array_dict, signature):
+
+        self.signature = signature
+        self.nucl = array_dict['nucl']
+        self.state = array_dict['state']
+        self.indptr = array_dict['indptr']
+        self.data = array_dict['data']
+
+        self._table_index_dict = {}
+        for i, (nucl, state) in enumerate(zip(self.nucl.tolist(), self.state.tolist())):
+            self._table_index_dict.setdefault(nucl, {})[state] = i
+        self._nucl_data_dict = {}
+
+    def __getitem__(self, nucl):
+
+        if nucl in self._nucl_data_dict:
+            return self._nucl_data_dict[nucl]
+
+        # OpenMC is only needed here so it is not imported with the rest of onix.data
+        import openmc
+
+        nucl_data = {}
+        for state, (energy_grid, ratio) in self.get_tables(nucl).items():
+            nucl_data[state] = openmc.data.Tabulated1D(np.array(energy_grid), np.array(ratio))
+        self._nucl_data_dict[nucl] = nucl_data
+
+        return nucl_data
+
+    def __contains__(self, nucl):
+
+        return nucl in self._table_index_dict
+
+    def __iter__(self):
+
+        return iter(self._table_index_dict)
+
+    def __len__(self):
+
+        return len(self._table_index_dict)
+
+    def get_tables(self, nucl):
+
+        """Returns a dictionnary with the daughter states of a nuclide as keys and (energy points, branching ratios) as entries. These are views of the store arrays (no copy).
+
+        Parameters
+        ----------
+        nucl: str
+            Name of the nuclide (ex: 'Am241', 'Ag108_m1')
+        """
+
+        tables = {}
+        for state, i in self._table_index_dict[nucl].items():
+            start = self.indptr[i]
+            end = self.indptr[i+1]
+            tables[state] = (self.data[0, start:end], self.data[1, start:end])
+
+        return tables
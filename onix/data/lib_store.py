@@ -0,0 +1,360 @@
+import os
+import copy
+import shutil
+from collections.abc import Mapping
+import numpy as np
+from .read_lib_functions import conv_decay_b_a, get_lib_cache_dir, _get_lib_hash, _parse_decay_lib, _parse_xs_lib, _parse_fy_lib
+
+### Compiled libraries stores
+
+# Increase this number when the layout of the store files changes
+_lib_store_version = 1
+
+# Library types that can be compiled into a store and the number of values of each entry
+_lib_store_type_dict = {'decay_b':1, 'decay_a':1, 'xs':2, 'fy':2}
+
+# Stores already opened in this process, keyed on the library path and type
+# The file size and modification time are kept to detect a library that has been modified
+_lib_store_dict = {}
+
+_lib_store_file_list = ['zamid.npy', 'indptr.npy', 'stable.npy', 'key.npy', 'key_index.npy', 'value.npy']
+
+def get_lib_store(lib_path, lib_type):
+
+    """Returns the onix.data.Lib_store of a library.
+
+    The library is parsed and compiled into flat arrays only once: the arrays are saved in the library cache folder (see :func:`set_lib_cache_dir`)
+    under a name built from the hash of the library file and are memory-mapped in read-only mode. Within a process, all the calls for the same library
+    return the same store, and the operating system shares the mapped pages of the arrays between processes (the sub-dictionnaries built when nuclides
+    are accessed are specific to each process). If the library cache is off, the store is built in memory.
+
+    **Note**: Library must be compatible with ONIX format.
+
+    Parameters
+    ----------
+    lib_path: str
+        Path to the library
+    lib_type: str
+        'decay_b' (fractionnal decay constants), 'decay_a' (absolute decay constants), 'xs' (cross sections) or 'fy' (fission yields)
+
+    """
+
+    if lib_type not in _lib_store_type_dict:
+        raise Lib_store_type_unknown('Library type {} is unknown, it should be one of {}'.format(lib_type, list(_lib_store_type_dict.keys())))
+
+    lib_path = os.path.abspath(lib_path)
+    lib_stat = os.stat(lib_path)
+    key = (lib_path, lib_type)
+    if key in _lib_store_dict:
+        size, mtime, store = _lib_store_dict[key]
+        if size == lib_stat.st_size and mtime == lib_stat.st_mtime_ns:
+            return store
+
+    cache_dir = get_lib_cache_dir()
+    if cache_dir is None:
+        store = Lib_store(lib_type, _get_lib_store_arrays(lib_path, lib_type), lib_path)
+    else:
+        store_path = os.path.join(cache_dir, '{}_store_v{}_{}'.format(lib_type, _lib_store_version, _get_lib_hash(lib_path)))
+        if not _is_lib_store_complete(store_path, _lib_store_file_list):
+            _write_lib_store(store_path, _get_lib_store_arrays(lib_path, lib_type))
+
+        if _is_lib_store_complete(store_path, _lib_store_file_list):
+            array_dict = _load_lib_store(store_path, _lib_store_file_list)
+        # The store could not be written, it is kept in memory
+        else:
+            array_dict = _get_lib_store_arrays(lib_path, lib_type)
+        store = Lib_store(lib_type, array_dict, lib_path)
+
+    _lib_store_dict[key] = (lib_stat.st_size, lib_stat.st_mtime_ns, store)
+
+    return store
+
+def clear_lib_store_dict():
+
+    """Forgets all the stores opened in this process. The compiled files in the library cache folder are kept.
+    """
+
+    _lib_store_dict.clear()
+
+def _get_lib_store_arrays(lib_path, lib_type):
+
+    # The library is parsed directly: the compiled store is its only cached form
+    if lib_type == 'decay_b':
+        lib = _parse_decay_lib(lib_path)
+    elif lib_type == 'decay_a':
+        lib = conv_decay_b_a(_parse_decay_lib(lib_path))
+    elif lib_type == 'xs':
+        lib = _parse_xs_lib(lib_path)
+    elif lib_type == 'fy':
+        lib = _parse_fy_lib(lib_path)
+
+    zamid_list = []
+    indptr_list = [0]
+    stable_list = []
+    key_dict = {}
+    key_index_list = []
+    value_list = []
+    for zamid in lib:
+        zamid_list.append(zamid)
+        nucl_data = lib[zamid]
+        stable_list.append(nucl_data == 'stable')
+        if nucl_data != 'stable':
+            for key in nucl_data:
+                if key not in key_dict:
+                    key_dict[key] = len(key_dict)
+                key_index_list.append(key_dict[key])
+                value_list.append(nucl_data[key])
+        indptr_list.append(len(key_index_list))
+
+    value_shape = (len(value_list),) if _lib_store_type_dict[lib_type] == 1 else (len(value_list), _lib_store_type_dict[lib_type])
+
+    array_dict = {}
+    array_dict['zamid'] = np.array(zamid_list, dtype = str)
+    array_dict['indptr'] = np.array(indptr_list, dtype = np.int64)
+    array_dict['stable'] = np.array(stable_list, dtype = bool)
+    array_dict['key'] = np.array(list(key_dict.keys()), dtype = str)
+    array_dict['key_index'] = np.array(key_index_list, dtype = np.int32)
+    array_dict['value'] = np.array(value_list, dtype = np.float64).reshape(value_shape)
+
+    return array_dict
+
+def _is_lib_store_complete(store_path, file_list):
+
+    for file_name in file_list:
+        if not os.path.isfile(os.path.join(store_path, file_name)):
+            return False
+
+    return True
+
+def _load_lib_store(store_path, file_list):
+
+    array_dict = {}
+    for file_name in file_list:
+        array_dict[file_name[:-4]] = np.load(os.path.join(store_path, file_name), mmap_mode = 'r')
+
+    return array_dict
+
+def _write_lib_store(store_path, array_dict):
+
+    # The store is written in a temporary folder which is then renamed so that concurrent jobs never map a partial store
+    tmp_path = '{}.{}.tmp'.format(store_path, os.getpid())
+    try:
+        os.makedirs(tmp_path, exist_ok = True)
+        for name in array_dict:
+            np.save(os.path.join(tmp_path, name + '.npy'), array_dict[name])
+        os.rename(tmp_path, store_path)
+    except OSError:
+        # Another process may have written the same store in the meantime
+        if not os.path.isdir(store_path):
+            print ('\n\n WARNING: could not write the compiled library store {} \n\n'.format(store_path))
+        shutil.rmtree(tmp_path, ignore_errors = True)
+
+class Lib_store(Mapping):
+    """Read-only dictionnary view of a nuclear data library stored in flat arrays.
+
+    The data of all nuclides are stored one after the other: the entries of the i-th nuclide are between indptr[i] and indptr[i+1]. Each entry
+    is the index of its key (reaction name or fission parent zamid) in the key array and its value (decay constant) or its value and uncertainty (cross section, fission yield).
+
+    The store behaves like the dictionnary returned by the corresponding library reader: its keys are nuclides' zamid and its entries are the same sub-dictionnaries.
+    Sub-dictionnaries (onix.data.Lib_store_entry) are built from the arrays the first time they are accessed and are then shared by all the users of the store within a process. They must not be modified.
+    Only the arrays are shared between processes: code that reads many nuclides (for example onix.salameche.get_decay_mat_cached) should work on the arrays
+    (see get_nucl_index, get_key_index, get_nucl_arrays and get_value_table) rather than on the sub-dictionnaries.
+
+    Attributes
+    ----------
+    lib_type: str
+        'decay_b', 'decay_a', 'xs' or 'fy'
+    lib_path: str
+        Path to the library the store has been compiled from
+    zamid: numpy.array
+        z-a-m ids of the nuclides
+    indptr: numpy.array
+        Index of the first entry of each nuclide (the last element is the total number of entries)
+    stable: numpy.array
+        True for stable nuclides (decay libraries only)
+    key: numpy.array
+        Reaction names or fission parents zamid
+    key_index: numpy.array
+        Index of the key of each entry
+    value: numpy.array
+        Value of each entry. For cross sections and fission yields, the second column holds the uncertainty
+
+    Parameters
+    ----------
+    lib_type: str
+        'decay_b', 'decay_a', 'xs' or 'fy'
+    array_dict: dict
+        Arrays of the store
+    lib_path: str
+        Path to the library the store has been compiled from
+    """
+
+    def __init__(self, lib_type, array_dict, lib_path):
+
+        self.lib_type = lib_type
+        self.lib_path = lib_path
+        self.zamid = array_dict['zamid']
+        self.indptr = array_dict['indptr']
+        self.stable = array_dict['stable']
+        self.key = array_dict['key']
+        self.key_index = array_dict['key_index']
+        self.value = array_dict['value']
+
+        self._zamid_list = self.zamid.tolist()
+        self._index_dict = {zamid:i for i, zamid in enumerate(self._zamid_list)}
+        self._key_list = self.key.tolist()
+        self._key_index_dict = {key:k for k, key in enumerate(self._key_list)}
+        self._nucl_data_dict = {}
+        self._value_table = None
+
+    def __getitem__(self, zamid):
+
+        if zamid in self._nucl_data_dict:
+            return self._nucl_data_dict[zamid]
+
+        i = self._index_dict[zamid]
+        if self.stable[i]:
+            nucl_data = 'stable'
+        else:
+            key_list = self._key_list
+            start = self.indptr[i]
+            end = self.indptr[i+1]
+            nucl_data = Lib_store_entry(self, i)
+            for key_index, value in zip(self.key_index[start:end].tolist(), self.value[start:end].tolist()):
+                nucl_data[key_list[key_index]] = value
+        self._nucl_data_dict[zamid] = nucl_data
+
+        return nucl_data
+
+    def __contains__(self, zamid):
+
+        return zamid in self._index_dict
+
+    def __iter__(self):
+
+        return iter(self._zamid_list)
+
+    def __len__(self):
+
+        return len(self._zamid_list)
+
+    def get_nucl_arrays(self, zamid):
+
+        """Returns the keys index and the values of the entries of a nuclide as views of the store arrays (no copy).
+
+        Parameters
+        ----------
+        zamid: str
+            z-a-m id of the nuclide
+        """
+
+        i = self._index_dict[zamid]
+        start = self.indptr[i]
+        end = self.indptr[i+1]
+
+        return self.key_index[start:end], self.value[start:end]
+
+    def get_nucl_index(self, zamid_list):
+
+        """Returns the index of each nuclide of a list in the store arrays (-1 for nuclides that are not in the store).
+
+        Parameters
+        ----------
+        zamid_list: list
+            z-a-m ids of the nuclides
+        """
+
+        index_dict = self._index_dict
+
+        return np.array([index_dict.get(zamid, -1) for zamid in zamid_list], dtype = np.int64)
+
+    def get_key_index(self, key):
+
+        """Returns the index of a key (reaction name or fission parent zamid) in the key array (-1 if no entry has this key).
+
+        Parameters
+        ----------
+        key: str
+            Reaction name or fission parent zamid
+        """
+
+        return self._key_index_dict.get(key, -1)
+
+    def get_value_table(self):
+
+        """Returns a 2D array whose element [i, k] is the value of key k for the i-th nuclide of the store, or NaN if the nuclide has no entry with this key.
+        For cross sections and fission yields, the uncertainties are left out. The table is built once per process from the store arrays and must not be modified.
+        """
+
+        if self._value_table is None:
+            value = self.value if self.value.ndim == 1 else self.value[:, 0]
+            row = np.repeat(np.arange(len(self._zamid_list)), np.diff(self.indptr))
+            value_table = np.full((len(self._zamid_list), len(self._key_list)), np.nan)
+            value_table[row, self.key_index] = value
+            value_table.flags.writeable = False
+            self._value_table = value_table
+
+        return self._value_table
+
+    # Copies and unpickled stores (for example in worker processes) point to the store of the process, which maps the same files
+    def __reduce__(self):
+
+        return (get_lib_store, (self.lib_path, self.lib_type))
+
+    def __copy__(self):
+
+        return self
+
+    def __deepcopy__(self, memo):
+
+        return self
+
+class Lib_store_entry(dict):
+    """Sub-dictionnary of a nuclide in a onix.data.Lib_store.
+
+    The entry remembers the store and the index of the nuclide in the store arrays, so that code reading many nuclides can take their values
+    from the arrays (see onix.salameche.Xs_mat_topology). Pickled entries (for example in the passports sent to worker processes) only hold the library path and type
+    and the zamid of the nuclide, and point to the entry of the store of the process. Copies are ordinary dictionnaries that can be modified.
+
+    Attributes
+    ----------
+    store: onix.data.Lib_store
+        Store the entry belongs to
+    index: int
+        Index of the nuclide in the store arrays
+
+    Parameters
+    ----------
+    store: onix.data.Lib_store
+        Store the entry belongs to
+    index: int
+        Index of the nuclide in the store arrays
+    """
+
+    def __init__(self, store, index):
+
+        dict.__init__(self)
+        self.store = store
+        self.index = index
+
+    def __reduce__(self):
+
+        store = self.store
+
+        return (_get_lib_store_entry, (store.lib_path, store.lib_type, store._zamid_list[self.index]))
+
+    def __copy__(self):
+
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+
+        return copy.deepcopy(dict(self), memo)
+
+def _get_lib_store_entry(lib_path, lib_type, zamid):
+
+    return get_lib_store(lib_path, lib_type)[zamid]
+
+class Lib_store_type_unknown(Exception):
+    """Raise when the type of a library store is unknown"""
+    pass
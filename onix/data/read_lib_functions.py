@@ -1,8 +1,83 @@
 import os
 import math as m
+import hashlib
+import itertools
+import pickle
 import numpy as np
 from .list_and_dict import *
-import openmc
+
+### Persistent cache of parsed libraries
+
+# Parsed libraries are pickled in this folder under a name built from the library type and the hash of the library file content.
+# A modified library therefore gets a new hash and is parsed again. Set ONIX_LIB_CACHE_DIR or call set_lib_cache_dir to change it.
+_lib_cache_dir = os.environ.get('ONIX_LIB_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'onix', 'libs'))
+# Increase this number when a parser changes the structure of the dictionnary it returns
+# It is part of the name of the cache files so that files written by older parsers are never read
+_lib_cache_version = 2
+
+def set_lib_cache_dir(cache_dir):
+
+    """Sets the folder where parsed libraries are cached. Setting it to None turns the cache off.
+
+    Parameters
+    ----------
+    cache_dir: str
+        Path to the cache folder
+
+    """
+
+    global _lib_cache_dir
+    _lib_cache_dir = cache_dir
+
+def get_lib_cache_dir():
+
+    """Returns the folder where parsed libraries are cached (None if the cache is off).
+    """
+
+    return _lib_cache_dir
+
+def _get_lib_hash(lib_path):
+
+    hasher = hashlib.sha1()
+    with open(lib_path, 'rb') as lib_file:
+        for chunk in iter(lambda: lib_file.read(1 << 20), b''):
+            hasher.update(chunk)
+
+    return hasher.hexdigest()
+
+def _get_lib_cache_path(lib_path, lib_type):
+
+    return os.path.join(_lib_cache_dir, '{}_v{}_{}.pkl'.format(lib_type, _lib_cache_version, _get_lib_hash(lib_path)))
+
+def _read_lib_cached(lib_path, lib_type, parser):
+
+    if _lib_cache_dir is None:
+        return parser(lib_path)
+
+    cache_path = _get_lib_cache_path(lib_path, lib_type)
+    if os.path.isfile(cache_path):
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                return pickle.load(cache_file)
+        # A truncated or unreadable cache file is simply rebuilt
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+
+    lib = parser(lib_path)
+
+    # The cache is written to a temporary file first and then renamed (atomically) so that concurrent jobs never read a partial file
+    tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+    try:
+        os.makedirs(_lib_cache_dir, exist_ok = True)
+        with open(tmp_path, 'wb') as cache_file:
+            pickle.dump(lib, cache_file, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        print ('\n\n WARNING: could not write the parsed library {} to the cache folder {} \n\n'.format(lib_path, _lib_cache_dir))
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+
+    return lib
 
 def read_mass_lib(mass_lib_path):
 
@@ -10,6 +85,8 @@ def read_mass_lib(mass_lib_path):
 
     **Note**: Library must be compatible with ONIX format.
 
+    The parsed library is cached on disk (see :func:`set_lib_cache_dir`) and reused as long as the library file is unchanged.
+
     Parameters
     ----------
     mass_lib_path: str
@@ -17,20 +94,24 @@ def read_mass_lib(mass_lib_path):
 
     '''
 
+    return _read_lib_cached(mass_lib_path, 'mass', _parse_mass_lib)
+
+def _parse_mass_lib(mass_lib_path):
+
     mass_list = {}
     with open(mass_lib_path, 'r') as atm_mass_file:
-        line = atm_mass_file.readlines()
-        for i in range(40, 3352):
-            if line[i][0] == ' ':
-                nz, na = int(line[i].split()[2]), int(line[i].split()[3])
-            elif line[i][0] == '0':
-                nz, na = int(line[i].split()[3]), int(line[i].split()[4])
+        # Data is located between line 41 and line 3352
+        for l in itertools.islice(atm_mass_file, 40, 3352):
+            l_split = l.split()
+            if l[0] == ' ':
+                nz, na = int(l_split[2]), int(l_split[3])
+            elif l[0] == '0':
+                nz, na = int(l_split[3]), int(l_split[4])
 
             zaid = str(1000*nz + na)
-            _mass = line[i].split()[-3:-1]
+            _mass = l_split[-3:-1]
             # This part is to convert the weird number format of mass.mass12 into a normal format
             mass_deci = _mass[1].replace('.','').replace('#','')
-            #  mass_deci = '{}{}'.format(_mass[1].split('.')[0], _mass[1].split('.')[1])
             mass = float('{}.{}'.format(_mass[0], mass_deci))
             mass_list[zaid] = mass
 
@@ -42,6 +123,8 @@ def read_decay_lib(decay_lib_path):
 
     **Note**: Library must be compatible with ONIX format.
 
+    The parsed library is cached on disk (see :func:`set_lib_cache_dir`) and reused as long as the library file is unchanged.
+
     Parameters
     ----------
     decay_lib_path: str
@@ -49,50 +132,32 @@ def read_decay_lib(decay_lib_path):
 
     '''
 
-    with open(decay_lib_path, 'r') as decay_file:
-        lines = decay_file.readlines()
-        dict_list = {}
+    return _read_lib_cached(decay_lib_path, 'decay', _parse_decay_lib)
 
-        previous_zamid = lines[3].split()[1]
-        new_nuclide = 'yes'
+def _parse_decay_lib(decay_lib_path):
+
+    dict_list = {}
+    zamid = None
+    with open(decay_lib_path, 'r') as decay_file:
         # Data starts at line 4
-        count = 0
-        for i in range(len(lines)-3):
-        #for line in lines[3:]:
-            line = lines[i+3]
-
-            line = line.split()
-
-            # This part check if the new line is about a new nuclide
-            if count != 0:
-                col_1_val = line[0]
-                if col_1_val != previous_zamid:
-                    new_nuclide = 'yes'
-
-
-            if new_nuclide == 'yes':
-                if count != 0:
-                    dict_list[previous_zamid] = data_dict
-                data_dict = {}
-                new_nuclide = 'no'
-                zamid = line[1]
-                previous_zamid = zamid
-                if line[2] == 'stable':
+        for l in itertools.islice(decay_file, 3, None):
+            l_split = l.split()
+            if not l_split:
+                continue
+
+            # Lines of the same nuclide start with its zamid, the first line starts with its name
+            if l_split[0] != zamid:
+                zamid = l_split[1]
+                if l_split[2] == 'stable':
                     data_dict = 'stable'
                 else:
-                    data_dict['half-life'] = float(line[3])
-                    total_decay = m.log(2)/float(line[3])
-                    data_dict['total decay'] = total_decay
-
+                    half_life = float(l_split[3])
+                    data_dict = {}
+                    data_dict['half-life'] = half_life
+                    data_dict['total decay'] = m.log(2)/half_life
+                dict_list[zamid] = data_dict
             else:
-                data_dict[line[1]] = float(line[2])
-
-            # If this is the last line, we need to add the last dictionrary
-            if i == len(lines)-4:
-                dict_list[previous_zamid] = data_dict
-
-
-            count += 1      
+                data_dict[l_split[1]] = float(l_split[2])
 
     return dict_list
 
@@ -225,6 +290,8 @@ def read_xs_lib(xs_lib_path):
 
     **Note**: Library must be compatible with ONIX format.
 
+    The parsed library is cached on disk (see :func:`set_lib_cache_dir`) and reused as long as the library file is unchanged.
+
     Parameters
     ----------
     xs_lib_path: str
@@ -232,59 +299,50 @@ def read_xs_lib(xs_lib_path):
 
     '''
 
+    return _read_lib_cached(xs_lib_path, 'xs', _parse_xs_lib)
+
+def _parse_xs_lib(xs_lib_path):
+
+    xs_dic = {}
+    zamid = None
     with open(xs_lib_path, 'r') as xs_file:
-        line = xs_file.readlines()
-        r = 0
-        xs_dic = {}
-        for l in line:
-            # if r == 0:
-            #     if len(l.split()) > 1 and l.split()[0].split('-')[0] in nuc_name_dic:
-            #         zamid = l.split()[1]
-            #         xs = l.split()[2]
-            #         val = [float(k) for k in l.split()[3:5]]
-            #         removal_val += removal_val + val[0]
-            #         xs_dic[zamid] = {xs:val}
-            #         summ[0] = summ[0] + val[0]
-            #         r = 1
-            # elif r > 0:
-            #     if l.split()[1] == 'removal':
-            #         r = 0
-            #     xs = l.split()[1]
-            #     val = [float(k) for k in l.split()[2:4]]
-            #     xs_dic[zamid][xs] = val
-
-            if len(l.split()) > 1 and l.split()[0].split('-')[0] in nuc_name_dic:
-                zamid = l.split()[1]
-                xs = l.split()[2]
-                val = [float(k) for k in l.split()[3:5]]
-                xs_dic[zamid] = {xs:val}
-                r = 1
-            elif len(l.split()) > 1 and r == 1:
-                xs = l.split()[1]
-                val = [float(k) for k in l.split()[2:4]]
-                xs_dic[zamid][xs] = val
-            else:
-                r=0
-
-    # Add the removal entry and values to the dic
-    for zamid in xs_dic:
-        removal_val = 0
-        for xs in xs_dic[zamid]:
-            removal_val += xs_dic[zamid][xs][0]
-        xs_dic[zamid]['removal'] = [0, 0]
-        xs_dic[zamid]['removal'][0] = removal_val
-
-    # Add the removal uncertainty values to the dic
-    for zamid in xs_dic:
-        removal_unc = 0
-        if xs_dic[zamid]['removal'][0] != 0: # if removal = 0 then no need to go through the following
-            for xs in xs_dic[zamid]:
-                val_weight = xs_dic[zamid][xs][0]/xs_dic[zamid]['removal'][0]
-                removal_unc += xs_dic[zamid][xs][1]*val_weight
-            xs_dic[zamid]['removal'][1] = removal_unc
+        for l in xs_file:
+            l_split = l.split()
+            # First line of a nuclide
+            if len(l_split) > 1 and l_split[0].split('-')[0] in nuc_name_dic:
+                if zamid is not None:
+                    _add_xs_removal(xs_dic[zamid])
+                zamid = l_split[1]
+                xs_dic[zamid] = {l_split[2]:[float(k) for k in l_split[3:5]]}
+            # Following lines of the nuclide
+            elif len(l_split) > 1 and zamid is not None:
+                xs_dic[zamid][l_split[1]] = [float(k) for k in l_split[2:4]]
+            # Any other line closes the nuclide
+            elif zamid is not None:
+                _add_xs_removal(xs_dic[zamid])
+                zamid = None
+
+    if zamid is not None:
+        _add_xs_removal(xs_dic[zamid])
 
     return xs_dic
 
+def _add_xs_removal(nucl_xs_dic):
+
+    # Add the removal entry and values to the nuclide dic
+    removal_val = 0
+    for xs in nucl_xs_dic:
+        removal_val += nucl_xs_dic[xs][0]
+    nucl_xs_dic['removal'] = [removal_val, 0]
+
+    # Add the removal uncertainty values to the nuclide dic
+    if removal_val != 0: # if removal = 0 then no need to go through the following
+        removal_unc = 0
+        for xs in nucl_xs_dic:
+            val_weight = nucl_xs_dic[xs][0]/removal_val
+            removal_unc += nucl_xs_dic[xs][1]*val_weight
+        nucl_xs_dic['removal'][1] = removal_unc
+
 
 def read_fy_lib(fy_lib_path):
 
@@ -292,6 +350,8 @@ def read_fy_lib(fy_lib_path):
 
     **Note**: Library must be compatible with ONIX format.
 
+    The parsed library is cached on disk (see :func:`set_lib_cache_dir`) and reused as long as the library file is unchanged.
+
     Parameters
     ----------
     fy_lib_path: str
@@ -299,37 +359,35 @@ def read_fy_lib(fy_lib_path):
 
     '''
 
+    return _read_lib_cached(fy_lib_path, 'fy', _parse_fy_lib)
 
+def _parse_fy_lib(fy_lib_path):
 
+    fy_dic = {}
     with open(fy_lib_path, 'r') as fy_file:
-        line = fy_file.readlines()
-        r = 0
-        read =  0
-        fy_dic = {}
-        for i in range(0,len(line)):
-            l = line[i]
+        # Skip the actinides and other sections until the fission products yields
+        for l in fy_file:
             if l == '--- Fission Products Yields ---\n':
-                read = 1
-            if read == 1:
-                # This is the first line for the nuclide
-                if r == 0:
-                    if len(l.split()) > 1 and l.split()[0].split('-')[0] in nuc_name_dic:
-                        zamid = l.split()[1]
-                        father_nuc = l.split()[2]
-                        fy = [float(k) for k in l.split()[3:5]]
-                        fy_dic[zamid] = {father_nuc:fy}
-                        r = 1
-                # This is not the first line for the nuclide
-                elif r > 0:
-                    father_nuc = l.split()[1]
-                    fy = [float(k) for k in l.split()[2:4]]
-                    fy_dic[zamid][father_nuc] = fy
-                    # If this the last line of the file, exit of the loop
-                    if i == len(line) - 1:
-                        break
-                    # If next line is a new nuclide and is not empty, reset r to 0
-                    elif len(l.split()) > 1 and line[i+1].split()[0].split('-')[0] in nuc_name_dic:
-                        r = 0
+                break
+
+        # r = 0: looking for the first line of a nuclide
+        # r = 1: the previous line was the first line of a nuclide
+        # r = 2: the previous line was a following line of a nuclide
+        r = 0
+        for l in fy_file:
+            l_split = l.split()
+            # A line starting with a nuclide name closes the current nuclide, unless it comes right after the first line of that nuclide
+            if r == 2 and l_split[0].split('-')[0] in nuc_name_dic:
+                r = 0
+
+            if r == 0:
+                if len(l_split) > 1 and l_split[0].split('-')[0] in nuc_name_dic:
+                    zamid = l_split[1]
+                    fy_dic[zamid] = {l_split[2]:[float(k) for k in l_split[3:5]]}
+                    r = 1
+            else:
+                fy_dic[zamid][l_split[1]] = [float(k) for k in l_split[2:4]]
+                r = 2
 
     return fy_dic
 
@@ -411,52 +469,3 @@ def nucl_list_from_txt(mattxt_path):
         nucl_list.append(zamid)
 
     return nucl_list
-
-# This might not be appropriate to have this function here as it needs OpenMC
-def read_isomeric_data():
-
-    """Reads the EAF-2010 activation transmutation neutron
-nuclear data library and returns a point-wise isomeric branching dictionnary for (n,gamma) reactions. The keys of the dictionnary are nuclides and entries are isomeric branching subdictionnaries. The keys of these subdictionnaries are the state of the product daughter (ground state or first excited state) and the entries are the corresponding point-wise isomeric branching ratio.
-    """
-    # This command will find the absolute path of read_lib_fuctions.py
-    # Since read_lib_fuctions.py is located in data, the default isomeric data is just in __file__path + '/isomeric_data/eaf-2010-multiplicities'
-    __file__path = os.path.abspath(os.path.dirname(__file__))
-
-    isomeric_data_path = __file__path+ '/isomeric_data/eaf-2010-multiplicities'
-
-    # onix does not consider branching that goes to 2nd excited state
-    file_name_list = [x for x in os.listdir(isomeric_data_path) if '_2.' not in x]
-
-    isomeric_branching_dict = {}
-    for file_name in file_name_list:
-        name = file_name.replace('.csv', '')
-        target_name = name.split('_')[0]
-        target_state = name.split('_')[1]
-        daughter_state = name.split('_')[3]
-        if target_state == '1':
-            nucl_name = target_name + '_m1'
-        else:
-            nucl_name = target_name
-        if nucl_name not in isomeric_branching_dict:
-            isomeric_branching_dict[nucl_name] = {}
-        file = open(isomeric_data_path + '/' + file_name, 'r')
-        lines = file.readlines()
-        energy_grid = []
-        data = []
-        for line in lines[1:]:
-            line = line.split(',')
-            energy_grid.append(float(line[1]))
-            data.append(float(line[2]))
-        tabulated_data = openmc.data.Tabulated1D(energy_grid, data)
-        isomeric_branching_dict[nucl_name][daughter_state] = tabulated_data
-    
-    # for some reason some parasitycal element are added to the dict (ex:.~lock.I129)
-    # These lines remove them
-    wrong_entries = []
-    for key in isomeric_branching_dict:
-        if 'lock' in key:
-            wrong_entries.append(key)
-    for key in wrong_entries:
-        del isomeric_branching_dict[key]
-
-    return isomeric_branching_dict
\ No newline at end of file
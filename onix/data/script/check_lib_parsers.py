@@ -0,0 +1,199 @@
+"""Checks that the library parsers of onix.data.read_lib_functions return exactly
+the same dictionnaries as the original line-by-line readers on every library
+shipped with ONIX (same keys, same key order, same values).
+
+The reference readers below are verbatim copies of the readers the parsers
+replaced. Run this script after any edit to the parsers:
+
+    python onix/data/script/check_lib_parsers.py
+
+"""
+
+import os
+import sys
+import math as m
+
+from onix.data.list_and_dict import nuc_name_dic
+from onix.data.read_lib_functions import _parse_mass_lib, _parse_decay_lib, _parse_xs_lib, _parse_fy_lib
+
+data_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+lib_dir_list = ['default_libs', 'other_libs']
+
+
+def ref_read_mass_lib(mass_lib_path):
+
+    mass_list = {}
+    with open(mass_lib_path, 'r') as atm_mass_file:
+        line = atm_mass_file.readlines()
+        for i in range(40, 3352):
+            if line[i][0] == ' ':
+                nz, na = int(line[i].split()[2]), int(line[i].split()[3])
+            elif line[i][0] == '0':
+                nz, na = int(line[i].split()[3]), int(line[i].split()[4])
+
+            zaid = str(1000*nz + na)
+            _mass = line[i].split()[-3:-1]
+            mass_deci = _mass[1].replace('.','').replace('#','')
+            mass = float('{}.{}'.format(_mass[0], mass_deci))
+            mass_list[zaid] = mass
+
+    return mass_list
+
+def ref_read_decay_lib(decay_lib_path):
+
+    with open(decay_lib_path, 'r') as decay_file:
+        lines = decay_file.readlines()
+        dict_list = {}
+
+        previous_zamid = lines[3].split()[1]
+        new_nuclide = 'yes'
+        count = 0
+        for i in range(len(lines)-3):
+            line = lines[i+3]
+
+            line = line.split()
+
+            if count != 0:
+                col_1_val = line[0]
+                if col_1_val != previous_zamid:
+                    new_nuclide = 'yes'
+
+            if new_nuclide == 'yes':
+                if count != 0:
+                    dict_list[previous_zamid] = data_dict
+                data_dict = {}
+                new_nuclide = 'no'
+                zamid = line[1]
+                previous_zamid = zamid
+                if line[2] == 'stable':
+                    data_dict = 'stable'
+                else:
+                    data_dict['half-life'] = float(line[3])
+                    total_decay = m.log(2)/float(line[3])
+                    data_dict['total decay'] = total_decay
+
+            else:
+                data_dict[line[1]] = float(line[2])
+
+            if i == len(lines)-4:
+                dict_list[previous_zamid] = data_dict
+
+            count += 1
+
+    return dict_list
+
+def ref_read_xs_lib(xs_lib_path):
+
+    with open(xs_lib_path, 'r') as xs_file:
+        line = xs_file.readlines()
+        r = 0
+        xs_dic = {}
+        for l in line:
+            if len(l.split()) > 1 and l.split()[0].split('-')[0] in nuc_name_dic:
+                zamid = l.split()[1]
+                xs = l.split()[2]
+                val = [float(k) for k in l.split()[3:5]]
+                xs_dic[zamid] = {xs:val}
+                r = 1
+            elif len(l.split()) > 1 and r == 1:
+                xs = l.split()[1]
+                val = [float(k) for k in l.split()[2:4]]
+                xs_dic[zamid][xs] = val
+            else:
+                r=0
+
+    for zamid in xs_dic:
+        removal_val = 0
+        for xs in xs_dic[zamid]:
+            removal_val += xs_dic[zamid][xs][0]
+        xs_dic[zamid]['removal'] = [0, 0]
+        xs_dic[zamid]['removal'][0] = removal_val
+
+    for zamid in xs_dic:
+        removal_unc = 0
+        if xs_dic[zamid]['removal'][0] != 0:
+            for xs in xs_dic[zamid]:
+                val_weight = xs_dic[zamid][xs][0]/xs_dic[zamid]['removal'][0]
+                removal_unc += xs_dic[zamid][xs][1]*val_weight
+            xs_dic[zamid]['removal'][1] = removal_unc
+
+    return xs_dic
+
+def ref_read_fy_lib(fy_lib_path):
+
+    with open(fy_lib_path, 'r') as fy_file:
+        line = fy_file.readlines()
+        r = 0
+        read =  0
+        fy_dic = {}
+        for i in range(0,len(line)):
+            l = line[i]
+            if l == '--- Fission Products Yields ---\n':
+                read = 1
+            if read == 1:
+                if r == 0:
+                    if len(l.split()) > 1 and l.split()[0].split('-')[0] in nuc_name_dic:
+                        zamid = l.split()[1]
+                        father_nuc = l.split()[2]
+                        fy = [float(k) for k in l.split()[3:5]]
+                        fy_dic[zamid] = {father_nuc:fy}
+                        r = 1
+                elif r > 0:
+                    father_nuc = l.split()[1]
+                    fy = [float(k) for k in l.split()[2:4]]
+                    fy_dic[zamid][father_nuc] = fy
+                    if i == len(line) - 1:
+                        break
+                    elif len(l.split()) > 1 and line[i+1].split()[0].split('-')[0] in nuc_name_dic:
+                        r = 0
+
+    return fy_dic
+
+
+# Library type is read from the file name prefix
+parser_dict = {'mass': (ref_read_mass_lib, _parse_mass_lib),
+               'decay_lib': (ref_read_decay_lib, _parse_decay_lib),
+               'xs_lib': (ref_read_xs_lib, _parse_xs_lib),
+               'fy_': (ref_read_fy_lib, _parse_fy_lib)}
+
+def get_lib_type(lib_name):
+
+    for prefix in parser_dict:
+        if lib_name.startswith(prefix):
+            return prefix
+    return None
+
+def same_dict(dict1, dict2):
+
+    """Compares two library dictionnaries, including key order at every level."""
+
+    if isinstance(dict1, dict) != isinstance(dict2, dict):
+        return False
+    if not isinstance(dict1, dict):
+        return dict1 == dict2
+    if list(dict1.keys()) != list(dict2.keys()):
+        return False
+    return all(same_dict(dict1[key], dict2[key]) for key in dict1)
+
+
+lib_count = 0
+fail_list = []
+for lib_dir in lib_dir_list:
+    for root, dir_list, file_list in os.walk(os.path.join(data_path, lib_dir)):
+        dir_list.sort()
+        for lib_name in sorted(file_list):
+            lib_type = get_lib_type(lib_name)
+            if lib_type is None:
+                continue
+            lib_path = os.path.join(root, lib_name)
+            ref_parser, parser = parser_dict[lib_type]
+            lib_count += 1
+            if same_dict(ref_parser(lib_path), parser(lib_path)):
+                print ('{:<70} identical'.format(os.path.relpath(lib_path, data_path)))
+            else:
+                print ('{:<70} DIFFERENT'.format(os.path.relpath(lib_path, data_path)))
+                fail_list.append(lib_path)
+
+print ('\n{} libraries checked, {} different'.format(lib_count, len(fail_list)))
+if fail_list:
+    sys.exit(1)
@@ -212,20 +212,20 @@ class Input(object):
 					lib_dict['decay_b'] = data.default_decay_lib_b
 					lib_dict['decay_a'] = data.default_decay_lib_a
 				else:
-					lib_dict['decay_b'] = data.read_decay_lib(lib_path_dict[lib])
-					lib_dict['decay_a'] = data.conv_decay_b_a(lib_dict['decay_b'])
+					lib_dict['decay_b'] = data.get_lib_store(lib_path_dict[lib], 'decay_b')
+					lib_dict['decay_a'] = data.get_lib_store(lib_path_dict[lib], 'decay_a')
 
 			if lib == 'xs':
 				if lib_path_dict[lib] == 'default':
 					lib_dict[lib] = data.default_xs_lib
 				else:
-					lib_dict[lib] = data.read_xs_lib(lib_path_dict[lib])
+					lib_dict[lib] = data.get_lib_store(lib_path_dict[lib], 'xs')
 
 			if lib == 'fy':
 				if lib_path_dict[lib] == 'default':
 					lib_dict[lib] = data.default_fy_lib
 				else:
-					lib_dict[lib] = data.read_fy_lib(lib_path_dict[lib])
+					lib_dict[lib] = data.get_lib_store(lib_path_dict[lib], 'fy')
 
 		return lib_dict
 
@@ -8,6 +8,7 @@ import math as m
 import numpy as np
 import os
 import operator
+import copy
 
 class Passlist(object):
 
@@ -27,6 +28,44 @@ class Passlist(object):
 
         self._nucl_list = None
         self._passport_list = None
+        # Positions of the terms of the cross section matrix, built by onix.salameche.get_xs_mat
+        self._xs_mat_topology = None
+        # Reaction rate terms used to rank reactions, built by onix.salameche.get_reaction_rate_topology
+        self._reaction_rate_topology = None
+        # Creation tree mask of the density vector used by onix.salameche.CRAM_reality_check
+        self._leaves_mask = None
+
+        # zamid, name and index dictionnaries of the passports list, kept up to date by the passlist
+        self._zamid_passport_dict = None
+        self._name_passport_dict = None
+        self._index_dict = None
+
+        # Increased each time the passports list is ordered or extended
+        self._passport_list_version = 0
+
+        # Densities of all the passports stored in contiguous arrays ordered after the passports list at version _dens_version
+        # _dens_vect holds the current densities. Row s of _dens_seq_mat holds the densities at macrostep point s and the rows of
+        # _dens_subseq_mat hold the densities at the microstep points of all macrosteps one after the other, the micro sequence
+        # number s starting at row _dens_subseq_start_list[s]. The history arrays have more rows than the points stored
+        # (_dens_seq_length and _dens_subseq_length) and are reallocated with twice as many rows when they are full
+        # _dens_seq_count and _dens_subseq_count hold the number of points stored for each passport, which only differ
+        # from the number of points of the passlist while the passports are appended one by one
+        self._dens_vect = None
+        self._dens_seq_mat = None
+        self._dens_seq_length = 0
+        self._dens_seq_count = None
+        self._dens_subseq_mat = None
+        self._dens_subseq_length = 0
+        self._dens_subseq_start_list = None
+        self._dens_subseq_count = None
+        self._dens_version = None
+
+        # Fission energy times fission cross section of each passport, reset when cross sections change
+        self._fission_energy_xs_vect = None
+
+        # Increased each time the cross sections of a passport change, the cross section values loaded in
+        # the topologies are reloaded when it differs from the version they have been loaded at
+        self._xs_version = 0
 
         if nucl_list:
 
@@ -43,6 +82,7 @@ class Passlist(object):
             self._set_mass(passport_list)
             self.zam_order_passport_list()
             self._set_zero_dens(passport_list)
+            self._bind_dens()
 
     @property
     def nucl_list(self):
@@ -58,49 +98,58 @@ class Passlist(object):
 
         
     def _get_zamid_passport_dict(self):
-        """Convert the list of Passport objects into a dictionnary of Passport objects where keys are the zamid of the nuclides and entries are Passport objects."""
+        """Returns a dictionnary of Passport objects where keys are the zamid of the nuclides and entries are Passport objects.
 
-        passport_list = self.passport_list
-
-        passport_dict = {}
-        for i in passport_list:
-            zamid = i.zamid
-            passport_dict[zamid] = i
+        The dictionnary is kept by the passlist and must not be modified."""
 
-        return passport_dict
+        self._check_passport_maps()
+        return self._zamid_passport_dict
 
     def _get_name_passport_dict(self):
-        """Convert the list of passport into a dictionnary of passports where entries are the zamid of the nuclides."""
+        """Returns a dictionnary of Passport objects where keys are the names of the nuclides and entries are Passport objects.
+
+        The dictionnary is kept by the passlist and must not be modified."""
+
+        self._check_passport_maps()
+        return self._name_passport_dict
+
+    def _set_passport_maps(self):
+        """Builds the zamid, name and index dictionnaries of the passports list."""
 
         passport_list = self.passport_list
+        if passport_list is None:
+            passport_list = []
 
-        passport_dict = {}
-        for i in passport_list:
-            name = i.name
-            passport_dict[name] = i
+        self._zamid_passport_dict = {}
+        self._name_passport_dict = {}
+        self._index_dict = {}
+        for nuc_pass in passport_list:
+            self._add_to_passport_maps(nuc_pass)
+        self._passport_list_version += 1
+
+    def _add_to_passport_maps(self, nuc_pass):
+        """Adds a passport appended at the end of the passports list to the zamid, name and index dictionnaries."""
+
+        zamid = nuc_pass.zamid
+        self._index_dict[zamid] = len(self._index_dict)
+        self._zamid_passport_dict[zamid] = nuc_pass
+        self._name_passport_dict[nuc_pass.name] = nuc_pass
 
-        return passport_dict
+    def _check_passport_maps(self):
+        """Builds the zamid, name and index dictionnaries if they have not been built yet or if passports have been added to the list without going through the passlist."""
+
+        passport_list = self.passport_list
+        passport_number = 0 if passport_list is None else len(passport_list)
+        if self._index_dict is None or len(self._index_dict) != passport_number:
+            self._set_passport_maps()
 
     def azm_order_passport_list(self):
         """Orders the list of Passport objects after mass number first and then atomic number.
         """
         passport_list = self.passport_list
         print('AZM ORDER CALLED')
-        changed = True
-        while changed:
-            changed = False
-            for i in range(len(passport_list) - 1):
-                a0 = passport_list[i].get_a
-                a1 = passport_list[i+1].get_a
-                z0 = passport_list[i].get_z
-                z1 = passport_list[i+1].get_z
-                state0 = passport_list[i].get_state()
-                state1 = passport_list[i+1].get_state()
-                azm0 = 1000*a0 + 10*z0 + state0
-                azm1 = 1000*a1 + 10*z1 + state1
-                if azm0 > azm1:
-                    passport_list[i], passport_list[i+1] = passport_list[i+1], passport_list[i]
-                    changed = True
+        passport_list.sort(key = lambda pp: 1000*pp.get_a + 10*pp.get_z + pp.state)
+        self._set_passport_maps()
         return None
 
 
@@ -108,55 +157,24 @@ class Passlist(object):
         """Orders the list of Passport objects after atomic number first and then mass number.
         """
         passport_list = self.passport_list
-        changed = True
-        while changed:
-            changed = False
-            for i in range(len(passport_list) - 1):
-                passp0 = passport_list[i]
-                passp1 = passport_list[i+1]
-                zamid0 = int(passp0.zamid)
-                zamid1 = int(passp1.zamid)
-
-                if zamid0 > zamid1:
-                    passport_list[i], passport_list[i+1] = passport_list[i+1], passport_list[i]
-                    changed = True
+        passport_list.sort(key = lambda pp: pp.zam)
+        self._set_passport_maps()
         return None
 
 
-    # def qsort(inlist):
-    #     passport_list = self.passport_list
-    #     if inlist == []: 
-    #         return []
-    #     else:
-    #         pivot = inlist[0]
-    #         lesser = qsort([x for x in inlist[1:] if x < pivot])
-    #         greater = qsort([x for x in inlist[1:] if x >= pivot])
-    #         return lesser + [pivot] + greater
-
-
     def zam_order_passport_list_2(self):
         """Orders the list of Passport objects after atomic number first and then mass number with Python list.sort() method.
         """
-        passport_list = self.passport_list
-        #passport_list = sorted(passport_list, key = lambda pp: int(pp.zamid))
-        passport_list.sort(key = lambda pp: int(pp.zamid))
-
-        #return ordered_passport_list
+        self.zam_order_passport_list()
 
 
     def get_index_dict(self):
         """Returns a dictionnary where keys are z-a-m id of nuclides and entries are the index of their Passport in the Passport list.
-        """
-        passport_list = self.passport_list
-
-        index_dict = {}
 
-        index = 0
-        for i in passport_list:
-            index_dict[i.zamid] = index
-            index = index + 1
-
-        return index_dict
+        The dictionnary is kept by the passlist and updated when the list is ordered or extended. It must not be modified.
+        """
+        self._check_passport_maps()
+        return self._index_dict
 
     def _add_nucl_list(self, nucl_list):
 
@@ -170,9 +188,13 @@ class Passlist(object):
         new_extra_passport_list = self.create_passport_list(new_extra_nuclides)
         self._set_mass(new_extra_passport_list)
         self._set_zero_dens(new_extra_passport_list)
+        self._check_passport_maps()
         for nucl_pass in new_extra_passport_list:
             self.passport_list.append(nucl_pass)
             self.nucl_list.append(nucl_pass.zamid)
+            self._add_to_passport_maps(nucl_pass)
+        self._passport_list_version += 1
+        self._bind_dens()
 
     def create_passport_list(self, nucl_list):
         """Create a Passport objects list after a provided list of nuclides.
@@ -269,6 +291,10 @@ class Passlist(object):
                 fy = fy_dict[zamid]
                 nuc_pass.fy = fy
 
+        # Only the yield matrix of the cross section matrix topology needs to be built again
+        if self._xs_mat_topology is not None:
+            self._xs_mat_topology._set_yield_mat(self)
+
     def _set_initial_dens(self, dens_dict):
 
         sample_key = list(dens_dict.keys())[0]
@@ -298,6 +324,289 @@ class Passlist(object):
 
         for nucl in passport_list:
             nucl._set_initial_dens(0.0)
+
+    def _bind_dens(self):
+        """Gathers the densities of the passports into the density arrays of the passlist.
+
+        The arrays are rebuilt in the order of the passports list. Each passport is then bound to the passlist and reads and writes its densities at its position in the arrays. Passports that were not bound to this passlist bring their own density history, aligned on the most recent point."""
+
+        passport_list = self.passport_list
+        if passport_list is None:
+            return None
+
+        N = len(passport_list)
+        bound_index = [i for i in range(N) if passport_list[i]._dens_store is self]
+        unbound_index = [i for i in range(N) if passport_list[i]._dens_store is not self]
+
+        if bound_index:
+            seq_length = self._dens_seq_length
+            subseq_length_list = [end - start for start, end in self._get_dens_subseq_range_list()]
+        elif unbound_index:
+            sample_pass = passport_list[unbound_index[0]]
+            seq_length = len(sample_pass.dens_seq)
+            subseq_length_list = [len(dens_subseq) for dens_subseq in sample_pass.dens_subseq_mat]
+        else:
+            seq_length = 0
+            subseq_length_list = []
+
+        subseq_start_list = [int(x) for x in np.cumsum([0] + subseq_length_list[:-1])] if subseq_length_list else []
+        subseq_length = sum(subseq_length_list)
+
+        dens_vect = np.zeros(N)
+        dens_seq_mat = np.zeros((max(seq_length, 1), N))
+        dens_subseq_mat = np.zeros((max(subseq_length, 1), N))
+
+        if bound_index:
+            new_index = np.array(bound_index)
+            old_index = np.array([passport_list[i]._dens_index for i in bound_index])
+            dens_vect[new_index] = self._dens_vect[old_index]
+            dens_seq_mat[:seq_length, new_index] = self._dens_seq_mat[:seq_length, old_index]
+            dens_subseq_mat[:subseq_length, new_index] = self._dens_subseq_mat[:subseq_length, old_index]
+
+        for i in unbound_index:
+            nuc_pass = passport_list[i]
+            dens_vect[i] = nuc_pass.current_dens
+            _fill_dens_history(dens_seq_mat[:seq_length, i], nuc_pass.dens_seq)
+            for start, length, dens_subseq in zip(reversed(subseq_start_list), reversed(subseq_length_list), reversed(nuc_pass.dens_subseq_mat)):
+                _fill_dens_history(dens_subseq_mat[start:start + length, i], dens_subseq)
+
+        self._dens_vect = dens_vect
+        self._dens_seq_mat = dens_seq_mat
+        self._dens_seq_length = seq_length
+        self._dens_seq_count = np.full(N, seq_length)
+        self._dens_subseq_mat = dens_subseq_mat
+        self._dens_subseq_length = subseq_length
+        self._dens_subseq_start_list = subseq_start_list
+        self._dens_subseq_count = np.full(N, subseq_length)
+        self._dens_version = self._passport_list_version
+        self._fission_energy_xs_vect = None
+        self._xs_version += 1
+
+        for i in range(N):
+            nuc_pass = passport_list[i]
+            nuc_pass._dens_store = self
+            nuc_pass._dens_index = i
+
+    def _reset_dens_history(self):
+        """Forgets the macro and micro sequences of densities. Only the current densities are kept."""
+
+        self._check_dens_binding()
+        N = len(self._dens_vect)
+        self._dens_seq_mat = np.zeros((1, N))
+        self._dens_seq_length = 0
+        self._dens_seq_count = np.zeros(N, dtype = int)
+        self._dens_subseq_mat = np.zeros((1, N))
+        self._dens_subseq_length = 0
+        self._dens_subseq_start_list = []
+        self._dens_subseq_count = np.zeros(N, dtype = int)
+
+    def _get_process_copy(self):
+        """Returns a copy of the passlist to be sent to a worker process (see onix.salameche.Burn_process_pool).
+
+        The passports are copied without their density and cross section histories and without their reaction rates, and are bound to the copy, whose density arrays only hold the current densities.
+        Nuclear data and topologies are shared with the passlist."""
+
+        self._check_dens_binding()
+        process_passlist = copy.copy(self)
+        process_passport_list = []
+        for nuc_pass in self.passport_list:
+            process_pass = copy.copy(nuc_pass)
+            process_pass._xs_seq = None
+            process_pass._destruction_dic = None
+            process_pass._creation_dic = None
+            process_pass._allreacs_dic = None
+            process_pass._allreacs_dic_list = []
+            process_pass._current_sorted_allreacs_tuple_list = None
+            process_pass._sorted_allreacs_tuple_mat = []
+            process_pass._dens_store = process_passlist
+            process_passport_list.append(process_pass)
+
+        process_passlist._passport_list = process_passport_list
+        process_passlist._set_passport_maps()
+        process_passlist._dens_vect = self._dens_vect.copy()
+        process_passlist._dens_version = process_passlist._passport_list_version
+        process_passlist._reset_dens_history()
+
+        return process_passlist
+
+    def _check_dens_binding(self):
+        """Rebuilds the density arrays if the passports list has been ordered or extended since they were built.
+
+        Only the version of the passports list is compared. Passports appended to the list without going through the passlist are detected
+        from the length of the list (see onix.Passlist._check_passport_maps), but the list must only be reordered with the ordering methods of the passlist."""
+
+        self._check_passport_maps()
+        if self._dens_version != self._passport_list_version:
+            self._bind_dens()
+
+    def get_dens_vect(self):
+        """Returns the current densities of the nuclides as a numpy array ordered after the passports list."""
+
+        self._check_dens_binding()
+        return self._dens_vect.copy()
+
+    def get_dens_seq_mat(self):
+        """Returns the macro sequence of densities as a 2D numpy array. Row s holds the densities of all nuclides at macrostep point s.
+
+        The array is a view of the density history of the passlist (no copy): it does not include the points appended later."""
+
+        self._check_dens_binding()
+        return self._dens_seq_mat[:self._dens_seq_length]
+
+    def get_dens_subseq_mat(self, s):
+        """Returns the micro sequence of densities number s as a 2D numpy array. Row ss holds the densities of all nuclides at microstep point ss.
+
+        The array is a view of the density history of the passlist (no copy): it does not include the points appended later."""
+
+        self._check_dens_binding()
+        start, end = self._get_dens_subseq_range(s)
+        return self._dens_subseq_mat[start:end]
+
+    def _get_dens_subseq_range(self, s):
+        """Returns the first row and the row after the last one of the micro sequence number s in the micro sequence array."""
+
+        start_list = self._dens_subseq_start_list
+        if s < 0:
+            s += len(start_list)
+        if s < 0 or s >= len(start_list):
+            raise IndexError('Micro sequence {} is not stored, the passlist stores {} micro sequences'.format(s, len(start_list)))
+        end = start_list[s+1] if s+1 < len(start_list) else self._dens_subseq_length
+
+        return start_list[s], end
+
+    def _get_dens_subseq_range_list(self):
+        """Returns the first row and the row after the last one of each micro sequence in the micro sequence array."""
+
+        return [self._get_dens_subseq_range(s) for s in range(len(self._dens_subseq_start_list))]
+
+    def _get_dens_seq_view(self, nuc_pass):
+        """Returns the macro sequence of densities of a passport of the passlist as a view of the macro sequence array."""
+
+        self._check_dens_binding()
+        i = nuc_pass._dens_index
+        return self._dens_seq_mat[:self._dens_seq_count[i], i]
+
+    def _get_dens_subseq_view(self, nuc_pass, s):
+        """Returns the micro sequence of densities number s of a passport of the passlist as a view of the micro sequence array."""
+
+        self._check_dens_binding()
+        i = nuc_pass._dens_index
+        start, end = self._get_dens_subseq_range(s)
+        return self._dens_subseq_mat[start:min(end, self._dens_subseq_count[i]), i]
+
+    def _get_dens_subseq_number(self):
+        """Returns the number of micro sequences stored."""
+
+        self._check_dens_binding()
+        return len(self._dens_subseq_start_list)
+
+    def _set_dens_history(self, nuc_pass, dens):
+        """Sets the current density and the whole density history of a passport of the passlist to dens."""
+
+        self._check_dens_binding()
+        i = nuc_pass._dens_index
+        self._dens_vect[i] = dens
+        self._dens_seq_mat[:self._dens_seq_length, i] = dens
+        self._dens_subseq_mat[:self._dens_subseq_length, i] = dens
+
+    def get_fission_energy_xs_vect(self):
+        """Returns the fission energy (MeV) times the current fission cross section (barn) of each nuclide as a numpy array ordered after the passports list.
+
+        Nuclides without fission energy or fission cross section have a zero entry. The array is computed once and kept until the cross sections
+        or fission energies of the passports change. It must not be modified.
+        """
+
+        self._check_dens_binding()
+        if self._fission_energy_xs_vect is None:
+            passport_list = self.passport_list
+            fission_energy_xs_vect = np.zeros(len(passport_list))
+            for i in range(len(passport_list)):
+                nuc_pass = passport_list[i]
+                if nuc_pass.fission_E != None and nuc_pass.current_xs != None:
+                    if 'fission' in nuc_pass.current_xs:
+                        fission_energy_xs_vect[i] = nuc_pass.current_xs['fission'][0]*nuc_pass.fission_E
+            self._fission_energy_xs_vect = fission_energy_xs_vect
+
+        return self._fission_energy_xs_vect
+
+    def get_fission_energy_rate(self, dens_vect = None):
+        """Returns the fission energy rate per unit flux (MeV barn cm-3 10+24), i.e. the sum over nuclides of fission energy times fission cross section times density.
+
+        Parameters
+        ----------
+        dens_vect: numpy.ndarray
+            (Optional) Densities ordered after the passports list. If None, the current densities of the passlist are used
+        """
+
+        fission_energy_xs_vect = self.get_fission_energy_xs_vect()
+        if dens_vect is None:
+            dens_vect = self._dens_vect
+
+        return np.dot(fission_energy_xs_vect, dens_vect)
+
+    def _set_step_dens(self):
+        """Appends the current densities of all the nuclides to the macro sequence of densities."""
+
+        self._check_dens_binding()
+        row = self._dens_seq_length
+        self._dens_seq_mat = _grow_dens_history(self._dens_seq_mat, row)
+        self._dens_seq_mat[row] = self._dens_vect
+        self._dens_seq_length = row + 1
+        self._dens_seq_count[:] = row + 1
+
+    def _set_substep_dens(self, N, ss):
+        """Sets the current densities of all the nuclides to N and appends N to the micro sequence of densities.
+
+        If this is the first micro step, creates a new micro sequence.
+
+        Parameters
+        ----------
+        N: numpy.ndarray
+            Densities ordered after the passports list
+        ss: int
+            Microstep number
+        """
+
+        self._check_dens_binding()
+        row = self._dens_subseq_length
+        if ss == 0:
+            self._dens_subseq_start_list.append(row)
+        self._dens_subseq_mat = _grow_dens_history(self._dens_subseq_mat, row)
+        self._dens_vect[:] = N
+        self._dens_subseq_mat[row] = self._dens_vect
+        self._dens_subseq_length = row + 1
+        self._dens_subseq_count[:] = row + 1
+
+    def _append_dens_seq_entry(self, nuc_pass, dens):
+        """Appends a density to the macro sequence of a single passport of the passlist.
+
+        The macro sequence array is shared by all the passports: the row written is the next one for this passport, so that passports appended
+        one after the other fill the same row. Used by onix.Passport._append_dens_seq."""
+
+        self._check_dens_binding()
+        i = nuc_pass._dens_index
+        row = self._dens_seq_count[i]
+        self._dens_seq_mat = _grow_dens_history(self._dens_seq_mat, row)
+        self._dens_seq_mat[row, i] = dens
+        self._dens_seq_count[i] = row + 1
+        self._dens_seq_length = max(self._dens_seq_length, row + 1)
+
+    def _append_dens_subseq_entry(self, nuc_pass, dens, ss):
+        """Appends a density to the micro sequence of a single passport of the passlist. If ss is 0, a new micro sequence is started.
+
+        As for onix.Passlist._append_dens_seq_entry, the row written is the next one for this passport. Used by onix.Passport._append_dens_subseq_mat."""
+
+        self._check_dens_binding()
+        i = nuc_pass._dens_index
+        row = self._dens_subseq_count[i]
+        start_list = self._dens_subseq_start_list
+        # The micro sequence is only started by the first passport that reaches it
+        if ss == 0 and (not start_list or start_list[-1] < row):
+            start_list.append(row)
+        self._dens_subseq_mat = _grow_dens_history(self._dens_subseq_mat, row)
+        self._dens_subseq_mat[row, i] = dens
+        self._dens_subseq_count[i] = row + 1
+        self._dens_subseq_length = max(self._dens_subseq_length, row + 1)
         
 
 
@@ -383,6 +692,23 @@ class Passlist(object):
 
 
 
+def _fill_dens_history(history, dens_list):
+    """Writes the history dens_list in the array history, aligned on the most recent point."""
+
+    n = min(len(history), len(dens_list))
+    if n > 0:
+        history[len(history) - n:] = dens_list[len(dens_list) - n:]
+
+def _grow_dens_history(history, row):
+    """Returns the density history array, reallocated with twice as many rows if row is beyond its last row."""
+
+    if row < len(history):
+        return history
+    new_history = np.zeros((2*len(history), history.shape[1]))
+    new_history[:len(history)] = history
+
+    return new_history
+
 class Nuc_xs_not_found(Exception):
     """Raise when the user requests a cross-sections of a nuclide that is not in the nuclide set """
     pass
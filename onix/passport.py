@@ -4,6 +4,152 @@ import math as m
 from . import data as d
 from .utils import functions as fct
 
+# Reaction topology of each nuclide, keyed on the integer z-a-m id
+# Built once per process and shared by all the passports of a nuclide
+_reaction_topology_dict = {}
+
+# Merged reaction dictionaries for each excitation state, built once per process
+_prod_dic_dict = {}
+
+def get_reaction_topology(zamid):
+    """Returns the onix.Reaction_topology of a nuclide. It is built the first time it is requested and then shared by all the passports of the nuclide.
+
+    Parameters
+    ----------
+    zamid: str or int
+        z-a-m id of the nuclide
+    """
+
+    zamid = int(zamid)
+    if zamid not in _reaction_topology_dict:
+        _reaction_topology_dict[zamid] = Reaction_topology(zamid)
+
+    return _reaction_topology_dict[zamid]
+
+def _get_prod_dic(prod_type, state):
+    """Returns the dictionary of operations on the z-a-m id that give the daughters (prod_type 'xs_from' or 'decay_from') or the parents
+    (prod_type 'xs_to' or 'decay_to') of a nuclide in the given excitation state."""
+
+    key = (prod_type, state)
+    if key not in _prod_dic_dict:
+        if prod_type == 'xs_from':
+            dic_list = [d.xs_prod_fromS_toS, d.xs_prod_fromS_toX] if state == 0 else [d.xs_prod_fromX_toS, d.xs_prod_fromX_toX]
+        elif prod_type == 'decay_from':
+            dic_list = [d.decay_prod_fromS_toS, d.decay_prod_fromS_toX] if state == 0 else [d.decay_prod_fromX_toS, d.decay_prod_fromX_toX]
+        elif prod_type == 'xs_to':
+            dic_list = [d.xs_prod_fromS_toS, d.xs_prod_fromX_toS] if state == 0 else [d.xs_prod_fromS_toX, d.xs_prod_fromX_toX]
+        elif prod_type == 'decay_to':
+            dic_list = [d.decay_prod_fromS_toS, d.decay_prod_fromX_toS] if state == 0 else [d.decay_prod_fromS_toX, d.decay_prod_fromX_toX]
+        prod_dic = dic_list[0].copy()
+        prod_dic.update(dic_list[1])
+        _prod_dic_dict[key] = prod_dic
+
+    return _prod_dic_dict[key]
+
+class Reaction_topology(object):
+    """Reaction_topology stores the parents and daughters of a nuclide via neutron-induced and decay reactions.
+
+    These only depend on the z-a-m id of the nuclide. A single object is built per nuclide and per process with onix.get_reaction_topology and is
+    referenced by all the passports of this nuclide. Its dictionnaries and lists must therefore not be modified.
+
+    Parameters
+    ----------
+    zamid: int
+        z-a-m id of the nuclide
+    """
+
+    __slots__ = ['zamid', 'xs_child', 'decay_child', 'xs_parent', 'decay_parent', 'all_parent', 'all_child']
+
+    def __init__(self, zamid):
+
+        self.zamid = zamid
+        state = zamid % 10
+
+        # Daughters via neutron-induced reactions
+        xs_prod_from_dic = _get_prod_dic('xs_from', state)
+        xs_child = {}
+        for i in xs_prod_from_dic:
+
+            # If nuclide is Li6 or Be10, add children from (n,t)
+            # (n,t) rxn rate only tallied for Li6 and Be10
+            if i == '(n,t)':
+                if zamid in [30060, 50100]:
+                    # In the case of (n,t) (and (n,alpha) as well), the reaction creates two new nuclides
+                    # The reaction is thus branched out in two new reactions:
+                    # 1) (n,x) which creates nuclides according to xs_prod_from_dic
+                    # 2) (n,x)x which creates x, which is the particle emitted (tritium or alpha)
+                    xs_child['(n,t)t'] = '10030'
+
+                elif zamid not in [30060, 50100]:
+                    continue
+
+                # Note that after that, Li6 and Be10 are still being added the other child from (n,t), as below
+
+            child_zamid = zamid + 10000*xs_prod_from_dic[i][0]+ 10*xs_prod_from_dic[i][1] + xs_prod_from_dic[i][2]
+            xs_child[i] = str(child_zamid)
+
+        # Daughters via decay reactions
+        decay_prod_from_dic = _get_prod_dic('decay_from', state)
+        decay_child = {}
+        for i in decay_prod_from_dic:
+            child_zamid = zamid + 10000*decay_prod_from_dic[i][0]+ 10*decay_prod_from_dic[i][1] + decay_prod_from_dic[i][2]
+            decay_child[i] = str(child_zamid)
+
+        # Parents via neutron-induced reactions
+        xs_prod_to_dic = _get_prod_dic('xs_to', state)
+        xs_parent = {}
+        for i in xs_prod_to_dic:
+
+            if i == '(n,t)':
+
+                # If nuclide is not a possible children of (n,t) reaction of Li6 or Be10
+                # Skip
+                if zamid not in [10030,20040, 30070]:
+                    continue
+
+                # In the case of tritium itself, the nuclide has two parents from the same type
+                # of reaction (Li6 and Be10 from (n,t))
+                # Therefore, we branched out this channel into two new channels
+                # Note that ONIX should not try to find a parent for tritium through xs_prod_to_dic in this case
+                # It would track back to Helium5 (He5 +n = H3 + H3)), which itself has no (n,t) reaction allocated
+                if zamid == 10030:
+                    xs_parent['Li6(n,t)'] = '30060'
+                    xs_parent['Be10(n,t)'] = '50100'
+                    continue
+
+                # This leaves us with only He4 and Li7 who are the products of Li6 (n,t) and Be10 (n,t) respectively
+                # For these two nuclides, ONIX finds the parents through xs_prod_to_dict as below
+
+            parent_zamid = zamid - 10000*xs_prod_to_dic[i][0]- 10*xs_prod_to_dic[i][1] - xs_prod_to_dic[i][2]
+            xs_parent[i] = str(parent_zamid)
+
+        # Parents via decay reactions
+        decay_prod_to_dic = _get_prod_dic('decay_to', state)
+        decay_parent = {}
+        for i in decay_prod_to_dic:
+            parent_zamid = zamid - 10000*decay_prod_to_dic[i][0]- 10*decay_prod_to_dic[i][1] - decay_prod_to_dic[i][2]
+            decay_parent[i] = str(parent_zamid)
+
+        self.xs_child = xs_child
+        self.decay_child = decay_child
+        self.xs_parent = xs_parent
+        self.decay_parent = decay_parent
+        self.all_parent = list(xs_parent.values()) + list(decay_parent.values())
+        self.all_child = list(xs_child.values()) + list(decay_child.values())
+
+    # Copies and unpickled objects (for example BUCells sent back by worker processes) point to the shared object of the process
+    def __reduce__(self):
+
+        return (get_reaction_topology, (self.zamid,))
+
+    def __copy__(self):
+
+        return self
+
+    def __deepcopy__(self, memo):
+
+        return self
+
 class Passport(object):
     """Passport stores all the relevant data of indivudual nuclides and offers methods to extract information on them.
 
@@ -25,6 +171,7 @@ class Passport(object):
 
     _name = None
     _zamid = None
+    _zam = None
 
     #_allreacs_dic_list = [] # A list of dicts of all the creation and destruction terms at eacch sequence point
 
@@ -39,15 +186,13 @@ class Passport(object):
         elif self._get_id_input_type(nuc_id) == 'zamid':
             self._zamid = self.nuc_id
             self._name = fct.zamid_to_name(self._zamid)
+        # Integer z-a-m id used to sort and compare passports
+        self._zam = fct.zamid_to_zam(self._zamid)
 
         self._set_state()
 
-        self._set_xschild()
-        self._set_decaychild()
-        self._set_xsparent()
-        self._set_decayparent()
-        self._set_all_parent()
-        self._set_all_child()
+        # Parents and daughters only depend on the z-a-m id and are shared by all the passports of the nuclide
+        self._reaction_topology = get_reaction_topology(self._zam)
         # self._all_non0_child = self.get_all_non0_child()
 
         self._all_reacs_dic = None
@@ -60,6 +205,11 @@ class Passport(object):
         self._current_dens_subseq = None
         self._dens_subseq_mat = None
 
+        # Once the passport belongs to a Passlist, its densities are stored in the density arrays of the Passlist
+        # at position _dens_index (see onix.Passlist._bind_dens)
+        self._dens_store = None
+        self._dens_index = None
+
         self._current_xs = None
         self._xs_seq = None
         self._decay_a = None
@@ -163,6 +313,18 @@ class Passport(object):
     def current_xs(self, new_xs):
         """Sets the current cross sections dictionnary of the nuclide"""
         self._current_xs = new_xs
+        self._xs_changed()
+
+    def _xs_changed(self):
+        """Tells the passlist of the passport that its cross sections have changed"""
+        if self._dens_store is not None:
+            self._dens_store._xs_version += 1
+        self._fission_data_changed()
+
+    def _fission_data_changed(self):
+        """Tells the passlist of the passport to recompute its fission energy cross section vector"""
+        if self._dens_store is not None:
+            self._dens_store._fission_energy_xs_vect = None
 
     @property
     def xs_seq(self):
@@ -216,7 +378,7 @@ class Passport(object):
         xs_lib = d.default_xs_lib
         xs = xs_lib[zamid]
 
-        self._current_xs = xs
+        self.current_xs = xs
 
 
 
@@ -270,6 +432,8 @@ class Passport(object):
     @property
     def current_dens(self):
         """Returns the current density of the nuclide in atom per :math:`cm^{3}`"""
+        if self._dens_store is not None:
+            return self._dens_store._dens_vect[self._dens_index]
         if self._current_dens is None:
             pass  # define exception for undefined variable
         return self._current_dens
@@ -277,49 +441,79 @@ class Passport(object):
     @current_dens.setter
     def current_dens(self, new_dens):
         """Sets the current density of the nuclide in atom per :math:`cm^{3}`"""
-        self._current_dens = new_dens
+        if self._dens_store is not None:
+            self._dens_store._dens_vect[self._dens_index] = new_dens
+        else:
+            self._current_dens = new_dens
 
     @property
     def dens_seq(self):
-        """Returns the macro sequence of densities of the nuclide in atom per :math:`cm^{3}`"""
+        """Returns the macro sequence of densities of the nuclide in atom per :math:`cm^{3}`
+
+        If the passport belongs to a passlist, the sequence is a numpy view of the density history of the passlist: setting its elements changes the stored densities"""
+        if self._dens_store is not None:
+            return self._dens_store._get_dens_seq_view(self)
         return self._dens_seq
 
     @dens_seq.setter
     def dens_seq(self, new_dens_seq):
         """Sets the macro sequence of densities of the nuclide in atom per :math:`cm^{3}`"""
-
-        self._dens_seq = new_dens_seq
+        if self._dens_store is not None:
+            dens_seq = self._dens_store._get_dens_seq_view(self)
+            if len(new_dens_seq) != len(dens_seq):
+                raise Dens_seq_length_mismatch('{} densities were given for a passlist that stores {} macrosteps'.format(len(new_dens_seq), len(dens_seq)))
+            dens_seq[:] = new_dens_seq
+        else:
+            self._dens_seq = new_dens_seq
 
     def _append_dens_seq(self, new_dens):
         """Appends a new density value to the macro sequence of densities of the nuclide in atom per :math:`cm^{3}`"""
-        self._dens_seq.append(new_dens)
+        if self._dens_store is not None:
+            self._dens_store._append_dens_seq_entry(self, new_dens)
+        else:
+            self._dens_seq.append(new_dens)
 
     def get_current_dens_subseq(self):
         """Returns the current micro sequence of densities (i.e. micro sequence corresponding to the current macro step)"""
-        return self._dens_subseq_mat[-1]
+        return self.get_dens_subseq(-1)
 
     @property
     def dens_subseq_mat(self):
-        """Returns the list of micro sequences of densities (one per macro step)"""
+        """Returns the list of micro sequences of densities (one per macro step)
+
+        If the passport belongs to a passlist, each micro sequence is a numpy view of the density history of the passlist"""
+        if self._dens_store is not None:
+            store = self._dens_store
+            return [store._get_dens_subseq_view(self, s) for s in range(store._get_dens_subseq_number())]
         return self._dens_subseq_mat
 
     def get_dens_subseq(self, s):
         """Returns the micro sequence of densities number s (i.e. micro sequence corresponding to the macro step number s)"""
+        if self._dens_store is not None:
+            return self._dens_store._get_dens_subseq_view(self, s)
         return self._dens_subseq_mat[s]
 
     def _append_dens_subseq_mat(self, new_dens, ss):
         """Sets new density value to the list of micro sequences of densities
 
         If this is the first micro step, creates a new micro sequence"""
-        if ss == 0:
-            self._dens_subseq_mat.append([])
-        self._dens_subseq_mat[-1].append(new_dens)
+        if self._dens_store is not None:
+            self._dens_store._append_dens_subseq_entry(self, new_dens, ss)
+        else:
+            if ss == 0:
+                self._dens_subseq_mat.append([])
+            self._dens_subseq_mat[-1].append(new_dens)
 
     def _set_initial_dens(self, new_dens):
         """Sets initial density"""
-        self.current_dens = new_dens
-        self.dens_seq = [new_dens]
-        self._dens_subseq_mat = [[new_dens]]
+        if self._dens_store is not None:
+            # All the passports of the passlist share the same history length
+            # The whole history of the nuclide is set to the initial density
+            self._dens_store._set_dens_history(self, new_dens)
+        else:
+            self.current_dens = new_dens
+            self.dens_seq = [new_dens]
+            self._dens_subseq_mat = [[new_dens]]
 
     def _set_step_dens(self):
         """Sets a new density in the macro sequence of densities
@@ -336,228 +530,57 @@ class Passport(object):
         The new density is appended to the micro sequence of densities"""
         self.current_dens = dens
         self._append_dens_subseq_mat(dens, ss)
-       
-
-
-
 
     @property
     def zamid(self):
         """Returns the z-a-m-id of the nuclide"""
         return self._zamid
 
+    @property
+    def zam(self):
+        """Returns the z-a-m-id of the nuclide as an integer"""
+        return self._zam
+
     @property
     def name(self):
         """Returns the name of the nuclide"""
         return self._name
 
 
-    def _get_xs_prod_from_dic(self):
-        """Produces a dictionnary that contains the operations required to be done on the zamid number of the nuclide
-        to obtain the zamid of nuclides produced by the different types of neutron-induced reaction"""
-        state = self._state
-        if state == 0:
-            xs_prod_from = d.xs_prod_fromS_toS.copy()
-            xs_prod_from.update(d.xs_prod_fromS_toX)
-
-        elif state == 1:
-            xs_prod_from = d.xs_prod_fromX_toS.copy()
-            xs_prod_from.update(d.xs_prod_fromX_toX)
-
-        return xs_prod_from
-
-    def _get_decay_prod_from_dic(self):
-        """Produces a dictionnary that contains the operations required to be done on the zamid number of the nuclide
-        to obtain the zamid of nuclides produced by the different types of decay reaction"""
-        state = self._state
-        if state == 0:
-            decay_prod_from = d.decay_prod_fromS_toS.copy()
-            decay_prod_from.update(d.decay_prod_fromS_toX)
-
-        elif state == 1:
-            decay_prod_from = d.decay_prod_fromX_toS.copy()
-            decay_prod_from.update(d.decay_prod_fromX_toX)
-
-        return decay_prod_from
-
-    def _get_xs_prod_to_dic(self):
-        """Produces a dictionnary that contains the operations required to be done on the zamid number of other nuclides
-        that produces the nuclide via different types of neutron-induced reaction"""
-        state = self._state
-        if state == 0:
-            xs_prod_to = d.xs_prod_fromS_toS.copy()
-            xs_prod_to.update(d.xs_prod_fromX_toS)
-
-        elif state == 1:
-            xs_prod_to = d.xs_prod_fromS_toX.copy()
-            xs_prod_to.update(d.xs_prod_fromX_toX)
-
-        return xs_prod_to
-
-    def _get_decay_prod_to_dic(self):
-        """Produces a dictionnary that contains the operations required to be done on the zamid number of other nuclides
-        that produces the nuclide via different types of decay reaction"""
-        state = self._state
-        if state == 0:
-            decay_prod_to = d.decay_prod_fromS_toS.copy()
-            decay_prod_to.update(d.decay_prod_fromX_toS)
-
-        elif state == 1:
-            decay_prod_to = d.decay_prod_fromS_toX.copy()
-            decay_prod_to.update(d.decay_prod_fromX_toX)
-
-        return decay_prod_to
-
-
+    @property
+    def reaction_topology(self):
+        """Returns the onix.Reaction_topology object that stores the parents and daughters of the nuclide. This object is shared by all the passports of the nuclide"""
+        return self._reaction_topology
 
     @property
     def xs_child(self):
         """Returns the daughter products of the nuclide via neutron-induced rections"""
-        return self._xs_child    
-
-    def _set_xschild(self):
-
-        zamid = int(self._zamid)
-
-        xs_prod_from_dic = self._get_xs_prod_from_dic()
-        
-        child_dic = {}
-      
-        for i in xs_prod_from_dic:
-
-            # If nuclide is Li6 or Be10, add children from (n,t)
-            # (n,t) rxn rate only tallied for Li6 and Be10
-            if i == '(n,t)':
-                if zamid in [30060, 50100]:
-                    # In the case of (n,t) (and (n,alpha) as well), the reaction creates two new nuclides
-                    # The reaction is thus branched out in two new reactions:
-                    # 1) (n,x) which creates nuclides according to xs_prod_from_dic
-                    # 2) (n,x)x which creates x, which is the particle emitted (tritium or alpha)
-                    child_dic['(n,t)t'] = '10030'
-            
-                elif zamid not in [30060, 50100]:
-                    continue
-
-                # Note that after that, Li6 and Be10 are still being added the other child from (n,t), as below
-
-            child_zamid = zamid + 10000*xs_prod_from_dic[i][0]+ 10*xs_prod_from_dic[i][1] + xs_prod_from_dic[i][2]
-            child_dic[i] = str(child_zamid)
-
-        self._xs_child = child_dic
+        return self._reaction_topology.xs_child
 
     @property
     def decay_child(self):
         """Returns the daughter products of the nuclide via decay reactions"""
-        return self._decay_child
-
-    def _set_decaychild(self):
-
-        zamid = int(self._zamid)
-
-        decay_prod_from_dic = self._get_decay_prod_from_dic()
-        
-        child_dic = {}
-        
-        for i in decay_prod_from_dic:
-            child_zamid = zamid + 10000*decay_prod_from_dic[i][0]+ 10*decay_prod_from_dic[i][1] + decay_prod_from_dic[i][2]
-            child_dic[i] = str(child_zamid)
-
-        self._decay_child = child_dic
+        return self._reaction_topology.decay_child
 
     @property
     def xs_parent(self):
         """Returns the parents of the nuclide via neutron-induced reactions"""
-        return self._xs_parent
-
-    def _set_xsparent(self):
-
-        zamid = int(self._zamid)
-
-        parent_dic = {}
-
-        xs_prod_to_dic = self._get_xs_prod_to_dic()
-        
-        for i in xs_prod_to_dic:
-
-            if i == '(n,t)':
-
-                # If nuclide is not a possible children of (n,t) reaction of Li6 or Be10
-                # Skip
-                if zamid not in [10030,20040, 30070]:
-                    continue
-
-                # In the case of tritium itself, the nuclide has two parents from the same type
-                # of reaction (Li6 and Be10 from (n,t))
-                # Therefore, we branched out this channel into two new channels
-                # Note that ONIX should not try to find a parent for tritium through xs_prod_to_dic in this case
-                # It would track back to Helium5 (He5 +n = H3 + H3)), which itself has no (n,t) reaction allocated
-                if zamid == 10030:
-                    parent_dic['Li6(n,t)'] = '30060'
-                    parent_dic['Be10(n,t)'] = '50100'
-                    continue
-
-                # This leaves us with only He4 and Li7 who are the products of Li6 (n,t) and Be10 (n,t) respectively
-                # For these two nuclides, ONIX finds the parents through xs_prod_to_dict as below
-
-            parent_zamid = zamid - 10000*xs_prod_to_dic[i][0]- 10*xs_prod_to_dic[i][1] - xs_prod_to_dic[i][2]
-            parent_dic[i] = str(parent_zamid)
-
-        self._xs_parent = parent_dic
+        return self._reaction_topology.xs_parent
 
     @property
     def decay_parent(self):
         """Returns the parents of the nuclide via decay reactions"""
-        return self._decay_parent
-
-    def _set_decayparent(self):
-
-        zamid = int(self._zamid)
-        
-        parent_dic = {}
-
-        decay_prod_to_dic = self._get_decay_prod_to_dic()
-        
-        for i in decay_prod_to_dic:
-            parent_zamid = zamid - 10000*decay_prod_to_dic[i][0]- 10*decay_prod_to_dic[i][1] - decay_prod_to_dic[i][2]
-            parent_dic[i] = str(parent_zamid)
-
-        self._decay_parent = parent_dic
+        return self._reaction_topology.decay_parent
 
     @property
     def all_parent(self):
         """Returns all parents of the nuclide"""
-        return self._all_parent
-
-    def _set_all_parent(self):
-
-        xs_parent = self._xs_parent
-        decay_parent = self._decay_parent
-        parent_list = []
-
-        for i in xs_parent:
-            parent_list.append(xs_parent[i])
-        for i in decay_parent:
-            parent_list.append(decay_parent[i])
-
-        self._all_parent = parent_list
+        return self._reaction_topology.all_parent
 
     @property
     def all_child(self):
         """Returns all daughter products of the nuclide."""
-        return self._all_child
-
-    def _set_all_child(self):
-
-        xs_child = self._xs_child
-        decay_child = self._decay_child
-        child_list = []
-
-        for i in xs_child:
-            child_list.append(xs_child[i])
-        for i in decay_child:
-            child_list.append(decay_child[i])
-
-        self._all_child = child_list
+        return self._reaction_topology.all_child
 
     @property
     def fission_child(self):
@@ -603,8 +626,8 @@ class Passport(object):
     # On the fly calculation
     def get_all_non0_child(self):
         """Gets all daughter products of the nuclide produced via reactions that are non-zero (i.e., the reaction cross section or decay constant is not null) in the library used in the simulation"""
-        xs_child = self._xs_child
-        decay_child = self._decay_child
+        xs_child = self.xs_child
+        decay_child = self.decay_child
         non0_child_list = []
         xs = self._current_xs
         decay_a = self._decay_a
@@ -653,24 +676,14 @@ class Passport(object):
     @property
     def get_a(self):
         """Returns the mass number of the nuclide"""
-        zaid = self._zamid
-
-        if len(zaid) == 5:
-            a = int(zaid[1:4])
-        else:
-            a = int(zaid[2:5])
+        a = (self._zam//10)%1000
 
         return a
 
     @property
     def get_z(self):
         """Returns the atomic number of the nuclide"""
-        zaid = self._zamid
-
-        if len(zaid) == 5:
-            z = int(zaid[0:1])
-        else:
-            z = int(zaid[0:2])
+        z = self._zam//10000
 
         return z
 
@@ -682,8 +695,7 @@ class Passport(object):
 
     def _set_state(self):
         """Sets the excitation state of the nuclide (excited or ground state)"""
-        zamid = self._zamid
-        state = int(zamid[-1])
+        state = self._zam%10
 
         self._state = state
 
@@ -705,6 +717,7 @@ class Passport(object):
     def fission_E(self, fission_E):
         """Sets the fission energy of the nuclide"""
         self._fission_E = fission_E
+        self._fission_data_changed()
 
     def _set_energy_per_fission(self):
 
@@ -826,6 +839,10 @@ class No_fission_XS(Exception):
     """Raise when the user tries to access fission XS for a nuclide which fission XS have not been set yet """
     pass
 
+class Dens_seq_length_mismatch(Exception):
+    """Raise when a sequence of densities does not have the length of the history stored by the passlist"""
+    pass
+
 
 
 
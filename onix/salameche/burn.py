@@ -1,12 +1,31 @@
 
 import numpy as np
+import copy
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 from onix import data
 from onix import passlist as pl
+import onix.utils as utils
 from . import mat_builder as mb
 from . import cram
 from . import py_pade   
 
+# Library attributes of a BUCell. In parallel mode, libraries that are onix.data.Lib_store are sent to the worker processes
+# (they are pickled as a path and map the same files). Libraries that are plain dictionnaries are not sent as they
+# would be copied for each BUCell
+_process_skip_attr_list = ['_decay_b_lib', '_decay_a_lib', '_xs_lib', '_fy_lib']
+
+# Order of the local error of each flux approximation, used by the adaptive microstep controller
+_flux_approximation_order = {'iv':1, 'pc':2, 'celi':2, 'leqi':3, 'me':4}
+
+# Adaptive microstep controller parameters
+_adaptive_safety = 0.9
+_adaptive_max_growth = 4.0
+_adaptive_min_shrink = 0.2
+# Smallest internal substep allowed, as a fraction of the microstep
+_adaptive_min_fraction = 1/1024
+
 # This function is in fact not used anymore.
 # Might need to be removed
 def burn(system):
@@ -24,12 +43,15 @@ def burn(system):
     # for each cell
     system.step_normalization()
 
-    for s in range(1, steps_number+1):
+    try:
+        for s in range(1, steps_number+1):
 
-        print ('\n\n\n\n STEP {}\n\n\n\n'.format(s))
+            print ('\n\n\n\n STEP {}\n\n\n\n'.format(s))
 
-        sequence._gen_step_folder(s)
-        burn_step(system, s, mode='stand alone')
+            sequence._gen_step_folder(s)
+            burn_step(system, s, mode='stand alone')
+    finally:
+        system._shutdown_process_pool()
 
     system._gen_output_summary_folder()
     system._print_summary_allreacs_rank()
@@ -52,15 +74,36 @@ def burn_step(system, s, mode):
 
     bucell_list = system.get_bucell_list()
     reac_rank = system.reac_rank
-    for bucell in bucell_list:
-        print ('\n\n\n\n CELL {}\n\n\n\n'.format(bucell.name))
-        # Create and set the folder corresponding to that cell
-        bucell._set_folder()
-        bucell._print_xs_lib()
-        burn_cell(bucell, s, mode, reac_rank)
-        bucell._change_isotope_density(s)
-        bucell._change_total_density(s)
-        bucell._print_substep_dens(s)
+    if reac_rank == 'on':
+        for bucell in bucell_list:
+            bucell._reac_rank_top = system.reac_rank_top
+
+    if system.batch_cram == 'on':
+        for bucell in bucell_list:
+            print ('\n\n\n\n CELL {}\n\n\n\n'.format(bucell.name))
+            bucell._set_folder()
+            bucell._print_xs_lib()
+        burn_cell_batch(bucell_list, s, mode, reac_rank)
+        for bucell in bucell_list:
+            bucell._change_isotope_density(s)
+            bucell._change_total_density(s)
+            bucell._print_substep_dens(s)
+    elif system.parallel == 'on':
+        for bucell in bucell_list:
+            print ('\n\n\n\n CELL {}\n\n\n\n'.format(bucell.name))
+            bucell._set_folder()
+            bucell._print_xs_lib()
+        burn_cell_parallel(bucell_list, s, mode, reac_rank, system._get_process_pool())
+    else:
+        for bucell in bucell_list:
+            print ('\n\n\n\n CELL {}\n\n\n\n'.format(bucell.name))
+            # Create and set the folder corresponding to that cell
+            bucell._set_folder()
+            bucell._print_xs_lib()
+            burn_cell(bucell, s, mode, reac_rank)
+            bucell._change_isotope_density(s)
+            bucell._change_total_density(s)
+            bucell._print_substep_dens(s)
 
     if reac_rank == 'on':
         system._print_current_allreacs_rank()
@@ -96,319 +139,749 @@ def burn_cell(bucell, s, mode, reac_rank):
     microsteps_number = sequence.microsteps_number(s-1)
     
     B = mb.get_xs_mat(passlist)
-    C = mb.get_decay_mat(passlist)
+    C = mb.get_decay_mat_cached(passlist, bucell.decay_a_lib)
     N = mb.get_initial_vect(passlist)
 
     # Store B and C on compressed txt
     # there needs to be a new matrix print for every step (even substep)
     mb._print_all_mat_to_text(B, C, bucell, s)
 
-    if flux_approximation == 'iv':
+    B, C = _reduce_network(bucell, B, C, N)
+
+    # B and C are constant over the macrostep. If the flux and the microstep time interval
+    # do not change either, the LU factors of the CRAM poles are reused from one microstep to the next
+    lu_cache = cram.CRAM_LU_cache()
+
+    if sequence.adaptive_tolerance is not None:
+        # The adaptive controller carries its own flux history and internal substep length
+        flux_history = {}
         for i in range(microsteps_number):
-            N = burn_microstep(bucell, B, C, N, s, i, microsteps_number, mode, reac_rank)
-    elif flux_approximation == 'pc':
+            N = burn_microstep_adaptive(bucell, B, C, N, s, i, microsteps_number, mode, reac_rank, lu_cache, flux_history)
+    elif flux_approximation == 'iv':
         for i in range(microsteps_number):
-            burn_substep_pc(bucell, B, C, N, s, i, microsteps_number, mode)
-    elif flux_approximation == 'me':
+            N = burn_microstep(bucell, B, C, N, s, i, microsteps_number, mode, reac_rank, lu_cache)
+    elif flux_approximation in ['pc', 'celi', 'leqi', 'me']:
+        # Flux and time interval of the previous microstep, used by the LE/QI scheme
+        # B changes at each macrostep so the history is reset here
+        flux_history = {}
         for i in range(microsteps_number):
-            burn_substep_pcME4(bucell, B, C, N, s, i, microsteps_number, mode)
+            N = burn_microstep_pc(bucell, B, C, N, s, i, microsteps_number, mode, reac_rank, lu_cache, flux_history)
 
+    bucell._solver_stats = lu_cache.stats
     bucell._set_step_dens()
     sequence._set_macrostep_bucell_bu()
 
     # At the end of this burn sequence, the flux and power
 
-def burn_microstep(bucell, B, C, N, s, ss, ssn, mode, reac_rank):
+def burn_cell_parallel(bucell_list, s, mode, reac_rank, process_pool):
 
-    """Depletes a BUCell for microstep ss within macrostep s.
+    """Depletes a list of BUCells for macrostep s, distributing the BUCells over a pool of worker processes.
+
+    The worker processes hold a copy of each BUCell without its density and reaction rate histories (see onix.salameche.Burn_process_pool).
+    At each macrostep, a process only receives the sequence of the BUCell and, if they have changed, the current cross sections of the nuclides. The current densities
+    are passed through a block of shared memory, in which the process writes back the densities appended to the macro and micro sequences. The process returns
+    the sequence, the density check and solver statistics and, if reac_rank is 'on', the reaction terms of the nuclides. These are then set in the BUCells of the parent process.
+    Each BUCell writes in its own folder so the output is identical to the serial depletion.
 
     Parameters
     ----------
-    bucell: onix.Cell
-        BUCell to be depleted
-    B: numpy.array
-        Neutron-induced reaction transmutation matrix
-    C: numpy.array
-        Decay matrix
+    bucell_list: list
+        List of onix.Cell to be depleted
     s: int
         Macrostep number
-    ss: int
-        Microstep number
-    ssn: int
-        Total number of microstep within macrostep s
     mode: str
         'stand alone' or 'couple'
     reac_rank: str
         'on' or 'off'. If set to 'on', each BUCell will compute production and destruction terms ranking for each nuclide at every macrostep.
+    process_pool: onix.salameche.Burn_process_pool
+        Pool of worker processes
     """
 
-    print ('\n\n++++ Microstep {} ++++\n\n'.format(ss))
+    executor = process_pool._get_executor(bucell_list)
 
-    bucell_id = bucell.id
-    sequence = bucell.sequence
-    norma = sequence.norma_unit
-    #norma_value = sequence.norma_vector[s]
+    # The densities of each BUCell take (microsteps number + 2) rows of the shared block: the current densities, the macrostep point and the microstep points
+    shape_list = [(bucell.sequence.microsteps_number(s-1) + 2, len(bucell.passlist.passport_list)) for bucell in bucell_list]
+    offset_list = [int(x) for x in np.cumsum([0] + [rows*columns for rows, columns in shape_list[:-1]])]
+    size = sum(rows*columns for rows, columns in shape_list)
 
-    # I decided that since pow dens sequence will only be updated dynamically
-    # and not created at the beginning, then the conversion bu-time/time-bu
-    # will also be done dynamically
-    # In case of norma = bu, time need to be calculated now, before CRAM
-    sequence._bucell_time_bu_substep_conversion(bucell, s, ss)
+    shm = shared_memory.SharedMemory(create = True, size = max(size, 1)*np.dtype(np.float64).itemsize)
+    try:
+        shm_array = np.ndarray((size,), dtype = np.float64, buffer = shm.buf)
+        task_list = []
+        for bucell, shape, offset in zip(bucell_list, shape_list, offset_list):
+            shm_array[offset:offset + shape[1]] = bucell.passlist._dens_vect
+            task_list.append((bucell.id, process_pool._get_process_state(bucell), shm.name, offset, shape))
 
-    # print ('s', s, 'ss', ss)
-    # print ('time subseq mat', sequence._time_subseq_mat)
-    # print ('bu subseq mat', sequence._bucell_bu_subseq_mat)
-    time_point = sequence.time_subpoint(s, ss)
-    bucell_bu_point = sequence.bucell_bu_subpoint(s, ss)
-    time_substep = sequence.get_time_subintvl(s, ss)
+        bucell_number = len(bucell_list)
+        burn_output_list = list(executor.map(_burn_cell_process, task_list, [s]*bucell_number, [mode]*bucell_number, [reac_rank]*bucell_number))
 
-    pow_dens = sequence.current_pow_dens
-    flux = sequence.current_flux
+        for bucell, shape, offset, burn_output in zip(bucell_list, shape_list, offset_list, burn_output_list):
+            dens_mat = shm_array[offset:offset + shape[0]*shape[1]].reshape(shape)
+            _set_burn_cell_process_output(bucell, dens_mat, burn_output)
+    finally:
+        shm.close()
+        shm.unlink()
 
-    # If this is the first substep, no need to update the flux or pow dens
-    # both have been already calculated 
-    if ss != 0:
-    # Check whether actinides are present in the cell
-    # If not, then no flux/power update should be done
-        act = bucell.check_act_presence()
-        if act == 'yes':
-        # Now that the density of nuclides is updated, calculate the new substep flux or power density
-            if norma == 'power':
-                flux = bucell._update_flux(pow_dens)
+class Burn_process_pool(object):
+    """Pool of worker processes used to deplete the BUCells of a system in parallel (see onix.System.parallel_on).
 
-            elif norma == 'flux':
-                pow_dens = bucell._update_pow_dens(flux)
+    The pool is kept from one macrostep to the next so that the worker processes keep their caches (decay matrices, cross section matrix topologies, library stores).
+    When the pool is started, each worker process receives a copy of every BUCell without its density, cross section and reaction rate histories
+    (see onix.Passlist._get_process_copy). The pool is started again if the nuclides of a BUCell have changed.
 
-    sequence._set_substep_flux(flux, s, ss)
-    sequence._set_substep_pow_dens(pow_dens, s, ss)
-
-    # print(('current_time_point', time_point))
-    # print(('current bucell_bu', bucell_bu_point))
-    A = (B*1e-24*flux + C)
-    #A = B*1e-24*flux
-    # print(('current flux', flux))
-    # print(('current time_subintvl', time_substep))
-
-    At = A*time_substep
-
-    N = cram.CRAM16(At, N)
-    #N = py_pade.pade(At, N)
-
-    cram.CRAM_density_check(bucell, N)
+    Parameters
+    ----------
+    processes: int
+        Maximum number of worker processes. If None (default), the number of processors of the machine is used
+    """
 
-    bucell._update_dens(N, ss, ssn)
+    def __init__(self, processes = None):
 
-    # Generate the allreacsdic for each nuclide
-    if reac_rank == 'on':
-        # print ('pika')
-        # quit()
-        bucell._set_allreacs_dic(s, ss, ssn)
-
-    return N
+        self.processes = processes
+        self._executor = None
+        self._bucell_key = None
+        # Cross section version of the passlist of each BUCell when the pool was started
+        self._xs_version_dict = None
 
+    def _get_executor(self, bucell_list):
 
+        """Returns the executor of the pool, starting it if needed."""
 
+        for bucell in bucell_list:
+            bucell.passlist._check_dens_binding()
 
+        bucell_key = tuple((bucell.id, tuple(bucell.passlist.get_index_dict())) for bucell in bucell_list)
+        if self._executor is None or bucell_key != self._bucell_key:
+            self.shutdown()
+            process_bucell_list = [_get_process_bucell(bucell) for bucell in bucell_list]
+            self._executor = ProcessPoolExecutor(max_workers = self.processes, initializer = _set_process_bucell_dict, initargs = (process_bucell_list,))
+            self._bucell_key = bucell_key
+            self._xs_version_dict = {bucell.id:bucell.passlist._xs_version for bucell in bucell_list}
 
+        return self._executor
 
+    def _get_process_state(self, bucell):
 
+        """Returns the data of a BUCell that a worker process needs on top of its copy: the sequence, the folder, the reaction rate ranking option
+        and the cross sections of the nuclides if they have changed since the pool was started."""
 
+        passlist = bucell.passlist
+        xs_version = passlist._xs_version
+        xs_list = None
+        if xs_version != self._xs_version_dict[bucell.id]:
+            xs_list = [nuc_pass.current_xs for nuc_pass in passlist.passport_list]
 
+        return bucell.sequence, bucell.folder_path, bucell._reac_rank_top, xs_version, xs_list
 
+    def shutdown(self):
 
+        """Stops the worker processes."""
 
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+            self._bucell_key = None
+            self._xs_version_dict = None
 
+# Copies of the BUCells held by a worker process, keyed on their id, and cross section version of their passlist in the parent process
+_process_bucell_dict = {}
+_process_xs_version_dict = {}
 
+def _get_process_bucell(bucell):
 
+    """Returns the copy of a BUCell held by the worker processes. Libraries that are not onix.data.Lib_store are left out."""
 
+    process_bucell = copy.copy(bucell)
+    for attr in _process_skip_attr_list:
+        if not isinstance(getattr(process_bucell, attr), data.Lib_store):
+            setattr(process_bucell, attr, None)
+    process_bucell.passlist = bucell.passlist._get_process_copy()
+    process_bucell._sequence = None
 
+    return process_bucell
 
+def _set_process_bucell_dict(process_bucell_list):
 
+    """Initializer of the worker processes."""
 
+    _process_bucell_dict.clear()
+    _process_xs_version_dict.clear()
+    for bucell in process_bucell_list:
+        _process_bucell_dict[bucell.id] = bucell
+        _process_xs_version_dict[bucell.id] = bucell.passlist._xs_version
 
+def _burn_cell_process(task, s, mode, reac_rank):
 
+    """Depletes a BUCell in a worker process. The densities are written in the shared block and the other data that have changed are returned (see _set_burn_cell_process_output)."""
 
+    bucell_id, process_state, shm_name, offset, shape = task
+    sequence, folder_path, reac_rank_top, xs_version, xs_list = process_state
 
+    bucell = _process_bucell_dict[bucell_id]
+    passlist = bucell.passlist
+    passport_list = passlist.passport_list
+
+    bucell._sequence = sequence
+    bucell._folder_path = folder_path
+    bucell._reac_rank_top = reac_rank_top
+    if xs_list is not None and xs_version != _process_xs_version_dict[bucell_id]:
+        for nuc_pass, xs in zip(passport_list, xs_list):
+            nuc_pass.current_xs = xs
+        _process_xs_version_dict[bucell_id] = xs_version
+    for nuc_pass in passport_list:
+        nuc_pass._allreacs_dic_list = []
+        nuc_pass._sorted_allreacs_tuple_mat = []
+
+    shm = shared_memory.SharedMemory(name = shm_name)
+    try:
+        dens_mat = np.ndarray(shape, dtype = np.float64, buffer = shm.buf, offset = offset*np.dtype(np.float64).itemsize)
+        passlist._dens_vect[:] = dens_mat[0]
+        passlist._reset_dens_history()
 
+        burn_cell(bucell, s, mode, reac_rank)
+        bucell._change_isotope_density(s)
+        bucell._change_total_density(s)
+        bucell._print_substep_dens(s)
 
+        dens_mat[0] = passlist._dens_vect
+        dens_mat[1] = passlist.get_dens_seq_mat()[-1]
+        dens_mat[2:] = passlist.get_dens_subseq_mat(-1)
+    finally:
+        shm.close()
 
-def burn_substep_pc(cell, B, C, N, s, i): # with predictor corrector
+    # With reac_rank_top, the ranking is only written in the folder of the BUCell
+    rank_output_list = None
+    if reac_rank == 'on' and reac_rank_top is None:
+        rank_output_list = []
+        for nuc_pass in passport_list:
+            rank_output_list.append((nuc_pass.destruction_dic,
+                                     nuc_pass.creation_dic,
+                                     nuc_pass.allreacs_dic,
+                                     nuc_pass._allreacs_dic_list,
+                                     nuc_pass.current_sorted_allreacs_tuple_list,
+                                     nuc_pass._sorted_allreacs_tuple_mat))
 
-    cell_id = cell.id
-    passlist = cell.passlist
-    index_dic = cell.index_dic
-    sequence = cell.sequence
-    norma = sequence.norma_unit
-    norma_value = sequence.norma_vector[s]
-    power = norma_value
+    return bucell.sequence, bucell._density_check_stats, bucell._solver_stats, bucell._reduced_index, rank_output_list
 
-    time_point = sequence.time_subpoint(s,i)
-    bu_point = sequence.bu_subpoint(s,i)
-    time_substep = sequence.time_substep(s,i)
+def _set_burn_cell_process_output(bucell, dens_mat, burn_output):
 
-    Ni = N.copy()
+    """Sets the output of _burn_cell_process in the BUCell of the parent process: the current densities and the densities appended
+    to the macro and micro sequences (rows of dens_mat), the sequence, the density check and solver statistics, the reduced network and the reaction terms of the nuclides."""
 
-    flux_pc = []
+    sequence, density_check_stats, solver_stats, reduced_index, rank_output_list = burn_output
 
-    for pc_i in range(2):
+    passlist = bucell.passlist
+    for ss in range(2, len(dens_mat)):
+        passlist._set_substep_dens(dens_mat[ss], ss-2)
+    passlist._dens_vect[:] = dens_mat[1]
+    passlist._set_step_dens()
+    passlist._dens_vect[:] = dens_mat[0]
+
+    bucell._sequence = sequence
+    bucell._density_check_stats = density_check_stats
+    bucell._solver_stats = solver_stats
+    bucell._reduced_index = reduced_index
+
+    if rank_output_list is not None:
+        for nuc_pass, rank_output in zip(passlist.passport_list, rank_output_list):
+            destruction_dic, creation_dic, allreacs_dic, allreacs_dic_list, current_sorted_allreacs_tuple_list, sorted_allreacs_tuple_mat = rank_output
+            nuc_pass.destruction_dic = destruction_dic
+            nuc_pass.creation_dic = creation_dic
+            nuc_pass.allreacs_dic = allreacs_dic
+            nuc_pass._allreacs_dic_list.extend(allreacs_dic_list)
+            nuc_pass._current_sorted_allreacs_tuple_list = current_sorted_allreacs_tuple_list
+            nuc_pass._sorted_allreacs_tuple_mat.extend(sorted_allreacs_tuple_mat)
+
+def burn_cell_batch(bucell_list, s, mode, reac_rank):
+
+    """Depletes a list of BUCells for macrostep s, solving the depletion equations of all BUCells together at each microstep.
+
+    BUCells are advanced microstep by microstep in lockstep. At each microstep, the depletion matrices of all BUCells
+    are passed to onix.salameche.solve_depletion_batch, grouped by solver. BUCells whose flux approximation is not 'iv' or that use adaptive microsteps are depleted one by one with onix.salameche.burn_cell.
 
-        flux_pc.append(sequence._update_flux(passlist, power))
+    Parameters
+    ----------
+    bucell_list: list
+        List of onix.Cell to be depleted
+    s: int
+        Macrostep number
+    mode: str
+        'stand alone' or 'couple'
+    reac_rank: str
+        'on' or 'off'. If set to 'on', each BUCell will compute production and destruction terms ranking for each nuclide at every macrostep.
+    """
 
-        if pc_i ==1: # Corrector step
+    batch_list = []
+    for bucell in bucell_list:
+        if bucell.sequence.flux_approximation == 'iv' and bucell.sequence.adaptive_tolerance is None:
+            batch_list.append(bucell)
+        else:
+            burn_cell(bucell, s, mode, reac_rank)
+
+    B_dict = {}
+    C_dict = {}
+    N_dict = {}
+    ssn_dict = {}
+    for bucell in batch_list:
+        passlist = bucell.passlist
+        B_dict[bucell] = mb.get_xs_mat(passlist)
+        C_dict[bucell] = mb.get_decay_mat_cached(passlist, bucell.decay_a_lib)
+        N_dict[bucell] = mb.get_initial_vect(passlist)
+        ssn_dict[bucell] = bucell.sequence.microsteps_number(s-1)
+        mb._print_all_mat_to_text(B_dict[bucell], C_dict[bucell], bucell, s)
+        B_dict[bucell], C_dict[bucell] = _reduce_network(bucell, B_dict[bucell], C_dict[bucell], N_dict[bucell])
+
+    # At most one distinct matrix per BUCell is solved in each microstep
+    lu_cache = cram.CRAM_LU_cache(len(batch_list))
+
+    max_ssn = max(ssn_dict.values(), default = 0)
+    for i in range(max_ssn):
+
+        print ('\n\n++++ Microstep {} ++++\n\n'.format(i))
+
+        # BUCells are grouped by solver and backend
+        group_dict = {}
+        for bucell in batch_list:
+            if i >= ssn_dict[bucell]:
+                continue
+            At = _get_microstep_matrix(bucell, B_dict[bucell], C_dict[bucell], s, i)
+            key = (bucell.solver, bucell.sequence.cram_backend)
+            group_dict.setdefault(key, []).append((bucell, At))
+
+        for (solver, backend), group in group_dict.items():
+            At_list = [At for bucell, At in group]
+            N_0_list = []
+            for bucell, At in group:
+                if bucell._reduced_index is None:
+                    N_0_list.append(N_dict[bucell])
+                else:
+                    N_0_list.append(N_dict[bucell][bucell._reduced_index])
+            N_list = cram.solve_depletion_batch(At_list, N_0_list, solver, backend, lu_cache)
+            for (bucell, At), N in zip(group, N_list):
+                if bucell._reduced_index is not None:
+                    N_full = np.zeros(len(N_dict[bucell]))
+                    N_full[bucell._reduced_index] = N
+                    N = N_full
+                _update_microstep_dens(bucell, N, s, i, ssn_dict[bucell], reac_rank)
+                N_dict[bucell] = N
+
+    for bucell in batch_list:
+        bucell._solver_stats = lu_cache.stats
+        bucell._set_step_dens()
+        bucell.sequence._set_macrostep_bucell_bu()
+
+def burn_microstep(bucell, B, C, N, s, ss, ssn, mode, reac_rank, lu_cache = None):
 
-            flux_pc = (flux_pc[0] + flux_pc[1])/2
+    """Depletes a BUCell for microstep ss within macrostep s.
 
-            # Pass the flux to sequence. If power norma, seq and subseq are updated. If flux norma, only subseq needs to be updated
-            sequence._set_flux(flux_pc, s, i)
+    Parameters
+    ----------
+    bucell: onix.Cell
+        BUCell to be depleted
+    B: scipy.sparse.csr_matrix
+        Neutron-induced reaction transmutation matrix
+    C: scipy.sparse.csr_matrix
+        Decay matrix
+    s: int
+        Macrostep number
+    ss: int
+        Microstep number
+    ssn: int
+        Total number of microstep within macrostep s
+    mode: str
+        'stand alone' or 'couple'
+    reac_rank: str
+        'on' or 'off'. If set to 'on', each BUCell will compute production and destruction terms ranking for each nuclide at every macrostep.
+    lu_cache: onix.salameche.CRAM_LU_cache
+        Cache of the LU factors of the CRAM poles, shared between the microsteps of a macrostep
+    """
 
-            # Generate the first set of reacs
-            if s == 0 and i == 0:
-                pl._set_allreacs_dic(passlist, sequence, s, i)
+    print ('\n\n++++ Microstep {} ++++\n\n'.format(ss))
 
+    At = _get_microstep_matrix(bucell, B, C, s, ss)
 
-        A = (B*1e-24*flux_pc + C)
-        #A = B*1e-24*flux
-        print(('flux_pc', flux_pc))
-        print(('time_substep', time_substep))
+    N = _solve_cell_depletion(bucell, At, N, lu_cache)
+    #N = py_pade.pade(At, N)
 
-        At = A*time_substep
+    _update_microstep_dens(bucell, N, s, ss, ssn, reac_rank)
 
-        N = cram.CRAM16(At, Ni)
+    return N
 
-        cram.CRAM_reality_check(cell, index_dic, N)
+def _get_microstep_matrix(bucell, B, C, s, ss):
 
-        pl._update_dens(N, passlist)
+    """Updates the flux or power density of a BUCell for microstep ss within macrostep s and returns the depletion matrix multiplied by the microstep time interval."""
 
-        if pc_i == 1:
+    flux, time_substep = _set_microstep_flux(bucell, s, ss)
 
-          #  pl.print_dens_2(cell, s, i)
+    # print(('current_time_point', time_point))
+    # print(('current bucell_bu', bucell_bu_point))
+    A = (B*1e-24*flux + C)
+    #A = B*1e-24*flux
+    # print(('current flux', flux))
+    # print(('current time_subintvl', time_substep))
 
-            # Store B and C on compressed txt
-            # there needs to be a new matrix print for every step (even substep)
-            mb._print_all_mat_to_text(B, C, flux_pc, cell, s, i)
+    At = A*time_substep
 
-            # Generate the allreacsdic for each nuclide
-            pl._set_allreacs_dic(passlist, sequence, s, i)
+    return At
 
+def _set_microstep_flux(bucell, s, ss):
 
-def burn_substep_pcME4(cell, B, C, N, s, i): # with predictor corrector
+    """Updates the flux or power density of a BUCell at the beginning of microstep ss within macrostep s. Returns the flux and the microstep time interval."""
 
-    cell_id = cell.id
-    passlist = cell.passlist
-    index_dic = cell.index_dic
-    sequence = cell.sequence
+    bucell_id = bucell.id
+    sequence = bucell.sequence
     norma = sequence.norma_unit
-    norma_value = sequence.norma_vector[s]
-    power = norma_value
-
-    time_point = sequence.time_subpoint(s,i)
-    bu_point = sequence.bu_subpoint(s,i)
-    time_substep = sequence.time_substep(s,i)
-
-    Ni = N.copy()
+    #norma_value = sequence.norma_vector[s]
 
-    flux_pc = []
+    # I decided that since pow dens sequence will only be updated dynamically
+    # and not created at the beginning, then the conversion bu-time/time-bu
+    # will also be done dynamically
+    # In case of norma = bu, time need to be calculated now, before CRAM
+    sequence._bucell_time_bu_substep_conversion(bucell, s, ss)
 
-    # Predictor
-    print('Predictor')
+    # print ('s', s, 'ss', ss)
+    # print ('time subseq mat', sequence._time_subseq_mat)
+    # print ('bu subseq mat', sequence._bucell_bu_subseq_mat)
+    time_point = sequence.time_subpoint(s, ss)
+    bucell_bu_point = sequence.bucell_bu_subpoint(s, ss)
+    time_substep = sequence.get_time_subintvl(s, ss)
 
-    flux_pc.append(sequence._update_flux(passlist, power))
+    pow_dens = sequence.current_pow_dens
+    flux = sequence.current_flux
 
-    A = (B*1e-24*flux_pc + C)
-    #A = B*1e-24*flux
-    print(('flux_pc', flux_pc))
-    print(('time_substep', time_substep))
+    # If this is the first substep, no need to update the flux or pow dens
+    # both have been already calculated 
+    if ss != 0:
+    # Check whether actinides are present in the cell
+    # If not, then no flux/power update should be done
+        act = bucell.check_act_presence()
+        if act == 'yes':
+        # Now that the density of nuclides is updated, calculate the new substep flux or power density
+            if norma == 'power':
+                flux = bucell._update_flux(pow_dens)
 
-    At = A*time_substep
+            elif norma == 'flux':
+                pow_dens = bucell._update_pow_dens(flux)
 
-    N = cram.CRAM16(At, Ni)
+    sequence._set_substep_flux(flux, s, ss)
+    sequence._set_substep_pow_dens(pow_dens, s, ss)
 
-    cram.CRAM_reality_check(cell, index_dic, N)
+    return flux, time_substep
 
-    pl._update_dens(N, passlist)
+def _update_microstep_dens(bucell, N, s, ss, ssn, reac_rank):
 
+    """Checks the densities computed for microstep ss within macrostep s and stores them in the BUCell."""
 
+    bucell._density_check_stats = cram.CRAM_density_check(bucell, N)
 
-    # Corrector
-    print('Corrector')
+    bucell._update_dens(N, ss, ssn)
 
-    flux_pc.append(sequence._update_flux(passlist, power))
-    flux_av = (flux_pc[0] + flux_pc[1])/2
+    # Generate the allreacsdic for each nuclide
+    if reac_rank == 'on':
+        # print ('pika')
+        # quit()
+        bucell._set_allreacs_dic(s, ss, ssn)
 
-    # Pass the flux to sequence. If power norma, seq and subseq are updated. If flux norma, only subseq needs to be updated
-    sequence._set_flux(flux_av, s, i)
+def burn_microstep_pc(bucell, B, C, N, s, ss, ssn, mode, reac_rank, lu_cache = None, flux_history = None):
 
-    # Generate the first set of reacs
-    if s == 0 and i == 0:
-        pl._set_allreacs_dic(passlist, sequence, s, i)
+    """Depletes a BUCell for microstep ss within macrostep s with a predictor-corrector or higher-order flux integrator.
 
+    The integrator is selected by the flux approximation of the BUCell's sequence:
 
-    # Apct
-    Apc = (B*1e-24*flux_av + C)
-    #A = B*1e-24*flux
-    print(('flux_pc', flux_pc))
-    print(('time_substep', time_substep))
-    Apct = A*time_substep
+    - 'pc': constant extrapolation / constant midpoint (CE/CM) predictor-corrector
+    - 'celi': constant extrapolation / linear interpolation (CE/LI)
+    - 'leqi': linear extrapolation / quadratic interpolation (LE/QI). The first microstep of each macrostep uses CE/LI
+    - 'me': fourth-order commutator-free Magnus integrator (CF4)
 
-    # Correction from ME4
-    BC_CB = np.matmul(B,C) - np.matmul(C,B)
-    correction = BC_CB*((flux_pc[1] - flux_pc[0])*time_substep**2)/12
+    The cross sections are constant over a macrostep, so that the depletion matrix only depends on the flux.
+    Each stage of the integrators therefore reduces to a depletion with an effective flux.
+    With flux normalization, or if the BUCell contains no actinides, the flux is constant over the microstep and all integrators reduce to the 'iv' scheme.
 
-    Apct_corrected = Apct + correction
+    Parameters
+    ----------
+    bucell: onix.Cell
+        BUCell to be depleted
+    B: scipy.sparse.csr_matrix
+        Neutron-induced reaction transmutation matrix
+    C: scipy.sparse.csr_matrix
+        Decay matrix
+    s: int
+        Macrostep number
+    ss: int
+        Microstep number
+    ssn: int
+        Total number of microstep within macrostep s
+    mode: str
+        'stand alone' or 'couple'
+    reac_rank: str
+        'on' or 'off'. If set to 'on', each BUCell will compute production and destruction terms ranking for each nuclide at every macrostep.
+    lu_cache: onix.salameche.CRAM_LU_cache
+        Cache of the LU factors of the CRAM poles, shared between the microsteps of a macrostep
+    flux_history: dict
+        Flux and time interval of the previous microstep, updated by this function. Only used by the LE/QI scheme
+    """
 
-    np.set_printoptions(threshold='nan')
-    print(("Apct", Apct))
-    print(("determinant Apct", np.linalg.det(Apct)))
-    print(("norm At", np.linalg.norm(Apct, 2)))
+    print ('\n\n++++ Microstep {} ++++\n\n'.format(ss))
 
-    print(("BC_CB", BC_CB))
-    print(("determinant BC_CB", np.linalg.det(BC_CB)))
-    print(("norm BC_CB", np.linalg.norm(BC_CB, 2)))
+    sequence = bucell.sequence
+    flux_approximation = sequence.flux_approximation
+    pow_dens = sequence.current_pow_dens
 
+    flux_0, time_substep = _set_microstep_flux(bucell, s, ss)
 
+    if flux_history is None:
+        flux_history = {}
 
+    if sequence.norma_unit != 'power' or bucell.check_act_presence() == 'no':
+        N_end = _deplete_with_flux(bucell, B, C, N, flux_0, time_substep, lu_cache)
+    else:
+        N_end = _integrate_flux(bucell, B, C, N, flux_0, pow_dens, time_substep, flux_approximation, lu_cache, flux_history)
 
-    print(("Correction", correction))
-    print(("Apct_corrected", Apct_corrected))
-    print(('determinant corrected',   np.linalg.det(Apct)))
-    norm_corrected = np.linalg.norm(Apct_corrected, 2)
-    print(('NORM corrected', norm_corrected))
+    flux_history['flux'] = flux_0
+    flux_history['time_substep'] = time_substep
 
-    N = cram.CRAM16(Apct_corrected, Ni)
+    _update_microstep_dens(bucell, N_end, s, ss, ssn, reac_rank)
 
-    cram.CRAM_reality_check(cell, index_dic, N)
+    return N_end
 
-    pl._update_dens(N, passlist)
+def burn_microstep_adaptive(bucell, B, C, N, s, ss, ssn, mode, reac_rank, lu_cache = None, flux_history = None):
 
-  #  pl.print_dens_2(cell, s, i)
+    """Depletes a BUCell for microstep ss within macrostep s, dividing the microstep into internal substeps whose length is adapted to a local error estimate.
 
-    # Store B and C on compressed txt
-    # there needs to be a new matrix print for every step (even substep)
-    mb._print_all_mat_to_text(B, C, flux_pc, cell, s, i)
+    Each internal substep of length h is integrated once over h and once as two substeps of length h/2 with the flux approximation of the sequence.
+    The relative difference between the two solutions on the end-of-substep flux and on the densities of the nuclides selected with Sequence.set_adaptive_microstep
+    estimates the local error. If the error is below the sequence tolerance, the two half substeps solution is accepted. In both cases, the next substep length is
+    scaled by safety*(tolerance/error)^(1/(p+1)) where p is the order of the flux approximation. The last substep of a microstep is shortened to end on the microstep
+    boundary, but the substep length proposed by the controller is kept for the next microstep. Substeps that reach 1/1024 of the microstep are accepted even if
+    the tolerance is not met, and a warning is printed.
 
-    # Generate the allreacsdic for each nuclide
-    pl._set_allreacs_dic(passlist, sequence, s, i)
+    The microsteps defined by the user are kept as output points: densities, flux and power density are only stored at the end of each microstep.
+    With flux normalization, or if the BUCell contains no actinides, the depletion matrix is constant over the microstep and a single solve is exact.
 
+    Parameters
+    ----------
+    bucell: onix.Cell
+        BUCell to be depleted
+    B: scipy.sparse.csr_matrix
+        Neutron-induced reaction transmutation matrix
+    C: scipy.sparse.csr_matrix
+        Decay matrix
+    s: int
+        Macrostep number
+    ss: int
+        Microstep number
+    ssn: int
+        Total number of microstep within macrostep s
+    mode: str
+        'stand alone' or 'couple'
+    reac_rank: str
+        'on' or 'off'. If set to 'on', each BUCell will compute production and destruction terms ranking for each nuclide at every macrostep.
+    lu_cache: onix.salameche.CRAM_LU_cache
+        Cache of the LU factors of the CRAM poles, shared between the microsteps of a macrostep
+    flux_history: dict
+        Flux and length of the previous internal substep and length of the next internal substep, updated by this function
+    """
 
+    print ('\n\n++++ Microstep {} ++++\n\n'.format(ss))
 
+    sequence = bucell.sequence
+    flux_approximation = sequence.flux_approximation
+    pow_dens = sequence.current_pow_dens
 
+    flux_0, time_substep = _set_microstep_flux(bucell, s, ss)
+
+    if flux_history is None:
+        flux_history = {}
+
+    if sequence.norma_unit != 'power' or bucell.check_act_presence() == 'no':
+        N_end = _deplete_with_flux(bucell, B, C, N, flux_0, time_substep, lu_cache)
+    else:
+        tolerance = sequence.adaptive_tolerance
+        order = _flux_approximation_order[flux_approximation]
+        index_list = _get_adaptive_index_list(bucell)
+
+        t = 0.0
+        # h is the substep length proposed by the controller. The substep actually integrated (h_step) is shortened
+        # to land on the end of the microstep, but the proposal is kept for the next microstep
+        h = flux_history.get('next_substep', time_substep)
+        flux = flux_0
+        substep_count = 0
+        rejected_count = 0
+        forced_count = 0
+        while time_substep - t > 1e-9*time_substep:
+            h_step = min(h, time_substep - t)
+            # The history is only updated once a substep is accepted
+            trial_history = dict(flux_history)
+            N_full = _integrate_flux(bucell, B, C, N, flux, pow_dens, h_step, flux_approximation, lu_cache, dict(trial_history))
+            N_mid = _integrate_flux(bucell, B, C, N, flux, pow_dens, h_step/2, flux_approximation, lu_cache, trial_history)
+            trial_history['flux'] = flux
+            trial_history['time_substep'] = h_step/2
+            flux_mid = bucell._get_flux_from_vect(N_mid, pow_dens)
+            N_half = _integrate_flux(bucell, B, C, N_mid, flux_mid, pow_dens, h_step/2, flux_approximation, lu_cache, trial_history)
+
+            error = _get_local_error(bucell, N_full, N_half, pow_dens, index_list)
+
+            # Substeps at the smallest length allowed are accepted even if the tolerance is not met
+            accepted = error <= tolerance or h_step <= time_substep*_adaptive_min_fraction
+            if accepted:
+                if error > tolerance:
+                    forced_count += 1
+                N = N_half
+                t += h_step
+                flux_history['flux'] = flux_mid
+                flux_history['time_substep'] = h_step/2
+                flux = bucell._get_flux_from_vect(N, pow_dens)
+                substep_count += 2
+            else:
+                rejected_count += 1
+
+            if error == 0:
+                factor = _adaptive_max_growth
+            else:
+                factor = _adaptive_safety*(tolerance/error)**(1/(order+1))
+            # The proposal never goes below the smallest length allowed, otherwise substeps accepted without meeting
+            # the tolerance would keep shrinking and the end of the microstep would never be reached
+            h_new = max(h_step*min(_adaptive_max_growth, max(_adaptive_min_shrink, factor)), time_substep*_adaptive_min_fraction)
+            # An accepted substep shortened to land on the end of the microstep does not shorten the proposal
+            if accepted and h_step < h:
+                h = max(h, h_new)
+            else:
+                h = h_new
+
+        flux_history['next_substep'] = h
+        N_end = N
+        print ('Adaptive microstep: {} internal substeps, {} rejected'.format(substep_count, rejected_count))
+        if forced_count > 0:
+            print ('\n\n WARNING: {} substeps of microstep {} were accepted at the smallest substep length allowed without meeting the adaptive tolerance {} \n\n'.format(forced_count, ss, tolerance))
+
+    _update_microstep_dens(bucell, N_end, s, ss, ssn, reac_rank)
+
+    return N_end
+
+def _get_adaptive_index_list(bucell):
+
+    """Returns the indexes in the density vector of the nuclides monitored by the adaptive microstep controller."""
+
+    nucl_list = bucell.sequence.adaptive_nucl_list
+    if nucl_list is None:
+        return []
+
+    index_dict = bucell.passlist.get_index_dict()
+    index_list = []
+    for nucl in nucl_list:
+        zamid = utils.name_to_zamid(nucl)
+        if zamid in index_dict:
+            index_list.append(index_dict[zamid])
+
+    return index_list
+
+def _get_local_error(bucell, N_full, N_half, pow_dens, index_list):
+
+    """Returns the relative difference between the solutions computed with one substep and two half substeps, on the end-of-substep flux and on the monitored densities."""
+
+    flux_full = bucell._get_flux_from_vect(N_full, pow_dens)
+    flux_half = bucell._get_flux_from_vect(N_half, pow_dens)
+    error = abs(flux_full - flux_half)/abs(flux_half)
+
+    for index in index_list:
+        if N_half[index] > 0:
+            error = max(error, abs(N_full[index] - N_half[index])/N_half[index])
+
+    return error
+
+def _integrate_flux(bucell, B, C, N, flux_0, pow_dens, time_substep, flux_approximation, lu_cache, flux_history):
+
+    """Integrates the depletion equation over time_substep with the selected flux approximation when the flux depends on the densities (power normalization).
+    flux_0 is the flux at the beginning of the interval and flux_history holds the flux and time interval of the previous interval (LE/QI only)."""
+
+    h = time_substep/2
 
+    if flux_approximation == 'iv':
+        N_end = _deplete_with_flux(bucell, B, C, N, flux_0, time_substep, lu_cache)
 
+    elif flux_approximation == 'pc':
+        print ('Predictor')
+        N_mid = _deplete_with_flux(bucell, B, C, N, flux_0, h, lu_cache)
+        flux_mid = bucell._get_flux_from_vect(N_mid, pow_dens)
+        print ('Corrector')
+        N_end = _deplete_with_flux(bucell, B, C, N, flux_mid, time_substep, lu_cache)
+
+    elif flux_approximation == 'celi' or (flux_approximation == 'leqi' and 'flux' not in flux_history):
+        print ('Predictor')
+        N_p = _deplete_with_flux(bucell, B, C, N, flux_0, time_substep, lu_cache)
+        flux_1 = bucell._get_flux_from_vect(N_p, pow_dens)
+        print ('Corrector')
+        N_inter = _deplete_with_flux(bucell, B, C, N, (5*flux_0 + flux_1)/6, h, lu_cache)
+        N_end = _deplete_with_flux(bucell, B, C, N_inter, (flux_0 + 5*flux_1)/6, h, lu_cache)
+
+    elif flux_approximation == 'leqi':
+        flux_l = flux_history['flux']
+        dt_l = flux_history['time_substep']
+        dt = time_substep
+
+        print ('Predictor')
+        flux_p1 = 2*(-dt/(12*dt_l)*flux_l + (dt + 6*dt_l)/(12*dt_l)*flux_0)
+        flux_p2 = 2*(-5*dt/(12*dt_l)*flux_l + (5*dt + 6*dt_l)/(12*dt_l)*flux_0)
+        N_inter = _deplete_with_flux(bucell, B, C, N, flux_p1, h, lu_cache)
+        N_p = _deplete_with_flux(bucell, B, C, N_inter, flux_p2, h, lu_cache)
+        flux_1 = bucell._get_flux_from_vect(N_p, pow_dens)
+
+        print ('Corrector')
+        denom = 12*dt_l*(dt + dt_l)
+        flux_c1 = 2*(-dt**2/denom*flux_l + (dt**2 + 6*dt*dt_l + 5*dt_l**2)/denom*flux_0 + dt_l**2/denom*flux_1)
+        flux_c2 = 2*(-dt**2/denom*flux_l + (dt**2 + 2*dt*dt_l + dt_l**2)/denom*flux_0 + (4*dt*dt_l + 5*dt_l**2)/denom*flux_1)
+        N_inter = _deplete_with_flux(bucell, B, C, N, flux_c1, h, lu_cache)
+        N_end = _deplete_with_flux(bucell, B, C, N_inter, flux_c2, h, lu_cache)
 
+    elif flux_approximation == 'me':
+        N_1 = _deplete_with_flux(bucell, B, C, N, flux_0, h, lu_cache)
+        flux_1 = bucell._get_flux_from_vect(N_1, pow_dens)
+        N_2 = _deplete_with_flux(bucell, B, C, N, flux_1, h, lu_cache)
+        flux_2 = bucell._get_flux_from_vect(N_2, pow_dens)
+        N_3 = _deplete_with_flux(bucell, B, C, N_1, 2*flux_2 - flux_0, h, lu_cache)
+        flux_3 = bucell._get_flux_from_vect(N_3, pow_dens)
+        N_inter = _deplete_with_flux(bucell, B, C, N, (3*flux_0 + 2*flux_1 + 2*flux_2 - flux_3)/6, h, lu_cache)
+        N_end = _deplete_with_flux(bucell, B, C, N_inter, (-flux_0 + 2*flux_1 + 2*flux_2 + 3*flux_3)/6, h, lu_cache)
 
+    return N_end
 
+def _deplete_with_flux(bucell, B, C, N, flux, time_interval, lu_cache):
 
+    """Depletes the density vector N over time_interval with the depletion matrix built for the given flux."""
 
+    At = (B*1e-24*flux + C)*time_interval
 
+    return _solve_cell_depletion(bucell, At, N, lu_cache)
 
+def _reduce_network(bucell, B, C, N):
 
+    """If the sequence of the BUCell uses a reduced network, finds the nuclides reachable from the current densities,
+    stores their indexes in the BUCell and returns the cross section and decay matrices restricted to these nuclides."""
 
+    if bucell.sequence.reduced_network != 'on':
+        bucell._reduced_index = None
+        return B, C
 
+    reduced_index = mb.get_reachable_index(B, C, N)
+    bucell._reduced_index = reduced_index
+    print ('Reduced network: {} nuclides out of {}'.format(len(reduced_index), len(N)))
 
+    B = B[reduced_index][:, reduced_index]
+    C = C[reduced_index][:, reduced_index]
 
+    return B, C
 
+def _solve_cell_depletion(bucell, At, N, lu_cache):
 
+    """Solves the depletion equation of a BUCell. If the network is reduced, At is the reduced matrix and the solution is mapped back onto the full density vector."""
 
+    sequence = bucell.sequence
+    reduced_index = bucell._reduced_index
 
+    if reduced_index is None:
+        return cram.solve_depletion(At, N, bucell.solver, sequence.cram_backend, lu_cache)
 
+    N_end = np.zeros(len(N))
+    N_end[reduced_index] = cram.solve_depletion(At, N[reduced_index], bucell.solver, sequence.cram_backend, lu_cache)
 
+    return N_end
@@ -1,25 +1,20 @@
 """Compute the solution of the matricial depletion equation using the CRAM method"""
 import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+import scipy.sparse.csgraph as csgraph
+import scipy.linalg as la
+import hashlib
 import warnings
 import time
 
-def CRAM16(At,N_0):
-    """CRAM uses a Chebishev Rational Approximation Method of order 16 to compute the solution of the matricial depletion equation.
-
-    Parameters
-    ----------
-    At: numpy.array
-        Depletion matrix multiplied by the time interval over which nuclides are depleted
-    N_0: numpy.array
-        Initial nuclides' densities vector
-    """
-
-    print ('CRAM CALLED')
-    t0 = time.time()
+from . import py_pade
 
-    lN = len(N_0)
-
-    theta = np.array([
+# Poles and residues of the order 16 CRAM partial fraction decomposition
+# Only one pole of each conjugate pair is stored, hence the factor 2 on the real part of the sum
+# The linear solvers of numpy and scipy do not support extended precision, the coefficients are
+# therefore stored in double precision complex
+_theta16 = np.array([
     -1.0843917078696988026e1 +1.9277446167181652284e1j,
     -5.2649713434426468895 +1.6220221473167927305e1j,
     +5.9481522689511774808 +3.5874573620183222829j,
@@ -27,11 +22,11 @@ def CRAM16(At,N_0):
     +6.4161776990994341923 +1.1941223933701386874j,
     +1.4193758971856659786 +1.0925363484496722585e1j,
     +4.9931747377179963991 +5.9968817136039422260j,
-    -1.4139284624888862114 +1.3497725698892745389e1j], dtype = np.complex256)
+    -1.4139284624888862114 +1.3497725698892745389e1j], dtype = np.complex128)
 
-    alpha_0 = np.complex256(2.1248537104952237488e-16 + 0.0j) 
+_alpha16_0 = np.complex128(2.1248537104952237488e-16 + 0.0j)
 
-    alpha = np.array([
+_alpha16 = np.array([
     -5.0901521865224915650e-7 -2.4220017652852287970e-5j,
     +2.1151742182466030907e-4 +4.3892969647380673918e-3j,
     +1.1339775178483930527e2 +1.0194721704215856450e2j,
@@ -39,30 +34,765 @@ def CRAM16(At,N_0):
     -6.4500878025539646595e1 -2.2459440762652096056e2j,
     -1.4793007113557999718 +1.7686588323782937906j,
     -6.2518392463207918892e1 -1.1190391094283228480e1j,
-    +4.1023136835410021273e-2 -1.5743466173455468191e-1j], dtype = np.complex256)
+    +4.1023136835410021273e-2 -1.5743466173455468191e-1j], dtype = np.complex128)
+
+# Poles and coefficients of the order 16 and order 48 CRAM in incomplete partial fraction (IPF) form
+# M. Pusa, "Higher-Order Chebyshev Rational Approximation Method and Application to Burnup Equations",
+# Nuclear Science and Engineering, 182:3, 297-318 (2016)
+_ipf_theta16 = np.array([
+    +3.509103608414918 + 8.436198985884374j,
+    +5.948152268951177 + 3.587457362018322j,
+    -5.264971343442647 + 16.22022147316793j,
+    +1.419375897185666 + 10.92536348449672j,
+    +6.416177699099435 + 1.194122393370139j,
+    +4.993174737717997 + 5.996881713603942j,
+    -1.413928462488886 + 13.49772569889275j,
+    -10.84391707869699 + 19.27744616718165j], dtype = np.complex128)
+
+_ipf_alpha16_0 = np.complex128(2.124853710495224e-16 + 0.0j)
+
+_ipf_alpha16 = np.array([
+    +5.464930576870210e+3 - 3.797983575308356e+4j,
+    +9.045112476907548e+1 - 1.115537522430261e+3j,
+    +2.344818070467641e+2 - 4.228020157070496e+2j,
+    +9.453304067358312e+1 - 2.951294291446048e+2j,
+    +7.283792954673409e+2 - 1.205646080220011e+5j,
+    +3.648229059594851e+1 - 1.155509621409682e+2j,
+    +2.547321630156819e+1 - 2.639500283021502e+1j,
+    +2.394538338734709e+1 - 5.650522971778156e+0j], dtype = np.complex128)
+
+_ipf_theta48 = np.array([
+    -4.465731934165702e+1 + 6.233225190695437e+1j,
+    -5.284616241568964e+0 + 4.057499381311059e+1j,
+    -8.867715667624458e+0 + 4.325515754166724e+1j,
+    +3.493013124279215e+0 + 3.281615453173585e+1j,
+    +1.564102508858634e+1 + 1.558061616372237e+1j,
+    +1.742097597385893e+1 + 1.076629305714420e+1j,
+    -2.834466755180654e+1 + 5.492841024648724e+1j,
+    +1.661569367939544e+1 + 1.316994930024688e+1j,
+    +8.011836167974721e+0 + 2.780232111309410e+1j,
+    -2.056267541998229e+0 + 3.794824788914354e+1j,
+    +1.449208170441839e+1 + 1.799988210051809e+1j,
+    +1.853807176907916e+1 + 5.974332563100539e+0j,
+    +9.932562704505182e+0 + 2.532823409972962e+1j,
+    -2.244223871767187e+1 + 5.179633600312162e+1j,
+    +8.590014121680897e-1 + 3.536456194294350e+1j,
+    -1.286192925744479e+1 + 4.600304902833652e+1j,
+    +1.164596909542055e+1 + 2.287153304140217e+1j,
+    +1.806076684783089e+1 + 8.368200580099821e+0j,
+    +5.870672154659249e+0 + 3.029700159040121e+1j,
+    -3.542938819659747e+1 + 5.834381701800013e+1j,
+    +1.901323489060250e+1 + 1.194282058271408e+0j,
+    +1.885508331552577e+1 + 3.583428564427879e+0j,
+    -1.734689708174982e+1 + 4.883941101108207e+1j,
+    +1.316284237125190e+1 + 2.042951874827759e+1j], dtype = np.complex128)
+
+_ipf_alpha48_0 = np.complex128(2.258038182743983e-47 + 0.0j)
+
+_ipf_alpha48 = np.array([
+    +6.387380733878774e+2 - 6.743912502859256e+2j,
+    +1.909896179065730e+2 - 3.973203432721332e+2j,
+    +4.236195226571914e+2 - 2.041233768918671e+3j,
+    +4.645770595258726e+2 - 1.652917287299683e+3j,
+    +7.765163276752433e+2 - 1.783617639907328e+4j,
+    +1.907115136768522e+3 - 5.887068595142284e+4j,
+    +2.909892685603256e+3 - 9.953255345514560e+3j,
+    +1.944772206620450e+2 - 1.427131226068449e+3j,
+    +1.382799786972332e+5 - 3.256885197214938e+6j,
+    +5.628442079602433e+3 - 2.924284515884309e+4j,
+    +2.151681283794220e+2 - 1.121774011188224e+3j,
+    +1.324720240514420e+3 - 6.370088443140973e+4j,
+    +1.617548476343347e+4 - 1.008798413156542e+6j,
+    +1.112729040439685e+2 - 8.837109731680418e+1j,
+    +1.074624783191125e+2 - 1.457246116408180e+2j,
+    +8.835727765158191e+1 - 6.388286188419360e+1j,
+    +9.354078136054179e+1 - 2.195424319460237e+2j,
+    +9.418142823531573e+1 - 6.719055740098035e+2j,
+    +1.040012390717851e+2 - 1.693747595553868e+2j,
+    +6.861882624343235e+1 - 1.177598523430493e+1j,
+    +8.766654491283722e+1 - 4.596464999363902e+3j,
+    +1.056007619389650e+2 - 1.738294585524067e+3j,
+    +7.738987569039419e+1 - 4.311715386228984e+1j,
+    +1.041366366475571e+2 - 2.777743732451969e+2j], dtype = np.complex128)
+
+def _get_pf_residues(theta, alpha, alpha_0):
+    """Converts the coefficients of a CRAM in IPF form into the residues of the same approximation in partial fraction form."""
+
+    residues = np.zeros(len(theta), dtype = np.complex128)
+    for j in range(len(theta)):
+        residue = alpha_0*alpha[j]
+        for l in range(len(theta)):
+            if l == j:
+                continue
+            residue *= 1 + alpha[l]/(theta[j] - theta[l]) + np.conj(alpha[l])/(theta[j] - np.conj(theta[l]))
+        residues[j] = residue
+
+    return residues
+
+# The order 48 residues in partial fraction form are derived from the IPF coefficients
+# These residues are as large as 1e8 and cancel each other out. In double precision, the partial fraction
+# form of order 48 is therefore only accurate to about 1e-9. The IPF form does not suffer from this problem
+_theta48 = _ipf_theta48
+_alpha48_0 = _ipf_alpha48_0
+_alpha48 = _get_pf_residues(_ipf_theta48, _ipf_alpha48, _ipf_alpha48_0)
+
+_cram_coefficients = {
+    (16, 'pf'): (_theta16, _alpha16, _alpha16_0),
+    (16, 'ipf'): (_ipf_theta16, _ipf_alpha16, _ipf_alpha16_0),
+    (48, 'pf'): (_theta48, _alpha48, _alpha48_0),
+    (48, 'ipf'): (_ipf_theta48, _ipf_alpha48, _ipf_alpha48_0)
+    }
+
+# Largest difference with the matrix exponential of scipy expected from each CRAM approximation
+# on the reference decay chain of onix.salameche.check_cram_accuracy
+_cram_accuracy_dict = {
+    (16, 'pf'): 1e-12,
+    (16, 'ipf'): 1e-12,
+    (48, 'pf'): 1e-8,
+    (48, 'ipf'): 1e-12
+    }
+
+# Solvers that can be selected for a Sequence or a BUCell
+# For CRAM solvers, the entries are the order and the form of the approximation
+cram_solver_dict = {
+    'cram16': (16, 'pf'),
+    'cram48': (48, 'pf'),
+    'ipf16': (16, 'ipf'),
+    'ipf48': (48, 'ipf')
+    }
+
+solver_list = list(cram_solver_dict.keys()) + ['expm_multiply', 'pade']
+
+# Linear algebra backends of the CRAM solvers
+backend_list = ['sparse', 'dense', 'block']
+
+# In the block backend, strongly connected components up to this size are factorized
+# with a dense LU, larger components with a sparse LU
+_block_dense_size = 64
+
+# Block triangular orderings of the last sparsity patterns met
+_block_order_dict = {}
+_block_order_dict_size = 4
+
+def solve_depletion(At, N_0, solver = 'cram16', backend = 'sparse', lu_cache = None):
+    """Computes the solution of the matricial depletion equation with the selected solver.
+
+    Parameters
+    ----------
+    At: numpy.array or scipy.sparse matrix
+        Depletion matrix multiplied by the time interval over which nuclides are depleted
+    N_0: numpy.array
+        Initial nuclides' densities vector
+    solver: str
+        'cram16' (default) and 'cram48' for CRAM of order 16 and 48 in partial fraction form, 'ipf16' and 'ipf48' for CRAM of order 16 and 48 in incomplete partial fraction form, 'expm_multiply' for the action-based exponential of scipy and 'pade' for the dense Pade approximant of scipy
+    backend: str
+        'sparse' (default), 'dense' or 'block'. Linear algebra backend used by the CRAM solvers
+    lu_cache: onix.salameche.CRAM_LU_cache
+        Cache of LU factors used by the CRAM solvers. If None (default), no factors are stored. The solves are counted in the onix.salameche.Solver_stats object of the cache
+    """
+
+    if solver in cram_solver_dict:
+        order, form = cram_solver_dict[solver]
+        return CRAM(At, N_0, order, form, backend, lu_cache)
+
+    t0 = time.time()
+    if solver == 'expm_multiply':
+        N = expm_action(At, N_0)
+    elif solver == 'pade':
+        if sp.issparse(At):
+            At = At.toarray()
+        N = py_pade.pade(At, N_0)
+    else:
+        raise Unknown_solver('Solver {} is not supported, choose among {}'.format(solver, solver_list))
+
+    if lu_cache is not None:
+        lu_cache.stats._add_solve(time.time() - t0)
 
-    l = len(theta)
-    N = N_0*0
-    _N = np.zeros((lN),dtype=np.complex128)
+    return N
 
-    for i in range(l):
-        term1 = At - theta[i]*np.identity(np.shape(At)[0])
-        term2 = alpha[i]*N_0
-        _N += np.linalg.solve(term1,term2)
-        
-    N = 2*_N.real
-    N = N + alpha_0*N_0
-    # For some reason here N is still complex and not only real
+def CRAM(At, N_0, order = 16, form = 'pf', backend = 'sparse', lu_cache = None):
+    """CRAM uses a Chebishev Rational Approximation Method of order 16 or 48 to compute the solution of the matricial depletion equation.
+
+    In partial fraction form (pf), the linear systems of each pole are solved independently from the initial densities. In incomplete partial fraction form (ipf), they are solved one after the other, each system taking the previous solution as right-hand side. The IPF form is numerically more robust: at order 48, the partial fraction form is only accurate to about 1e-9 in double precision while the IPF form reaches the accuracy of order 16.
+
+    Parameters
+    ----------
+    At: numpy.array or scipy.sparse matrix
+        Depletion matrix multiplied by the time interval over which nuclides are depleted
+    N_0: numpy.array
+        Initial nuclides' densities vector. A 2D array can be passed to deplete several density vectors (one per column) with the same matrix
+    order: int
+        16 (default) or 48
+    form: str
+        'pf' (default) for partial fraction form or 'ipf' for incomplete partial fraction form
+    backend: str
+        'sparse' (default) to store the matrix in compressed sparse column format and use sparse LU factorizations, 'dense' to use dense LU factorizations, 'block' to solve the systems block by block following the block triangular order of the matrix (see onix.salameche.get_block_triangular_order)
+    lu_cache: onix.salameche.CRAM_LU_cache
+        If provided, the LU factors of each pole are looked up in this cache and stored in it once computed. When the same depletion matrix is used over several microsteps, the poles are then only factorized once.
+        The solve, its duration and whether the factors were reused are counted in the onix.salameche.Solver_stats object of the cache
+    """
+
+    if (order, form) not in _cram_coefficients:
+        raise Unknown_solver('CRAM of order {} in {} form is not supported'.format(order, form))
+
+    t0 = time.time()
+
+    theta, alpha, alpha_0 = _cram_coefficients[(order, form)]
+
+    lN = At.shape[0]
+
+    if backend in ['sparse', 'block']:
+        At = sp.csc_matrix(At, dtype = np.complex128)
+        identity = sp.identity(lN, dtype = np.complex128, format = 'csc')
+    elif backend == 'dense':
+        if sp.issparse(At):
+            At = At.toarray()
+        identity = np.identity(lN)
+    else:
+        raise Unknown_solver('CRAM backend {} is not supported, choose among {}'.format(backend, backend_list))
+
+    lu_list = None
+    if lu_cache is not None:
+        key = (_get_matrix_key(At), order, form, backend)
+        lu_list = lu_cache.get_factors(key)
+
+    # In the block backend, the matrix is split once and each pole only shifts the diagonal blocks
+    if backend == 'block' and lu_list is None:
+        block_matrix = Block_triangular_matrix(At, get_block_triangular_order(At))
+
+    new_lu_list = []
+    if form == 'pf':
+        _N = np.zeros(np.shape(N_0), dtype = np.complex128)
+    elif form == 'ipf':
+        N = np.array(N_0, dtype = np.float64)
+
+    for i in range(len(theta)):
+        if lu_list is None:
+            if backend == 'block':
+                lu = block_matrix.factorize(theta[i])
+            else:
+                lu = _factorize_pole(At - theta[i]*identity, backend)
+            if lu_cache is not None:
+                new_lu_list.append(lu)
+        else:
+            lu = lu_list[i]
+
+        if form == 'pf':
+            _N += alpha[i]*_solve_pole(lu, N_0, backend)
+        elif form == 'ipf':
+            N = N + 2*(alpha[i]*_solve_pole(lu, N, backend)).real
+
+    if form == 'pf':
+        N = 2*_N.real
+        N = N + alpha_0.real*N_0
+    elif form == 'ipf':
+        N = alpha_0.real*N
+
+    if lu_cache is not None:
+        if lu_list is None:
+            lu_cache.set_factors(key, new_lu_list)
+        lu_cache.stats._add_solve(time.time() - t0, lu_list is not None)
+
+    return N
+
+def solve_depletion_batch(At_list, N_0_list, solver = 'cram16', backend = 'sparse', lu_cache = None):
+    """Computes the solutions of several matricial depletion equations with the selected solver.
+
+    With the sparse CRAM solvers, the systems are solved by onix.salameche.CRAM_batch which factorizes identical matrices only once. Other solvers deplete each system one after the other.
+
+    Parameters
+    ----------
+    At_list: list
+        List of depletion matrices multiplied by the time interval over which nuclides are depleted
+    N_0_list: list
+        List of initial nuclides' densities vectors
+    solver: str
+        Same options as onix.salameche.solve_depletion
+    backend: str
+        'sparse' (default) or 'dense'
+    lu_cache: onix.salameche.CRAM_LU_cache
+        Cache of LU factors used by the CRAM solvers. If None (default), no factors are stored
+    """
+
+    if solver in cram_solver_dict and backend in ['sparse', 'block']:
+        order, form = cram_solver_dict[solver]
+        N_list = CRAM_batch(At_list, N_0_list, order, form, lu_cache, backend)
+    else:
+        N_list = [solve_depletion(At, N_0, solver, backend, lu_cache) for At, N_0 in zip(At_list, N_0_list)]
+
+    return N_list
+
+def CRAM_batch(At_list, N_0_list, order = 16, form = 'pf', lu_cache = None, backend = 'sparse'):
+    """Batched version of onix.salameche.CRAM with the sparse or block backend.
+
+    Depletion matrices with identical content (BUCells sharing the same libraries, passlist ordering, flux and time interval, or parameter sweeps on the initial densities) are grouped together.
+    The density vectors of each group are stacked as the columns of a single right-hand side, so that only one sparse LU factorization per pole is computed for the whole group.
+
+    Parameters
+    ----------
+    At_list: list
+        List of depletion matrices multiplied by the time interval over which nuclides are depleted
+    N_0_list: list
+        List of initial nuclides' densities vectors
+    order: int
+        16 (default) or 48
+    form: str
+        'pf' (default) or 'ipf'
+    lu_cache: onix.salameche.CRAM_LU_cache
+        Cache of LU factors. If None (default), no factors are stored
+    backend: str
+        'sparse' (default) or 'block'
+    """
 
-    print('CRAM took:{} s'.format(time.time() - t0))
+    if len(At_list) != len(N_0_list):
+        raise Batch_size_mismatch('{} matrices were given for {} density vectors'.format(len(At_list), len(N_0_list)))
+
+    group_dict = {}
+    for i in range(len(At_list)):
+        At = sp.csc_matrix(At_list[i])
+        key = _get_matrix_key(At)
+        if key not in group_dict:
+            group_dict[key] = (At, [])
+        group_dict[key][1].append(i)
+
+    print ('{} density vectors depleted with {} distinct matrices'.format(len(N_0_list), len(group_dict)))
+
+    N_list = [None]*len(N_0_list)
+    for At, index_list in group_dict.values():
+        N = CRAM(At, np.column_stack([N_0_list[i] for i in index_list]), order, form, backend, lu_cache)
+        for j in range(len(index_list)):
+            N_list[index_list[j]] = N[:, j].copy()
+
+    return N_list
+
+def _factorize_pole(M, backend):
+    """Computes the LU factorization of the matrix associated with one pole of the CRAM."""
+
+    if backend == 'sparse':
+        return spla.splu(M.tocsc())
+    elif backend == 'dense':
+        return la.lu_factor(M)
+
+def _solve_pole(lu, b, backend):
+    """Solves the linear system associated with one pole of the CRAM from its LU factorization."""
+
+    if backend == 'sparse':
+        return lu.solve(np.asarray(b, dtype = np.complex128))
+    elif backend == 'dense':
+        return la.lu_solve(lu, np.asarray(b, dtype = np.complex128))
+    elif backend == 'block':
+        return lu.solve(b)
+
+def _get_matrix_key(At):
+    """Returns a digest of the content of a depletion matrix. Two matrices with the same digest are considered identical."""
+
+    digest = hashlib.sha1()
+    if sp.issparse(At):
+        At = sp.csc_matrix(At)
+        At.sum_duplicates()
+        digest.update(np.asarray(At.indptr).tobytes())
+        digest.update(np.asarray(At.indices).tobytes())
+        digest.update(np.asarray(At.data).tobytes())
+    else:
+        digest.update(np.ascontiguousarray(At).tobytes())
+
+    return (At.shape, digest.hexdigest())
+
+def get_block_triangular_order(At):
+    """Computes the block triangular order of a depletion matrix from its strongly connected components.
+
+    Transmutation networks are nearly acyclic: most nuclides cannot be produced back from their own daughters. The nuclides
+    form strongly connected components (blocks) linked to each other without loops. Each block is given a level, which is one more than the
+    highest level of the blocks producing it. The blocks of a level only depend on the blocks of lower levels and can be solved together once these are known.
+
+    The order only depends on the sparsity pattern of the matrix. The orders of the last patterns met are stored and are not computed again.
+
+    Parameters
+    ----------
+    At: numpy.array or scipy.sparse matrix
+        Depletion matrix multiplied by the time interval over which nuclides are depleted
+    """
+
+    At = sp.csr_matrix(At)
+    At.sum_duplicates()
+
+    digest = hashlib.sha1()
+    digest.update(np.asarray(At.indptr).tobytes())
+    digest.update(np.asarray(At.indices).tobytes())
+    key = (At.shape, digest.hexdigest())
+    if key in _block_order_dict:
+        return _block_order_dict[key]
+
+    pattern = sp.csr_matrix((np.ones(len(At.indices)), At.indices, At.indptr), shape = At.shape)
+    block_order = Block_triangular_order(pattern)
+    print ('Block triangular order: {} blocks on {} levels, largest block has {} nuclides'.format(block_order.block_number, block_order.level_number, block_order.largest_block_size))
+
+    _block_order_dict[key] = block_order
+    while len(_block_order_dict) > _block_order_dict_size:
+        del _block_order_dict[next(iter(_block_order_dict))]
+
+    return block_order
+
+class Block_triangular_order(object):
+    """Strongly connected components of a depletion matrix grouped by level. Built by onix.salameche.get_block_triangular_order.
+
+    In the permuted order, the nuclides of each level are contiguous: first the nuclides that form a block on their own, then the larger blocks one after the other.
+
+    Attributes
+    ----------
+    perm: numpy.array
+        Indexes of the nuclides in the permuted order
+    level_list: list
+        For each level, in increasing order, a tuple (start, end, single_end, block_range_list) of positions in the permuted order. The nuclides of the level
+        range from start to end, the single nuclide blocks from start to single_end and block_range_list contains the (start, end) positions of the larger blocks
+    block_number: int
+        Number of strongly connected components
+    level_number: int
+        Number of levels
+    largest_block_size: int
+        Number of nuclides in the largest block
+    """
+
+    def __init__(self, pattern):
+
+        block_number, block_label = csgraph.connected_components(pattern, directed = True, connection = 'strong')
+        block_size = np.bincount(block_label, minlength = block_number)
+
+        # Nuclide j produces nuclide i when At[i,j] is non-zero
+        pattern = pattern.tocoo()
+        coupling = block_label[pattern.row] != block_label[pattern.col]
+        source = block_label[pattern.col[coupling]]
+        target = block_label[pattern.row[coupling]]
+
+        # Longest path from the blocks that are not produced by any other block
+        level = np.zeros(block_number, dtype = int)
+        while True:
+            new_level = level.copy()
+            np.maximum.at(new_level, target, level[source] + 1)
+            if np.array_equal(new_level, level):
+                break
+            level = new_level
+
+        # Sort the nuclides by level, then single nuclide blocks first, then by block
+        nuclide_level = level[block_label]
+        is_block = block_size[block_label] > 1
+        self.perm = np.lexsort((block_label, is_block, nuclide_level))
+
+        self.level_list = []
+        perm_level = nuclide_level[self.perm]
+        perm_label = block_label[self.perm]
+        perm_is_block = is_block[self.perm]
+        level_bounds = np.searchsorted(perm_level, np.arange(level.max() + 2 if block_number > 0 else 1))
+        for l in range(len(level_bounds) - 1):
+            start, end = level_bounds[l], level_bounds[l+1]
+            single_end = start + int(np.count_nonzero(~perm_is_block[start:end]))
+            block_range_list = []
+            block_start = single_end
+            for block_end in range(single_end + 1, end + 1):
+                if block_end == end or perm_label[block_end] != perm_label[block_start]:
+                    block_range_list.append((block_start, block_end))
+                    block_start = block_end
+            self.level_list.append((start, end, single_end, block_range_list))
+
+        self.block_number = block_number
+        self.level_number = len(self.level_list)
+        self.largest_block_size = int(block_size.max()) if block_number > 0 else 0
+
+class Block_triangular_matrix(object):
+    """Depletion matrix split following its block triangular order. The coupling between levels and the diagonal blocks are extracted once
+    and are shared by the factorizations of all the poles of the CRAM, which only shift the diagonal.
+
+    Parameters
+    ----------
+    At: scipy.sparse matrix
+        Depletion matrix multiplied by the time interval over which nuclides are depleted
+    block_order: onix.salameche.Block_triangular_order
+        Block triangular order of the matrix
+    """
+
+    def __init__(self, At, block_order):
+
+        perm = block_order.perm
+        At = sp.csr_matrix(At)[perm][:, perm].tocsr()
+        diagonal = At.diagonal()
+
+        self.perm = perm
+        self.level_list = []
+        for start, end, single_end, block_range_list in block_order.level_list:
+            # Coupling of the level with the lower levels
+            At_coupling = At[start:end, :start] if start > 0 else None
+            block_list = []
+            for block_start, block_end in block_range_list:
+                At_block = At[block_start:block_end, block_start:block_end]
+                if block_end - block_start <= _block_dense_size:
+                    At_block = At_block.toarray()
+                else:
+                    At_block = At_block.tocsc()
+                block_list.append((block_start, block_end, At_block))
+            self.level_list.append((start, end, single_end, At_coupling, diagonal[start:single_end], block_list))
+
+    def factorize(self, theta):
+        """Returns the onix.salameche.Block_triangular_LU factorization of At - theta*I."""
+
+        return Block_triangular_LU(self, theta)
+
+class Block_triangular_LU(object):
+    """Factorization of a matrix At - theta*I following the block triangular order of At. The diagonal of the single nuclide blocks is stored,
+    the other blocks are factorized with a dense LU (or a sparse LU for the blocks larger than 64 nuclides). Linear systems are then solved
+    level by level, the coupling with the lower levels being moved to the right-hand side.
+
+    Parameters
+    ----------
+    block_matrix: onix.salameche.Block_triangular_matrix
+        Depletion matrix split following its block triangular order
+    theta: complex
+        Shift of the diagonal
+    """
+
+    def __init__(self, block_matrix, theta):
+
+        self._perm = block_matrix.perm
+        self._level_factor_list = []
+        for start, end, single_end, At_coupling, single_diagonal, block_list in block_matrix.level_list:
+            block_lu_list = []
+            for block_start, block_end, At_block in block_list:
+                if sp.issparse(At_block):
+                    identity = sp.identity(block_end - block_start, dtype = np.complex128, format = 'csc')
+                    block_lu_list.append((block_start, block_end, 'sparse', spla.splu(At_block - theta*identity)))
+                else:
+                    block_lu_list.append((block_start, block_end, 'dense', la.lu_factor(At_block - theta*np.identity(block_end - block_start))))
+            self._level_factor_list.append((start, end, single_end, At_coupling, single_diagonal - theta, block_lu_list))
+
+    def solve(self, b):
+        """Returns the solution x of (At - theta*I) x = b. b can be a 2D array with one right-hand side per column."""
+
+        b = np.asarray(b, dtype = np.complex128)[self._perm]
+        x = np.empty(b.shape, dtype = np.complex128)
+
+        for start, end, single_end, At_coupling, single_diagonal, block_lu_list in self._level_factor_list:
+            if At_coupling is None:
+                x[start:end] = b[start:end]
+            else:
+                x[start:end] = b[start:end] - At_coupling.dot(x[:start])
+            if b.ndim == 2:
+                x[start:single_end] /= single_diagonal[:, None]
+            else:
+                x[start:single_end] /= single_diagonal
+            for block_start, block_end, block_backend, lu in block_lu_list:
+                if block_backend == 'dense':
+                    x[block_start:block_end] = la.lu_solve(lu, x[block_start:block_end])
+                else:
+                    x[block_start:block_end] = lu.solve(x[block_start:block_end])
+
+        x_out = np.empty(b.shape, dtype = np.complex128)
+        x_out[self._perm] = x
+
+        return x_out
+
+class CRAM_LU_cache(object):
+    """Stores the LU factors of the CRAM poles for the last depletion matrices solved.
+
+    When the depletion matrix does not change between two microsteps (flux normalization or BUCells without actinides),
+    the poles do not need to be factorized again. Only the factors of the last *size* matrices are kept in memory.
+
+    The cache also counts the solves made with it in an onix.salameche.Solver_stats object.
+
+    Attributes
+    ----------
+    stats: onix.salameche.Solver_stats
+        Number and duration of the solves made with this cache and number of solves that reused LU factors
+
+    Parameters
+    ----------
+    size: int
+        Maximum number of depletion matrices for which factors are stored
+    """
 
-    return N.real
+    def __init__(self, size = 1):
+
+        self._size = size
+        self._factors_dict = {}
+        self.stats = Solver_stats()
+
+    @property
+    def size(self):
+
+        return self._size
+
+    def get_factors(self, key):
+        """Returns the list of LU factors stored for key, or None if the key is not in the cache."""
+
+        if key not in self._factors_dict:
+            return None
+        # Move key to the end so that it is the last one to be removed
+        lu_list = self._factors_dict.pop(key)
+        self._factors_dict[key] = lu_list
+        return lu_list
+
+    def set_factors(self, key, lu_list):
+        """Stores the list of LU factors for key. The least recently used entries are removed once the cache is full."""
+
+        self._factors_dict[key] = lu_list
+        while len(self._factors_dict) > self._size:
+            del self._factors_dict[next(iter(self._factors_dict))]
+
+    def clear(self):
+        """Removes all the factors stored in the cache."""
+
+        self._factors_dict = {}
+
+def CRAM16(At,N_0):
+    """CRAM uses a Chebishev Rational Approximation Method of order 16 to compute the solution of the matricial depletion equation.
+
+    Parameters
+    ----------
+    At: numpy.array
+        Depletion matrix multiplied by the time interval over which nuclides are depleted
+    N_0: numpy.array
+        Initial nuclides' densities vector
+    """
+
+    return CRAM(At, N_0, 16, 'pf', 'dense')
+
+def CRAM16_sparse(At, N_0):
+    """Sparse version of onix.salameche.CRAM16. The depletion matrix is stored in compressed sparse column format and the linear system associated with each pole is solved with a sparse LU factorization.
+
+    Depletion matrices are almost entirely made of zeros. This method yields the same densities as the dense method but is much faster and lighter in memory for large nuclide networks.
+
+    Parameters
+    ----------
+    At: numpy.array or scipy.sparse matrix
+        Depletion matrix multiplied by the time interval over which nuclides are depleted
+    N_0: numpy.array
+        Initial nuclides' densities vector
+    """
+
+    return CRAM(At, N_0, 16, 'pf', 'sparse')
+
+def expm_action(At, N_0):
+    """Computes the solution of the matricial depletion equation with the action-based matrix exponential of scipy (scipy.sparse.linalg.expm_multiply).
+
+    The cost of this method grows with the norm of the depletion matrix. It is therefore only efficient for networks without very short-lived nuclides or for short time intervals.
+
+    Parameters
+    ----------
+    At: numpy.array or scipy.sparse matrix
+        Depletion matrix multiplied by the time interval over which nuclides are depleted
+    N_0: numpy.array
+        Initial nuclides' densities vector
+    """
+
+    At = sp.csc_matrix(At, dtype = np.float64)
+    N = spla.expm_multiply(At, np.asarray(N_0, dtype = np.float64))
+
+    return N
+
+def check_cram_accuracy(order, form, tolerance = None):
+    """Checks a CRAM approximation against the matrix exponential of scipy (scipy.linalg.expm) on a reference decay chain whose decay constants multiplied by the time interval range from 1e-3 to 1e3. Raises onix.salameche.CRAM_accuracy_error if the largest difference between the two solutions exceeds the tolerance.
+
+    This check is not run by the solvers. It is meant to validate the coefficients of the approximations, for instance after they have been edited. Returns the largest difference.
+
+    Parameters
+    ----------
+    order: int
+        16 or 48
+    form: str
+        'pf' or 'ipf'
+    tolerance: float
+        Largest difference accepted between the densities of the two solutions (the initial density is 1). If None (default), the accuracy expected
+        from the approximation is used: 1e-12, except for order 48 in partial fraction form (1e-8)
+    """
+
+    if (order, form) not in _cram_coefficients:
+        raise Unknown_solver('CRAM of order {} in {} form is not supported'.format(order, form))
+    if tolerance is None:
+        tolerance = _cram_accuracy_dict[(order, form)]
+
+    decay_constant = np.logspace(-3, 3, 12)
+    At = np.diag(-decay_constant) + np.diag(decay_constant[:-1], -1)
+    N_0 = np.zeros(len(decay_constant))
+    N_0[0] = 1.0
+
+    N = CRAM(At, N_0, order, form, 'dense')
+    error = np.max(np.abs(N - la.expm(At).dot(N_0)))
+    if error > tolerance:
+        raise CRAM_accuracy_error('CRAM of order {} in {} form differs from the matrix exponential by {:.3e} (tolerance {:.1e})'.format(order, form, error, tolerance))
+
+    return error
+
+class Solver_stats(object):
+    """Counts of the depletion solves made with an onix.salameche.CRAM_LU_cache. The solvers do not print anything at each solve, these counts are kept instead.
+
+    Attributes
+    ----------
+    solve_count: int
+        Number of depletion equations solved
+    lu_reuse_count: int
+        Number of CRAM solves that reused the LU factors of a previous solve
+    solve_time: float
+        Total time spent in the solvers (s)
+    """
+
+    def __init__(self):
+
+        self.solve_count = 0
+        self.lu_reuse_count = 0
+        self.solve_time = 0.0
+
+    def __repr__(self):
+
+        return 'Solver_stats(solves={}, lu_reuses={}, time={:.3e} s)'.format(self.solve_count, self.lu_reuse_count, self.solve_time)
+
+    def _add_solve(self, solve_time, lu_reused = False):
+
+        self.solve_count += 1
+        if lu_reused:
+            self.lu_reuse_count += 1
+        self.solve_time += solve_time
+
+class Density_check_stats(object):
+    """Counts of the corrections and inconsistencies found by onix.salameche.CRAM_density_check and onix.salameche.CRAM_reality_check.
+
+    Attributes
+    ----------
+    negative_count: int
+        Number of negative densities set to zero
+    small_count: int
+        Number of densities below one atom per cubic centimeter set to zero (including the negative ones)
+    intruder_count: int
+        Number of nuclides with a non-zero density that are not in the creation tree. Only set by CRAM_reality_check
+    missing_count: int
+        Number of nuclides in the creation tree with a zero density. Only set by CRAM_reality_check
+    """
+
+    def __init__(self):
+
+        self.negative_count = 0
+        self.small_count = 0
+        self.intruder_count = None
+        self.missing_count = None
+
+    def __repr__(self):
+
+        return 'Density_check_stats(negative={}, small={}, intruders={}, missings={})'.format(self.negative_count, self.small_count, self.intruder_count, self.missing_count)
+
+def _clip_densities(N, stats):
+    """Sets negative densities and densities below 1e-24 to zero in place and counts them in stats."""
+
+    negative_mask = N < 0
+    small_mask = N < 1e-24
+    N[small_mask] = 0.0
+
+    stats.negative_count = int(np.count_nonzero(negative_mask))
+    stats.small_count = int(np.count_nonzero(small_mask))
 
 # CRAM is yielding non zero values for nuclides that should be at zero because no one is producing them
 # This algorithm check which nuclide are in this situation and set their density to zero
 def CRAM_reality_check(bucell, index_dic, N):
     """This functions checks against negative and extremely small densities (same as onix.salameche.CRAM_density_check). In addition, it compares the calculated new densities with the BUCell.leave attribute (this attribute enables to know which isotopes should be produced or not during depletion). The comparison enables the function to detect nuclides that have a non-zero density but should have a zero density. Likewise, it can detect nuclides that should be produced but have zero density.
 
+    Returns an onix.salameche.Density_check_stats object.
+
     Parameters
     ----------
     bucell: onix.Cell
@@ -73,60 +803,44 @@ def CRAM_reality_check(bucell, index_dic, N):
         New density vector solution to the depletion equation
     """
 
-    print('reality check called')
-    passlist = bucell.passlist
-    leaves = bucell.leaves
-    fission_leaves = bucell.fission_leaves
-    total_leaves = leaves + fission_leaves
-
-    negative_count = 0
-    small_count = 0
-    intruder_count = 0
-    missing_count = 0
-
-    for nuc_pass in passlist:
-        nuc_zamid = nuc_pass.zamid
-        nuc_name = nuc_pass.name
-        nuc_dens = nuc_pass.dens
-        index = index_dic[nuc_pass.zamid]
-        N_val = N[index]
-
-        # if nuc_name == 'Au-200':
-        #     print nuc_name, nuc_zamid
-        #     print nuc_dens
-
-        if N_val < 0:
-          #  warnings.warn('NEGATIVE: Nuclide {}/{} has a negative density of {}'.format(nuc_name, nuc_zamid, N_val))
-            N[index] = 0.0
-            negative_count += 1
+    stats = Density_check_stats()
+    _clip_densities(N, stats)
 
-        N_val = N[index]
+    leaves_mask = _get_leaves_mask(bucell, index_dic, len(N))
 
-        if N_val < 1e-24:
-          #  warnings.warn('TOO SMALL: Nuclide {}/{} has a density of {} below 1e-24'.format(nuc_name, nuc_zamid, N_val))
-            N[index] = 0.0
-            small_count += 1
+    zero_mask = N == 0
+    stats.missing_count = int(np.count_nonzero(leaves_mask & zero_mask))
+    stats.intruder_count = int(np.count_nonzero(~leaves_mask & ~zero_mask))
 
-        N_val = N[index]
+    return stats
 
-        if nuc_zamid in total_leaves and N_val == 0:
+def _get_leaves_mask(bucell, index_dic, size):
+    """Returns a boolean array indicating which entries of the density vector belong to the creation tree of the BUCell.
 
-          #  warnings.warn('MISSING: Nuclide {} has a density of 0 while it belongs to the creation tree'.format(nuc_name))
-            missing_count += 1
+    The mask is kept in the passlist of the BUCell and only rebuilt when the passports list has been ordered or extended or when the leaves have been regenerated."""
 
-        elif nuc_zamid not in total_leaves and N_val != 0:
+    passlist = bucell.passlist
+    leaves = bucell.leaves
+    fission_leaves = bucell.fission_leaves
+    cached = passlist._leaves_mask
+    if cached is not None:
+        version, cached_index_dic, cached_leaves, cached_fission_leaves, leaves_mask = cached
+        if version == passlist._passport_list_version and cached_index_dic is index_dic and cached_leaves is leaves \
+                and cached_fission_leaves is fission_leaves and len(leaves_mask) == size:
+            return leaves_mask
 
-          #  warnings.warn('INTRUDER: Nuclide {} has a density of {} while it is not in the creation tree'.format(nuc_name, N_val ))
-            intruder_count += 1
+    leaves_index = [index_dic[nuc_zamid] for nuc_zamid in set(leaves + fission_leaves) if nuc_zamid in index_dic]
+    leaves_mask = np.zeros(size, dtype = bool)
+    leaves_mask[leaves_index] = True
+    passlist._leaves_mask = (passlist._passport_list_version, index_dic, leaves, fission_leaves, leaves_mask)
 
-    print(('There are {} negative'.format(negative_count)))
-    print(('There are {} too small'.format(small_count)))
-    print(('There are {} intruders'.format(intruder_count)))
-    print(('There are {} missings'.format(missing_count)))
+    return leaves_mask
 
 def CRAM_density_check(bucell, N):
     """This function checks for extremely low densities and negative densities. Densities below one atom per cubic centimeter are set to zero. Negative densities are produced by mathematical approximations inherent to the CRAM method and therefore do not bear any physical meaning. They are also set to zero.
 
+    Returns an onix.salameche.Density_check_stats object.
+
     Parameters
     ----------
     bucell: onix.Cell
@@ -134,35 +848,20 @@ def CRAM_density_check(bucell, N):
     N: numpy.array
         New density vector solution to the depletion equation
     """
-    passlist = bucell.passlist
-    index_dict = passlist.get_index_dict()
-    passport_list = passlist.passport_list
-
-    negative_count = 0
-    small_count = 0
-
-    for nuc_pass in passport_list:
-        nuc_zamid = nuc_pass.zamid
-        nuc_name = nuc_pass.name
-        index = index_dict[nuc_pass.zamid]
-        N_val = N[index]
-
-        if N_val < 0:
-            #warnings.warn('NEGATIVE: Nuclide {}/{} has a negative density of {}'.format(nuc_name, nuc_zamid, N_val))
-            N[index] = 0.0
-            negative_count += 1
-
-        N_val = N[index]
-
-        if N_val < 1e-24:
-            #warnings.warn('TOO SMALL: Nuclide {}/{} has a density of {} below 1e-24'.format(nuc_name, nuc_zamid, N_val))
-            N[index] = 0.0
-            small_count += 1
-
-    print(('There are {} negative'.format(negative_count)))
-    print(('There are {} too small'.format(small_count)))
 
+    stats = Density_check_stats()
+    _clip_densities(N, stats)
 
+    return stats
 
+class Unknown_solver(Exception):
+    """Raise when the user selects a depletion solver that does not exist"""
+    pass
 
+class CRAM_accuracy_error(Exception):
+    """Raise when a CRAM approximation is not accurate enough compared to the matrix exponential"""
+    pass
 
+class Batch_size_mismatch(Exception):
+    """Raise when the number of depletion matrices and density vectors passed to a batched solver differ"""
+    pass
@@ -1,135 +1,274 @@
 """ Uses the passport list to build the transmutation matrix"""
 import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.csgraph as csgraph
 import os
+from onix import data
+
+# Decay matrices already built, keyed on the decay library and the passlist order
+# Libraries that are onix.data.Lib_store are identified by their path and type so that the key is the same in every process
+_decay_mat_cache_dict = {}
+_decay_mat_cache_size = 8
 
 def get_xs_mat(passlist):
-    """Builds the cross section matrix.
-    
+    """Builds the cross section matrix in compressed sparse row format.
+
+    The positions of the non-zero terms only depend on the passlist (see onix.salameche.Xs_mat_topology). They are computed once
+    and stored in the passlist. At each call, the current cross sections of the passports are gathered into these positions.
+
     Parameters
     ----------
     passlist: onix.Passlist
         Passlist object associated with the BUCell being depleted
     """
 
-    # order the list by mass number
-    #azm_sort(passport_list)
-
-    # create a dic that stores the index of each nuclide in the list
-    passport_list = passlist.passport_list
-    index_dict = passlist.get_index_dict()
+    return get_xs_mat_topology(passlist).get_xs_mat(passlist)
 
-    N = len(passport_list)
-    xs_mat = np.zeros((N,N))
+def get_xs_mat_topology(passlist):
+    """Returns the onix.salameche.Xs_mat_topology of the passlist. It is built the first time and whenever the order of the passlist has changed.
 
-    for row in range(N):
-        nucli = passport_list[row]
-        zaidi = nucli.zamid
-        FAM = nucli.get_FAM()
-
-        # Diagonal term
-        nucli_xs = nucli.current_xs
-        if nucli_xs != None:
-            xs_mat[row][row] = -nucli_xs['removal'][0]
-        # Non diagonal terms (non fission)
-        xs_parent = nucli.xs_parent
-        for j in xs_parent:
-            # If the parent nuclide is not in passport_list, skip
-            if xs_parent[j] not in index_dict:
-                continue
-            index = index_dict[xs_parent[j]]
-            parent_pass = passport_list[index]
-            parent_xs = parent_pass.current_xs
-            # If there are no xs for the parent nuclide, skip
-            if parent_xs == None:
-                continue
-
-            # In the xs_parent dic, reaction that start from an excited state have an 'X' at the beginning of the reaction name. This 
-            # is not the case in the xs dic. Therefore, we need to remove the starting X to match the reaction name in parent_xs
-            if parent_pass.state == 1:
-                j = j[1:]
+    Parameters
+    ----------
+    passlist: onix.Passlist
+        Passlist object associated with the BUCell being depleted
+    """
 
-            # if zaidi == '10030':
-            #     print ('tritium')
-            #     print ('xs', nucli_xs)
-            #     print ('parent dict', xs_parent)
-            #     print ('xs name before', j)
-            #     print ('parent', xs_parent[j])
-            #     print ('parent xs', parent_xs)
-
-            # Certain nuclides are produced by several parents through the same reaction
-            # Ex: tritium with (n,t) from Li6 and B10
-            # In the xs_parent dict, these reactions are differentiated with prefixes ('<parent_name>(n,t)')
-            # But in the xs dict of each nuclide, this is not the case. Each reaction is only represented once
-            # To find the corresponding reactions in parent's xs dic, we need to strip the reaction name
-            # found in the xs_parent dic from its prefix
-            j = '(' + j.split('(')[1]
-            # if zaidi == '10030':
-            #     print ('xs name after', j)
-
-            # If the specific xs that produce nucli does not exist for the parent, skip
-            if j not in parent_xs:
-                continue
+    topology = passlist._xs_mat_topology
+    zamid_tuple = tuple(nuc_pass.zamid for nuc_pass in passlist.passport_list)
+    if topology is None or topology.zamid_tuple != zamid_tuple:
+        topology = Xs_mat_topology(passlist)
+        passlist._xs_mat_topology = topology
 
-            xs_val = parent_xs[j][0]
-            # If the xs that produces nucli is zero, skip
-            if xs_val == 0.0:
-                continue
-            xs_mat[row][index] = xs_val
+    return topology
 
+class Xs_mat_topology(object):
+    """Positions of the terms of the cross section matrix of a passlist and reactions from which their values are taken.
 
+    Neutron-induced reaction terms are the cross section of a reaction of a parent nuclide (a reaction slot), multiplied by -1 for the removal
+    cross section on the diagonal and by 1 for the production of a nuclide. Terms whose parent is not in the passlist or whose reaction does not exist for the parent are left out.
 
-        ####################### WARNING, TO BE REMOVED ##########################
-        ######FOR ARGONNE BENCHMARK ONLY
+    Fission terms are stored apart in a sparse yield matrix Y (nuclides x fissile parents) holding the fission yields in percent. The fission
+    block of the cross section matrix is Y diag(sigma_f) 1e-2, where sigma_f is the fission cross section of the fissile parents.
 
-        # if zaidi =='611490':
-        #     indexpm148X = index_dict['611481']
-        #     pm148X_passport = passport_list[indexpm148X]
-        #     indexpm148X_xs_val = pm148X_passport.current_xs['ngamma'][0]
-        #     xs_mat[row][indexpm148X] = indexpm148X_xs_val
+    Attributes
+    ----------
+    zamid_tuple: tuple
+        z-a-m ids of the passlist, in the order for which the topology has been built
+    slot_list: list
+        (parent index, reaction name) of each reaction slot
+    yield_mat: scipy.sparse.csr_matrix
+        Fission yields in percent. Rows are nuclides of the passlist and columns are fissile parents
+    fission_parent_index: numpy.array
+        Index in the passlist of the fissile parent of each column of yield_mat
 
-        # if zaidi =='952430':
-        #     indexam242X = index_dict['952421']
-        #     am242X_passport = passport_list[indexam242X]
-        #     indexam242X_xs_val = am242X_passport.current_xs['ngamma'][0]
-        #     xs_mat[row][indexam242X] = indexam242X_xs_val
-        ####################### WARNING, TO BE REMOVED ##########################
+    Parameters
+    ----------
+    passlist: onix.Passlist
+        Passlist from which the topology is built
+    """
 
+    def __init__(self, passlist):
+
+        passport_list = passlist.passport_list
+        index_dict = passlist.get_index_dict()
+
+        N = len(passport_list)
+        slot_dict = {}
+        row_list = []
+        col_list = []
+        slot_index_list = []
+        coef_list = []
+
+        def add_term(row, col, reac, coef):
+            slot = (col, reac)
+            if slot not in slot_dict:
+                slot_dict[slot] = len(slot_dict)
+            row_list.append(row)
+            col_list.append(col)
+            slot_index_list.append(slot_dict[slot])
+            coef_list.append(coef)
+
+        for row in range(N):
+            nucli = passport_list[row]
+
+            # Diagonal term
+            add_term(row, row, 'removal', -1.0)
+
+            # Non diagonal terms (non fission)
+            xs_parent = nucli.xs_parent
+            for j in xs_parent:
+                # If the parent nuclide is not in passport_list, skip
+                if xs_parent[j] not in index_dict:
+                    continue
+                index = index_dict[xs_parent[j]]
+                parent_pass = passport_list[index]
 
-        # fission products yields  
-        if FAM == 'FP':
+                # In the xs_parent dic, reaction that start from an excited state have an 'X' at the beginning of the reaction name. This
+                # is not the case in the xs dic. Therefore, we need to remove the starting X to match the reaction name in parent_xs
+                if parent_pass.state == 1:
+                    j = j[1:]
+
+                # Certain nuclides are produced by several parents through the same reaction
+                # Ex: tritium with (n,t) from Li6 and B10
+                # In the xs_parent dict, these reactions are differentiated with prefixes ('<parent_name>(n,t)')
+                # To find the corresponding reactions in parent's xs dic, the reaction name is stripped from its prefix
+                j = '(' + j.split('(')[1]
+                add_term(row, index, j, 1.0)
+
+        self.zamid_tuple = tuple(nuc_pass.zamid for nuc_pass in passport_list)
+        self.slot_list = list(slot_dict.keys())
+        self.row = np.array(row_list, dtype = int)
+        self.col = np.array(col_list, dtype = int)
+        self.slot_index = np.array(slot_index_list, dtype = int)
+        self.coef = np.array(coef_list, dtype = float)
+
+        # Parent and reaction of each slot as arrays, the reactions being numbered in _reac_list
+        self._reac_list = list(dict.fromkeys(reac for index, reac in self.slot_list))
+        reac_index_dict = {reac:k for k, reac in enumerate(self._reac_list)}
+        self._slot_parent_index = np.array([index for index, reac in self.slot_list], dtype = int)
+        self._slot_reac_index = np.array([reac_index_dict[reac] for index, reac in self.slot_list], dtype = int)
+
+        # When several terms fall at the same position, the last non-zero one is kept
+        position = self.row*N + self.col
+        self._has_duplicates = len(np.unique(position)) != len(position)
+
+        self._set_yield_mat(passlist)
+
+    def _set_yield_mat(self, passlist):
+        """Builds the yield matrix from the fission yields of the passports. Called again when new fission yields are set to the passlist."""
+
+        passport_list = passlist.passport_list
+        index_dict = passlist.get_index_dict()
+
+        N = len(passport_list)
+        parent_dict = {}
+        row_list = []
+        col_list = []
+        yield_list = []
+
+        for row in range(N):
+            nucli = passport_list[row]
+            if nucli.get_FAM() != 'FP':
+                continue
             fy = nucli.fy
             for j in fy:
                 # If the parent nuclide not in passport_list, skip
                 if j not in index_dict:
                     continue
-                # If the fission yield is zero, skip
-                if fy[j][0] == 0.0:
-                    continue
-                index = index_dict[j]
-                parent_pass = passport_list[index]
-                parent_xs = parent_pass.current_xs
-                # If there are no xs for the parent nuclide, skip
-                if parent_xs == None:
-                    continue
-                # if fission is not in parent cross section
-                if 'fission' not in parent_xs:
-                    continue
-                fission_val = parent_xs['fission'][0]
-                # If the fission that produces nucli is zero, skip
-                if fission_val == 0.0:
-                    continue
-                val = fission_val*fy[j][0]*1e-2
+                if j not in parent_dict:
+                    parent_dict[j] = len(parent_dict)
+                row_list.append(row)
+                col_list.append(parent_dict[j])
+                yield_list.append(fy[j][0])
 
-                # if j == '922350' and zaidi == '571490':
+        self.fission_parent_index = np.array([index_dict[j] for j in parent_dict], dtype = int)
+        self.yield_mat = sp.csr_matrix((np.array(yield_list, dtype = float), (np.array(row_list, dtype = int), np.array(col_list, dtype = int))), shape = (N, len(parent_dict)))
 
-                xs_mat[row][index] = val
+        # The fissile parents may have changed, the cross sections are loaded again
+        self._xs_version = None
 
-    return xs_mat
+    def _load_xs_values(self, passlist):
+        """Loads the current cross sections of the passports into the slot and fission arrays. This is only done when the cross sections of the passlist have changed since the last load."""
 
+        passlist._check_dens_binding()
+        if self._xs_version == passlist._xs_version:
+            return
 
+        xs_list = [nuc_pass.current_xs for nuc_pass in passlist.passport_list]
+        fission_parent_index = self.fission_parent_index
 
+        self._slot_values = self._gather_xs_values(xs_list, self._slot_parent_index, self._slot_reac_index, self._reac_list)
+        self._fission_xs = self._gather_xs_values(xs_list, fission_parent_index, np.zeros(len(fission_parent_index), dtype = int), ['fission'])
+        self._xs_version = passlist._xs_version
 
+    def _gather_xs_values(self, xs_list, parent_index, reac_index, reac_list):
+        """Returns the cross section of the reaction reac_list[reac_index[k]] of the passport parent_index[k], for each k (zero if the passport has no cross sections or no such reaction).
 
+        Cross sections that come from a compiled library (onix.data.Lib_store_entry) are read from the value table of the store. The other cross section dictionnaries are read one by one."""
+
+        values = np.zeros(len(parent_index))
+
+        # Index of each passport in the store its cross sections come from (-1 for the passports whose cross sections do not come from this store)
+        store_dict = {}
+        is_dict = np.zeros(len(xs_list), dtype = bool)
+        for i, xs in enumerate(xs_list):
+            if isinstance(xs, data.Lib_store_entry):
+                store = xs.store
+                store_key = (store.lib_path, store.lib_type)
+                if store_key not in store_dict:
+                    store_dict[store_key] = (store, np.full(len(xs_list), -1, dtype = int))
+                store_dict[store_key][1][i] = xs.index
+            elif xs is not None:
+                is_dict[i] = True
+
+        for store, store_index in store_dict.values():
+            nucl_index = store_index[parent_index]
+            key_index = np.array([store.get_key_index(reac) for reac in reac_list], dtype = int)[reac_index]
+            found = (nucl_index >= 0) & (key_index >= 0)
+            store_values = store.get_value_table()[nucl_index[found], key_index[found]]
+            # NaN marks the reactions that do not exist for the nuclide
+            values[found] = np.where(np.isnan(store_values), 0.0, store_values)
+
+        for k in np.flatnonzero(is_dict[parent_index]):
+            parent_xs = xs_list[parent_index[k]]
+            reac = reac_list[reac_index[k]]
+            if reac in parent_xs:
+                values[k] = parent_xs[reac][0]
+
+        return values
+
+    def get_slot_values(self, passlist):
+        """Returns the current cross section of each reaction slot. Slots whose parent has no cross sections or whose reaction does not exist are set to zero.
+
+        The array is kept until the cross sections of the passlist change. It must not be modified.
+        """
+
+        self._load_xs_values(passlist)
+
+        return self._slot_values
+
+    def get_fission_xs(self, passlist):
+        """Returns the current fission cross section of each fissile parent (zero if the parent has no fission cross section).
+
+        The array is kept until the cross sections of the passlist change. It must not be modified.
+        """
+
+        self._load_xs_values(passlist)
+
+        return self._fission_xs
+
+    def get_fission_mat(self, passlist):
+        """Returns the fission block Y diag(sigma_f) 1e-2 of the cross section matrix, with the columns placed at the index of the fissile parents in the passlist."""
+
+        N = len(self.zamid_tuple)
+        yield_mat = self.yield_mat
+        data = yield_mat.data*self.get_fission_xs(passlist)[yield_mat.indices]*1e-2
+
+        return sp.csr_matrix((data, self.fission_parent_index[yield_mat.indices], yield_mat.indptr), shape = (N, N))
+
+    def get_xs_mat(self, passlist):
+        """Returns the cross section matrix of the passlist in compressed sparse row format, filled with the current cross sections of the passports."""
+
+        N = len(self.zamid_tuple)
+        values = self.get_slot_values(passlist)[self.slot_index]*self.coef
+
+        non_zero = values != 0.0
+        row = self.row[non_zero]
+        col = self.col[non_zero]
+        values = values[non_zero]
+
+        if self._has_duplicates:
+            # Index of the last occurrence of each position
+            _, first_reversed = np.unique((row*N + col)[::-1], return_index = True)
+            last = len(row) - 1 - first_reversed
+            row = row[last]
+            col = col[last]
+            values = values[last]
+
+        xs_mat = sp.csr_matrix((values, (row, col)), shape = (N, N)) + self.get_fission_mat(passlist)
+        xs_mat.eliminate_zeros()
+
+        return xs_mat
 
 def get_decay_mat(passlist):
     """Builds the decay matrix.
@@ -193,6 +332,131 @@ def get_decay_mat(passlist):
     return decay_mat
 
 
+def get_decay_mat_cached(passlist, decay_lib):
+    """Returns the decay matrix of the passlist in compressed sparse row format, built only once for a given decay library and passlist order.
+
+    The decay matrix does not depend on the flux and is therefore constant over the whole simulation. BUCells that share the same decay
+    library and the same passlist order receive the same matrix. This matrix is read-only and must not be modified in place.
+
+    Parameters
+    ----------
+    passlist: onix.Passlist
+        Passlist object associated with the BUCell being depleted
+    decay_lib: dict or onix.data.Lib_store
+        Decay library of the BUCell (absolute decay constants). If None, the matrix is built but not stored
+    """
+
+    if decay_lib is None:
+        return sp.csr_matrix(get_decay_mat(passlist))
+
+    if isinstance(decay_lib, data.Lib_store):
+        lib_key = (decay_lib.lib_path, decay_lib.lib_type)
+    else:
+        lib_key = id(decay_lib)
+    key = (lib_key, tuple(nuc_pass.zamid for nuc_pass in passlist.passport_list))
+    if key in _decay_mat_cache_dict:
+        cached_lib, decay_mat = _decay_mat_cache_dict[key]
+        # The id of a library that has been deleted can be given to a new one
+        # and a store is opened again if its library file has been modified
+        if cached_lib is decay_lib:
+            return decay_mat
+
+    if isinstance(decay_lib, data.Lib_store) and _is_decay_from_store(passlist, decay_lib):
+        decay_mat = get_decay_mat_from_store(passlist, decay_lib)
+    else:
+        decay_mat = sp.csr_matrix(get_decay_mat(passlist))
+    decay_mat.data.flags.writeable = False
+
+    _decay_mat_cache_dict[key] = (decay_lib, decay_mat)
+    while len(_decay_mat_cache_dict) > _decay_mat_cache_size:
+        del _decay_mat_cache_dict[next(iter(_decay_mat_cache_dict))]
+
+    return decay_mat
+
+def _is_decay_from_store(passlist, decay_store):
+    """Checks that the absolute decay constants of the passports are those of the store (None for nuclides that are not in the store)."""
+
+    for nuc_pass in passlist.passport_list:
+        zamid = nuc_pass.zamid
+        if zamid in decay_store:
+            if nuc_pass.decay_a != decay_store[zamid]:
+                return False
+        elif nuc_pass.decay_a is not None:
+            return False
+
+    return True
+
+def get_decay_mat_from_store(passlist, decay_store):
+    """Builds the decay matrix in compressed sparse row format directly from the arrays of a decay library store.
+
+    This yields the same matrix as onix.salameche.get_decay_mat when the passports hold the decay constants of the store, but the constants are
+    gathered from the memory-mapped arrays of the store with array indexing instead of the decay dictionnaries of the passports.
+
+    Parameters
+    ----------
+    passlist: onix.Passlist
+        Passlist object associated with the BUCell being depleted
+    decay_store: onix.data.Lib_store
+        Decay library store of the BUCell (absolute decay constants, 'decay_a')
+    """
+
+    passport_list = passlist.passport_list
+    index_dict = passlist.get_index_dict()
+    N = len(passport_list)
+
+    value_table = decay_store.get_value_table()
+    store_index = decay_store.get_nucl_index([nuc_pass.zamid for nuc_pass in passport_list])
+
+    # Diagonal terms come first so that, as in get_decay_mat, a later term at the same position replaces them
+    row_list = list(range(N))
+    col_list = list(range(N))
+    key_list = [decay_store.get_key_index('total decay')]*N
+    sign_list = [-1.0]*N
+
+    for row in range(N):
+        decay_parent = passport_list[row].decay_parent
+        for j in decay_parent:
+            # If the parent nuclide is not in passport_list, skip
+            if decay_parent[j] not in index_dict:
+                continue
+            index = index_dict[decay_parent[j]]
+            # Reactions that start from an excited state have an 'X' at the beginning of the reaction name in decay_parent
+            if passport_list[index].state == 1:
+                j = j[1:]
+            row_list.append(row)
+            col_list.append(index)
+            key_list.append(decay_store.get_key_index(j))
+            sign_list.append(1.0)
+
+    row = np.array(row_list, dtype = int)
+    col = np.array(col_list, dtype = int)
+    key = np.array(key_list, dtype = int)
+    values = np.array(sign_list)
+
+    # Terms whose source is not in the store or has no entry for the reaction are left out (stable nuclides have no entry)
+    source = store_index[col]
+    found = (source >= 0) & (key >= 0)
+    row = row[found]
+    col = col[found]
+    values = values[found]*value_table[source[found], key[found]]
+
+    # Zero terms are skipped and do not replace a previous term at the same position
+    found = ~np.isnan(values) & (values != 0.0)
+    row = row[found]
+    col = col[found]
+    values = values[found]
+
+    # When several terms fall at the same position, the last one is kept
+    _, first_reversed = np.unique((row*N + col)[::-1], return_index = True)
+    last = len(row) - 1 - first_reversed
+
+    return sp.csr_matrix((values[last], (row[last], col[last])), shape = (N, N))
+
+def clear_decay_mat_cache():
+    """Removes all the decay matrices stored by onix.salameche.get_decay_mat_cached. This should be called if the decay constants of passports are modified directly during a simulation."""
+
+    _decay_mat_cache_dict.clear()
+
 def get_initial_vect(passlist):
 
     """Gets the initial density vector.
@@ -202,25 +466,330 @@ def get_initial_vect(passlist):
     passlist: onix.Passlist
         Passlist object associated with the BUCell being depleted
     """
-    passport_list = passlist.passport_list
+    return passlist.get_dens_vect()
+
+
+
+
+
+
 
-    N = len(passport_list)
     
-    vect = np.zeros((N))
-    for i in range(N):
-        nuc_pass = passport_list[i]
-        vect[i] = nuc_pass.current_dens
 
-    return vect
 
+def get_reachable_index(xs_mat, decay_mat, initial_vect):
+    """Returns the sorted indexes of the nuclides that can be produced from the nuclides with a non-zero initial density.
 
+    A nuclide j produces a nuclide i if the cross section or the decay matrix has a non-zero term in row i and column j.
+    Nuclides that are not reachable keep a zero density during depletion and can be removed from the depletion system.
 
+    Parameters
+    ----------
+    xs_mat: numpy.array or scipy.sparse matrix
+        Cross section matrix
+    decay_mat: numpy.array or scipy.sparse matrix
+        Decay matrix
+    initial_vect: numpy.array
+        Initial density vector
+    """
 
+    N = len(initial_vect)
+    production_mat = (abs(sp.csr_matrix(xs_mat)) + abs(sp.csr_matrix(decay_mat))).tocsr()
 
+    # Graph where an edge goes from the producing nuclide to the produced nuclide
+    # An additional node (index N) is linked to every nuclide present initially
+    graph = production_mat.T.tocsr()
+    graph.data[:] = 1
+    source_row = sp.csr_matrix((np.ones(np.count_nonzero(initial_vect)), (np.zeros(np.count_nonzero(initial_vect), dtype = int), np.flatnonzero(initial_vect))), shape = (1, N))
+    graph = sp.vstack([sp.hstack([graph, sp.csr_matrix((N, 1))]), sp.hstack([source_row, sp.csr_matrix((1, 1))])]).tocsr()
 
+    reachable = csgraph.breadth_first_order(graph, N, directed = True, return_predecessors = False)
+    reachable_index = np.sort(reachable[reachable != N])
 
-    
+    return reachable_index
+
+def get_reaction_rate_topology(passlist):
+    """Returns the onix.salameche.Reaction_rate_topology of the passlist. It is built the first time and rebuilt whenever the order of the passlist,
+    the reactions present in the cross sections and decay data of the passports or the fission yields have changed.
+
+    Parameters
+    ----------
+    passlist: onix.Passlist
+        Passlist object associated with the BUCell
+    """
+
+    topology = passlist._reaction_rate_topology
+    if topology is None or not topology._is_valid(passlist):
+        topology = Reaction_rate_topology(passlist)
+        passlist._reaction_rate_topology = topology
+
+    return topology
+
+class Reaction_rate_topology(object):
+    """Labels and positions of the creation and destruction reaction rate terms of each nuclide of a passlist, used to rank reactions.
+
+    Each term is the density of a source nuclide multiplied by a decay constant, by a cross section times the flux or by a fission yield times
+    the fission cross section times the flux. The terms of a nuclide are stored in the order in which they appear in its destruction and creation
+    dictionaries. Reaction rates of all the terms are computed at once with onix.salameche.Reaction_rate_topology.get_reaction_rates.
+
+    Attributes
+    ----------
+    zamid_tuple: tuple
+        z-a-m ids of the passlist, in the order for which the topology has been built
+    label_list: list
+        Label of each term ('<reaction>' for destruction terms, '<parent name> <reaction>' for creation terms)
+    destruction_term_list: list
+        For each nuclide, the list of indexes of its destruction terms
+    creation_term_list: list
+        For each nuclide, the list of indexes of its creation terms
+    allreacs_term: numpy.array
+        Indexes of the destruction and creation terms of all nuclides, nuclide after nuclide
+    allreacs_indptr: numpy.array
+        The terms of nuclide i are allreacs_term[allreacs_indptr[i]:allreacs_indptr[i+1]]
+
+    Parameters
+    ----------
+    passlist: onix.Passlist
+        Passlist from which the topology is built
+    """
+
+    def __init__(self, passlist):
+
+        passport_list = passlist.passport_list
+        passport_dict = passlist._get_zamid_passport_dict()
+        index_dict = passlist.get_index_dict()
+        xs_topology = get_xs_mat_topology(passlist)
+        yield_mat = xs_topology.yield_mat
+        fission_parent_index = xs_topology.fission_parent_index
+
+        N = len(passport_list)
+        label_list = []
+        kind_list = []
+        source_list = []
+        coef_list = []
+        slot_index_list = []
+        slot_dict = {}
+
+        # kind 0: decay constant, kind 1: cross section, kind 2: fission yield
+        def add_term(term_dict, label, kind, source, coef, reac):
+            if reac is None:
+                slot_index_list.append(-1)
+            else:
+                slot = (source, reac)
+                if slot not in slot_dict:
+                    slot_dict[slot] = len(slot_dict)
+                slot_index_list.append(slot_dict[slot])
+            label_list.append(label)
+            kind_list.append(kind)
+            source_list.append(source)
+            coef_list.append(coef)
+            # A label already in the dictionnary keeps its position and takes the value of the new term
+            term_dict[label] = len(label_list) - 1
+
+        destruction_term_list = []
+        creation_term_list = []
+        allreacs_term_list = []
+
+        for row in range(N):
+            nuc_pass = passport_list[row]
+            destruction_dict = {}
+            creation_dict = {}
+
+            decay = nuc_pass.decay_a
+            if decay != None and decay != 'stable':
+                for reac in decay:
+                    if reac == 'total decay' or reac == 'half-life':
+                        continue
+                    add_term(destruction_dict, reac, 0, row, decay[reac], None)
+
+            xs = nuc_pass.current_xs
+            if xs != None:
+                for reac in xs:
+                    add_term(destruction_dict, reac, 1, row, 0.0, reac)
+                destruction_dict.pop('removal', None)
+
+            if nuc_pass.fy != None:
+                for k in range(yield_mat.indptr[row], yield_mat.indptr[row+1]):
+                    father_index = fission_parent_index[yield_mat.indices[k]]
+                    father_pass = passport_list[father_index]
+                    if father_pass.current_xs == None:
+                        continue
+                    if 'fission' not in father_pass.current_xs:
+                        continue
+                    add_term(creation_dict, '{} fission'.format(father_pass.name), 2, father_index, yield_mat.data[k], 'fission')
+
+            xs_parent = nuc_pass.xs_parent
+            for i in xs_parent:
+                father_zamid = xs_parent[i]
+                if father_zamid not in passport_dict:
+                    continue
+                father_pass = passport_dict[father_zamid]
+                # The reacname from xs_parent is different from parent_xs in case parent is in excited state
+                reac_name = i[1:] if father_pass.state == 1 else i
+                if father_pass.current_xs != None and reac_name in father_pass.current_xs:
+                    add_term(creation_dict, '{} {}'.format(father_pass.name, reac_name), 1, index_dict[father_zamid], 0.0, reac_name)
+
+            decay_parent = nuc_pass.decay_parent
+            for i in decay_parent:
+                father_zamid = decay_parent[i]
+                if father_zamid not in passport_dict:
+                    continue
+                father_pass = passport_dict[father_zamid]
+                reac_name = i[1:] if father_pass.state == 1 else i
+                father_decay = father_pass.decay_a
+                if father_decay != None and father_decay != 'stable' and reac_name in father_decay:
+                    add_term(creation_dict, '{} {}'.format(father_pass.name, reac_name), 0, index_dict[father_zamid], father_decay[reac_name], None)
+
+            allreacs_dict = destruction_dict.copy()
+            allreacs_dict.update(creation_dict)
+
+            destruction_term_list.append(list(destruction_dict.values()))
+            creation_term_list.append(list(creation_dict.values()))
+            allreacs_term_list.append(list(allreacs_dict.values()))
+
+        self.zamid_tuple = tuple(nuc_pass.zamid for nuc_pass in passport_list)
+        self.label_list = label_list
+        self.destruction_term_list = destruction_term_list
+        self.creation_term_list = creation_term_list
+        self.allreacs_indptr, self.allreacs_term = _flatten_term_list(allreacs_term_list)
+        self._allreacs_row = np.repeat(np.arange(N), np.diff(self.allreacs_indptr))
+        self._destruction_indptr, self._destruction_term = _flatten_term_list(destruction_term_list)
+        self._creation_indptr, self._creation_term = _flatten_term_list(creation_term_list)
+
+        # The rate of a term is _rate_coef times the density of its source, multiplied by the cross section of
+        # its slot times the flux for cross section and fission terms
+        kind = np.array(kind_list, dtype = int)
+        self._source = np.array(source_list, dtype = int)
+        self._rate_coef = np.array(coef_list, dtype = float)
+        self._rate_coef[kind == 1] = 1.0
+        self._rate_coef[kind == 2] *= 1e-2
+        self._slot_index = np.array(slot_index_list, dtype = int)
+        self._slot_term = np.flatnonzero(self._slot_index >= 0)
+        self._slot_list = list(slot_dict.keys())
+        self._xs_version = None
+
+        # Data the topology depends on, checked by _is_valid
+        self._yield_mat = yield_mat
+        self._decay_list = [nuc_pass.decay_a for nuc_pass in passport_list]
+        self._xs_key_list = self._get_xs_key_list(passlist)
+
+    def _get_xs_key_list(self, passlist):
+
+        return [None if nuc_pass.current_xs is None else tuple(nuc_pass.current_xs) for nuc_pass in passlist.passport_list]
+
+    def _is_valid(self, passlist):
+        """Checks that the passlist order, the decay data, the reactions of the cross sections and the fission yields are those used to build the topology."""
+
+        passport_list = passlist.passport_list
+        if len(passport_list) != len(self.zamid_tuple):
+            return False
+        if any(nuc_pass.zamid != zamid for nuc_pass, zamid in zip(passport_list, self.zamid_tuple)):
+            return False
+        if get_xs_mat_topology(passlist).yield_mat is not self._yield_mat:
+            return False
+        if any(nuc_pass.decay_a is not decay for nuc_pass, decay in zip(passport_list, self._decay_list)):
+            return False
+
+        return self._get_xs_key_list(passlist) == self._xs_key_list
+
+    def _load_xs_values(self, passlist):
+        """Loads the current cross sections of the passports into the slot array. This is only done when the cross sections of the passlist have changed since the last load."""
+
+        passlist._check_dens_binding()
+        if self._xs_version == passlist._xs_version:
+            return
+
+        passport_list = passlist.passport_list
+        self._slot_values = np.array([passport_list[index].current_xs[reac][0] for index, reac in self._slot_list], dtype = float)
+        self._xs_version = passlist._xs_version
+
+    def get_reaction_rates(self, passlist, flux):
+        """Returns the reaction rate of each term, computed from the current densities and cross sections of the passports.
+
+        Parameters
+        ----------
+        passlist: onix.Passlist
+            Passlist from which the topology has been built
+        flux: float
+            Neutron flux
+        """
+
+        dens = passlist.get_dens_vect()
+        self._load_xs_values(passlist)
+
+        rate_coef = self._rate_coef.copy()
+        term = self._slot_term
+        rate_coef[term] = rate_coef[term]*self._slot_values[self._slot_index[term]]*flux*1e-24
+
+        return rate_coef*dens[self._source]
+
+    def get_ranked_terms(self, rates):
+        """Returns the terms of all nuclides, nuclide after nuclide, each nuclide's terms being sorted by increasing reaction rate.
+        Terms with equal rates keep their order. The terms of nuclide i are at allreacs_indptr[i]:allreacs_indptr[i+1].
+
+        Parameters
+        ----------
+        rates: numpy.array
+            Reaction rate of each term (see onix.salameche.Reaction_rate_topology.get_reaction_rates)
+        """
+
+        allreacs_term = self.allreacs_term
+        order = np.lexsort((rates[allreacs_term], self._allreacs_row))
+
+        return allreacs_term[order]
+
+    def get_top_terms(self, rates, top):
+        """Returns, for each nuclide, its top destruction terms and its top creation terms sorted by decreasing reaction rate.
+        Terms with a zero reaction rate are left out.
+
+        Parameters
+        ----------
+        rates: numpy.array
+            Reaction rate of each term (see onix.salameche.Reaction_rate_topology.get_reaction_rates)
+        top: int
+            Maximum number of destruction terms and of creation terms kept for each nuclide
+
+        Returns
+        -------
+        destruction_top: tuple
+            (indptr, term) where the top destruction terms of nuclide i are term[indptr[i]:indptr[i+1]]
+        creation_top: tuple
+            (indptr, term) where the top creation terms of nuclide i are term[indptr[i]:indptr[i+1]]
+        """
+
+        return _get_top_terms(rates, self._destruction_indptr, self._destruction_term, top), \
+               _get_top_terms(rates, self._creation_indptr, self._creation_term, top)
+
+def _flatten_term_list(term_list_list):
+    """Flattens a list of lists of term indexes into (indptr, term) arrays."""
+
+    indptr = np.cumsum([0] + [len(term_list) for term_list in term_list_list])
+    term = np.array([k for term_list in term_list_list for k in term_list], dtype = int)
+
+    return indptr, term
+
+def _get_top_terms(rates, indptr, term, top):
+    """Keeps the top non-zero terms of each segment of term, sorted by decreasing rate."""
+
+    N = len(indptr) - 1
+    row = np.repeat(np.arange(N), np.diff(indptr))
+    term_rates = rates[term]
+    non_zero = term_rates != 0.0
+    row = row[non_zero]
+    term = term[non_zero]
+    term_rates = term_rates[non_zero]
+
+    # Rows stay in increasing order, terms of a row are sorted by decreasing rate
+    order = np.lexsort((-term_rates, row))
+    row = row[order]
+    term = term[order]
+
+    row_start = np.searchsorted(row, np.arange(N))
+    rank = np.arange(len(row)) - row_start[row]
+    kept = rank < top
+    top_indptr = np.searchsorted(row[kept], np.arange(N + 1))
 
+    return top_indptr, term[kept]
 
 def _print_all_mat_to_text(xs_mat, decay_mat, cell, s):
 
@@ -273,90 +842,57 @@ def _get_mat_folder_path(cell):
 
 def _get_xs_mat_text_1(xs_mat, cell):
 
-    passlist = cell.passlist
-    passport_list = passlist.passport_list
-    N = len(passport_list)
-    Btxt = ''
-    for row in range(N):
-        nuc_pass = passport_list[row]
-        nuc_zamid = nuc_pass.zamid
-        Btxt += '{}|{}:'.format(nuc_zamid, row)
-
-        # Diag terms
-        diag_val = xs_mat[row][row]
-        Btxt += ' {} {},'.format(row, diag_val)
-
-        # Non diag terms
-        for col in range(N):
-            if col == row:
-                continue
-            if xs_mat[row][col] != 0.0:
-                Btxt += ' {} {},'.format(col, xs_mat[row][col])
-
-        Btxt += '\n'
-
-    return Btxt
+    return _get_mat_text(xs_mat, cell)
 
     # B = open('xs_mat', 'w')
     # B.write(Btxt)
 
 def _get_xs_mat_text_2(xs_mat, cell, flux):
 
-    passlist = cell.passlist
-    passport_list = passlist.passport_list
-    N = len(passport_list)
-    Btxt = ''
-    for row in range(N):
-        nuc_pass = passport_list[row]
-        nuc_zamid = nuc_pass.zamid
-        Btxt += '{}|{}:'.format(nuc_zamid, row)
-
-        # Diag terms
-        diag_val = xs_mat[row][row]*flux*1e-24
-        Btxt += ' {} {},'.format(row, diag_val)
-
-        # Non diag terms
-        for col in range(N):
-            if col == row:
-                continue
-            if xs_mat[row][col] != 0.0:
-                Btxt += ' {} {},'.format(col, xs_mat[row][col]*flux*1e-24)
-
-        Btxt += '\n'
-
-    return Btxt
+    return _get_mat_text(xs_mat*flux*1e-24, cell)
     # B = open('xsphi_mat', 'w')
     # B.write(Btxt)
 
 
 def _get_decay_mat_text(decay_mat, cell):
 
+    return _get_mat_text(decay_mat, cell)
+    # C = open(txt_mat_name, 'w')
+    # C.write(Ctxt)
+
+def _get_mat_text(mat, cell):
+    """Writes each row of a matrix as its diagonal term followed by its non-zero non diagonal terms. Only the non-zero terms of the matrix are visited."""
 
     passlist = cell.passlist
     passport_list = passlist.passport_list
     N = len(passport_list)
-    Ctxt = ''
+
+    mat = sp.csr_matrix(mat)
+    mat.sort_indices()
+    diagonal = mat.diagonal()
+    indptr = mat.indptr
+    indices = mat.indices
+    data = mat.data
+
+    txt_list = []
     for row in range(N):
         nuc_pass = passport_list[row]
         nuc_zamid = nuc_pass.zamid
-        Ctxt += '{}|{}:'.format(nuc_zamid, row)
+        row_txt = '{}|{}:'.format(nuc_zamid, row)
 
         # Diag terms
-        diag_val = decay_mat[row][row]
-        Ctxt += ' {} {},'.format(row, diag_val)
+        row_txt += ' {} {},'.format(row, diagonal[row])
 
         # Non diag terms
-        for col in range(N):
-            if col == row:
+        for k in range(indptr[row], indptr[row+1]):
+            col = indices[k]
+            if col == row or data[k] == 0.0:
                 continue
-            if decay_mat[row][col] != 0.0:
-                Ctxt += ' {} {},'.format(col, decay_mat[row][col])
+            row_txt += ' {} {},'.format(col, data[k])
 
-        Ctxt += '\n'
+        txt_list.append(row_txt + '\n')
 
-    return Ctxt
-    # C = open(txt_mat_name, 'w')
-    # C.write(Ctxt)
+    return ''.join(txt_list)
 
 
 # Old methods that create matrixes from txt versions
@@ -1,5 +1,6 @@
 import onix.utils as utils
 from . import data
+from .salameche import cram
 import numpy
 import uncertainties
 
@@ -26,6 +27,7 @@ class Sequence(object):
         self._macrostep_unit = None
         self._norma_vector = None
         self._norma_unit = None
+        self._flux_approximation = 'iv'
 
         self._master_bucell = None
 
@@ -103,6 +105,19 @@ class Sequence(object):
         # Temperature change
         self._temperature_change_dict = None
 
+        # Linear algebra backend used by CRAM
+        self._cram_backend = 'sparse'
+
+        # Solver used for the depletion equation
+        self._solver = 'cram16'
+
+        # Adaptive microsteps are off as long as no tolerance is set
+        self._adaptive_tolerance = None
+        self._adaptive_nucl_list = None
+
+        # By default the whole passlist is depleted
+        self._reduced_network = 'off'
+
     # def _set_from_input(self, sequence_dict, passlist,  bu_sec_conv_factor):
 
     #     sequence = sequence_dict
@@ -563,18 +578,11 @@ class Sequence(object):
             MC_flux = bucell_sequence.current_MC_flux # MC_flux unit of neutron.cm per source particle
             vol = bucell.vol # probably useless, MC_flux is already volume integrated
             passlist = bucell.passlist
-            passport_list = passlist.passport_list
             conv_Mev_J = 1.60218e-13
             conv_J_kJ = 1E-3
-            fission_energy = 0
-            for nucl in passport_list:
-                if nucl.get_FAM() == 'ACT' and nucl.current_xs != None:
-                    fission_E = nucl.fission_E
-                    # xs is obtained by dividing reaction rates (rate per source neutron) by flux (neutron.cm per source neutron)
-                    # and density (cm-3), therefore, xs are just in cm2
-                    fission_xs = nucl.current_xs['fission'][0]
-                    dens = nucl.current_dens
-                    fission_energy += dens*fission_xs*MC_flux*fission_E*conv_Mev_J*conv_J_kJ #kW
+            # xs is obtained by dividing reaction rates (rate per source neutron) by flux (neutron.cm per source neutron)
+            # and density (cm-3), therefore, xs are just in cm2
+            fission_energy = passlist.get_fission_energy_rate()*MC_flux*conv_Mev_J*conv_J_kJ #kW
 
 
             deno += fission_energy
@@ -589,18 +597,11 @@ class Sequence(object):
         MC_flux = bucell_sequence.current_MC_flux # MC_flux unit of neutron.cm per source particle
         vol = bucell.vol # probably useless, MC_flux is already volume integrated
         passlist = bucell.passlist
-        passport_list = passlist.passport_list
         conv_Mev_J = 1.60218e-13
         conv_J_kJ = 1E-3
-        fission_energy = 0
-        for nucl in passport_list:
-            if nucl.get_FAM() == 'ACT' and nucl.current_xs != None:
-                fission_E = nucl.fission_E
-                # xs is obtained by dividing reaction rates (rate per source neutron) by flux (neutron.cm per source neutron)
-                # and density (cm-3), therefore, xs are just in cm2
-                fission_xs = nucl.current_xs['fission'][0]
-                dens = nucl.current_dens
-                fission_energy += dens*fission_xs*MC_flux*fission_E*conv_Mev_J*conv_J_kJ #kW
+        # xs is obtained by dividing reaction rates (rate per source neutron) by flux (neutron.cm per source neutron)
+        # and density (cm-3), therefore, xs are just in cm2
+        fission_energy = passlist.get_fission_energy_rate()*MC_flux*conv_Mev_J*conv_J_kJ #kW
 
 
         return master_pow/fission_energy
@@ -812,18 +813,115 @@ class Sequence(object):
 
     @property
     def flux_approximation(self):
-        """Returns the method used for approximating the flux between two microsteps
-
-        **Note**: This method should not be used by the user in version 0.1"""
+        """Returns the method used for approximating the flux between two microsteps"""
         return self._flux_approximation
 
     @flux_approximation.setter
     def flux_approximation(self, flux_approximation):
-        """Sets the method used for approximating the flux between two microsteps
+        """Sets the method used for approximating the flux between two microsteps.
+
+        'iv' (default) uses the flux at the beginning of each microstep. The other methods are predictor-corrector and higher-order
+        integrators that account for the evolution of the flux during the microstep. They allow for longer microsteps at equal accuracy
+        but only differ from 'iv' when depletion is normalized against power.
 
-        **Note**: This method should not be used by the user in version 0.1"""
+        Parameters
+        ----------
+        flux_approximation: str
+            'iv' for initial value, 'pc' for constant extrapolation / constant midpoint predictor-corrector (CE/CM),
+            'celi' for constant extrapolation / linear interpolation (CE/LI), 'leqi' for linear extrapolation / quadratic interpolation (LE/QI)
+            and 'me' for the fourth-order commutator-free Magnus integrator (CF4)
+        """
+        if flux_approximation not in ['iv', 'pc', 'celi', 'leqi', 'me']:
+            raise Unknown_flux_approximation('Flux approximation {} is not supported, choose among "iv", "pc", "celi", "leqi" and "me"'.format(flux_approximation))
         self._flux_approximation = flux_approximation
 
+    @property
+    def adaptive_tolerance(self):
+        """Returns the relative tolerance of the adaptive microstep controller. None means adaptive microsteps are not used."""
+        return self._adaptive_tolerance
+
+    @property
+    def adaptive_nucl_list(self):
+        """Returns the list of nuclides whose densities are monitored by the adaptive microstep controller."""
+        return self._adaptive_nucl_list
+
+    def set_adaptive_microstep(self, tolerance, nucl_list = None):
+        """Activates the adaptive microstep controller.
+
+        Each microstep is divided into internal substeps whose length is adapted so that the estimated local relative error on the flux
+        (and on the densities of the nuclides in nucl_list) stays below tolerance. The microsteps defined with microstep_vector remain the
+        points at which results are stored, so a single microstep per macrostep can be used.
+
+        The controller only refines microsteps when depletion is normalized against power, as the flux is otherwise constant over each microstep.
+
+        Parameters
+        ----------
+        tolerance: float
+            Relative tolerance on the local error
+        nucl_list: list
+            List of nuclide names (for example ['U-235', 'Pu-239']) whose densities are also controlled. If None (default), only the flux is controlled
+        """
+        self._adaptive_tolerance = tolerance
+        self._adaptive_nucl_list = nucl_list
+
+    @property
+    def reduced_network(self):
+        """Returns 'on' if only the nuclides reachable from the current composition are depleted, 'off' otherwise."""
+        return self._reduced_network
+
+    def reduced_network_on(self):
+        """Calling this method will tell ONIX to deplete only the nuclides that can be produced from the nuclides present in the BUCell at the beginning of each macrostep.
+        Nuclides that cannot be reached through the decay, cross section and fission yield data keep a zero density and are removed from the depletion matrix.
+        The densities are still stored for the whole passlist. This greatly reduces the size of the depletion system for non-fuel BUCells such as cladding or structural materials.
+        """
+        self._reduced_network = 'on'
+
+    @property
+    def cram_backend(self):
+        """Returns the linear algebra backend used by CRAM to solve the depletion equation ('sparse', 'dense' or 'block')."""
+        return self._cram_backend
+
+    @cram_backend.setter
+    def cram_backend(self, cram_backend):
+        """Sets the linear algebra backend used by CRAM to solve the depletion equation.
+
+        'sparse' (default) stores the depletion matrix in compressed sparse column format and uses sparse LU factorizations.
+        'dense' uses dense matrices and dense linear solves. It is much slower for large nuclide networks.
+        'block' splits the depletion matrix into its strongly connected components and solves them one level after the other in topological order.
+
+        Parameters
+        ----------
+        cram_backend: str
+            'sparse', 'dense' or 'block'
+        """
+        if cram_backend not in cram.backend_list:
+            raise Unknown_cram_backend('CRAM backend {} is not supported, choose among {}'.format(cram_backend, cram.backend_list))
+        self._cram_backend = cram_backend
+
+    @property
+    def solver(self):
+        """Returns the solver used for the depletion equation."""
+        return self._solver
+
+    @solver.setter
+    def solver(self, solver):
+        """Sets the solver used for the depletion equation. This solver is used by all BUCells unless a BUCell sets its own solver.
+
+        'cram16' (default) uses CRAM of order 16 in partial fraction form and 'ipf16' the same approximation in incomplete partial fraction form.
+        'cram48' and 'ipf48' use CRAM of order 48 in partial fraction and incomplete partial fraction form. In double precision, 'cram48' is only accurate to about 1e-9 (relative to the largest density)
+        as its residues cancel each other out. 'ipf48' does not suffer from this problem and should be preferred.
+        'expm_multiply' uses the action-based matrix exponential of scipy.
+        'pade' uses the dense Pade approximant of scipy.
+
+        Parameters
+        ----------
+        solver: str
+            'cram16', 'cram48', 'ipf16', 'ipf48', 'expm_multiply' or 'pade'
+        """
+        if solver not in cram.solver_list:
+            raise cram.Unknown_solver('Solver {} is not supported, choose among {}'.format(solver, cram.solver_list))
+        self._solver = solver
+
     @property
     def microstep_vector(self):
         """Returns the microstep vector
@@ -1784,3 +1882,11 @@ class Step_0(Exception):
 
 
 
+
+class Unknown_cram_backend(Exception):
+    """Raise when the user selects a CRAM backend that does not exist"""
+    pass
+
+class Unknown_flux_approximation(Exception):
+    """Raise when the user selects a flux approximation that does not exist"""
+    pass
@@ -1,5 +1,4 @@
 import numpy as np
-import matplotlib.pyplot as plt
 import shutil
 import os
 import copy
@@ -8,8 +7,6 @@ import glob
 import pdb
 import time
 
-import openmc
-import openmc.mgxs as mgxs
 from onix.cell import Cell
 from onix.system import System
 from onix import salameche
@@ -47,6 +44,17 @@ class Stand_alone(object):
 		system = self.system
 		system.add_bucell(bucell)
 
+	def batch_cram_on(self):
+		"""Tells ONIX to solve the depletion equations of all BUCells together at each microstep.
+		BUCells whose depletion matrices are identical are then depleted with a single factorization per pole"""
+		system = self.system
+		system.batch_cram_on()
+
+	def parallel_on(self, processes = None):
+		"""Tells ONIX to deplete the BUCells in parallel over a pool of processes (by default, one per processor of the machine)"""
+		system = self.system
+		system.parallel_on(processes)
+
 	@property
 	def total_vol(self):
 		"""Returns the total volume of the system"""
@@ -220,16 +228,20 @@ class Stand_alone(object):
 
 		macrosteps_number = sequence.macrosteps_number
 		# Shift loop from 1 in order to align loop s and step indexes
-		for s in range(1, macrosteps_number+1):
-
-			print ('\n\n\n\n====== STEP {}======\n\n\n\n'.format(s))
-			sequence._gen_step_folder(s)
-			self._step_normalization(s)
-			print (('\n\n\n=== Salameche Burn {}===\n\n\n'.format(s)))
-			salameche.burn_step(system, s, 'stand alone')
-
-			# To develop. Basially update bu against time when doing constant flux
-			#sequence.dynamic_system_time_bu_conversion(system)
+		try:
+			for s in range(1, macrosteps_number+1):
+
+				print ('\n\n\n\n====== STEP {}======\n\n\n\n'.format(s))
+				sequence._gen_step_folder(s)
+				self._step_normalization(s)
+				print (('\n\n\n=== Salameche Burn {}===\n\n\n'.format(s)))
+				salameche.burn_step(system, s, 'stand alone')
+
+				# To develop. Basially update bu against time when doing constant flux
+				#sequence.dynamic_system_time_bu_conversion(system)
+		finally:
+			# The worker processes of parallel_on() are only kept during the simulation
+			system._shutdown_process_pool()
 		
 		
 		system._gen_output_summary_folder()
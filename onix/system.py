@@ -22,6 +22,12 @@ class System(object):
         self._output_summary_path = None
 
         self._reac_rank = 'off'
+        self._reac_rank_top = None
+        self._batch_cram = 'off'
+        self._parallel = 'off'
+        self._processes = None
+        # Pool of worker processes of parallel_on(), started at the first parallel macrostep
+        self._process_pool = None
 
     @property
     def id(self):
@@ -111,12 +117,79 @@ class System(object):
     def reac_rank(self):
 
         return self._reac_rank
+
+    @property
+    def reac_rank_top(self):
+
+        return self._reac_rank_top
     
-    def reac_rank_on(self):
+    def reac_rank_on(self, top = None):
         """Calling this method will tell ONIX to produce production and destrubtion reaction rates ranking for each nuclide and print the data for each BUCells.
         By default ONIX does not produce reaction rates ranking as it takes a lot of memory.
+
+        Parameters
+        ----------
+        top: int
+            (Optional) If set, only the top producers and the top destroyers of each nuclide are kept. The ranking of each microstep is written
+            to the file cell_<id>_reacs_rank_top of the BUCell folder as soon as it is computed and is not stored in memory. At the end of the
+            simulation, the rankings of all steps are gathered in output_summary/cell_<name>_reacs_rank_top
         """
         self._reac_rank = 'on'
+        self._reac_rank_top = top
+
+    @property
+    def batch_cram(self):
+
+        return self._batch_cram
+
+    def batch_cram_on(self):
+        """Calling this method will tell ONIX to solve the depletion equations of all BUCells together at each microstep.
+        BUCells whose depletion matrices are identical are then depleted with a single factorization per pole.
+        By default ONIX depletes each BUCell one after the other. This option cannot be used together with parallel_on().
+        """
+        if self._parallel == 'on':
+            raise Incompatible_depletion_modes('batch_cram_on() cannot be called on system no. {} as parallel_on() has already been called'.format(self.id))
+        self._batch_cram = 'on'
+
+    @property
+    def parallel(self):
+
+        return self._parallel
+
+    @property
+    def processes(self):
+
+        return self._processes
+
+    def parallel_on(self, processes = None):
+        """Calling this method will tell ONIX to deplete the BUCells in parallel over a pool of processes.
+        The pool is started at the first macrostep and kept until the end of the simulation.
+        The output is identical to the serial depletion. This option cannot be used together with batch_cram_on().
+
+        Parameters
+        ----------
+        processes: int
+            Maximum number of processes. If None (default), the number of processors of the machine is used
+        """
+        if self._batch_cram == 'on':
+            raise Incompatible_depletion_modes('parallel_on() cannot be called on system no. {} as batch_cram_on() has already been called'.format(self.id))
+        self._parallel = 'on'
+        self._processes = processes
+        self._shutdown_process_pool()
+
+    def _get_process_pool(self):
+        """Returns the pool of worker processes used by parallel_on(). The pool is created the first time and kept until the end of the simulation (see _shutdown_process_pool)."""
+
+        if self._process_pool is None:
+            self._process_pool = salameche.Burn_process_pool(self._processes)
+        return self._process_pool
+
+    def _shutdown_process_pool(self):
+        """Stops the worker processes used by parallel_on(). Called at the end of the simulation."""
+
+        if self._process_pool is not None:
+            self._process_pool.shutdown()
+            self._process_pool = None
 
     @property
     def total_vol(self):
@@ -472,12 +545,15 @@ class System(object):
 
         sequence = self.sequence
         steps_number = sequence.steps_number
-        for s in range(steps_number):
+        try:
+            for s in range(steps_number):
 
-            print ('\n\n\n\n STEP {}\n\n\n\n'.format(s))
+                print ('\n\n\n\n STEP {}\n\n\n\n'.format(s))
 
-            sequence._gen_step_folder(s)
-            salameche.burn_step(self, s)
+                sequence._gen_step_folder(s)
+                salameche.burn_step(self, s)
+        finally:
+            self._shutdown_process_pool()
 
         system._gen_output_summary_folder()
         system._print_summary_allreacs_rank()
@@ -510,3 +586,7 @@ class System(object):
 class Cell_name_not_found(Exception):
 
     pass
+
+class Incompatible_depletion_modes(Exception):
+
+    pass
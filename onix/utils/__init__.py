@@ -1,4 +1,11 @@
 from .reactions_class import *
 from .functions import *
 from . import printer
-from .data_processor import *
\ No newline at end of file
+from .data_processor import *
+# MidpointNormalize is built by onix.utils.functions when it is first accessed (see onix.utils.functions.__getattr__)
+def __getattr__(name):
+
+    if name == 'MidpointNormalize':
+        return functions.MidpointNormalize
+
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
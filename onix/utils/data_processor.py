@@ -1,9 +1,7 @@
 from .functions import *
 import ast
 import re
-import networkx as nx
 import numpy as np
-import matplotlib.pyplot as plt
 import os
 import onix.data as d
 #import pylab
@@ -83,6 +81,10 @@ def plot_bucell_nuclide_network(nuclide, step, path, cell, threshold):
         Value under which reaction rates are not shown on diagram
 
     """
+
+    import networkx as nx
+    import matplotlib.pyplot as plt
+
     path_to_rank = path +'/output_summary/cell_{}_reacs_rank'.format(cell)
 
     file = open(path_to_rank, 'r')
@@ -201,6 +203,9 @@ def plot_nuclide_dens_from_passport(bucell, nuclide):
     bucell: onix.Cell
     nuclide: onix.Passport
     """
+
+    import matplotlib.pyplot as plt
+
     sequence = bucell.sequence
     time_seq = sequence.time_seq.copy()
     dens_seq = nuclide.dens_seq 
@@ -218,6 +223,8 @@ def plot_nuclide_dens_from_passport(bucell, nuclide):
 
 def plot_nuclide_dens(bucell, nuclide):
 
+    import matplotlib.pyplot as plt
+
     path = os.getcwd() +'/{}_dens'.format(bucell)
 
     time_seq = read_time_seq(path)
@@ -246,6 +253,8 @@ def plot_nuclide_dens_from_path(bucell, nuclide, path_to_simulation):
         Path to simulation directory
     """
 
+    import matplotlib.pyplot as plt
+
     path = path_to_simulation + '/output_summary/{}_dens'.format(bucell)
 
     time_seq = read_time_seq(path)
@@ -273,6 +282,9 @@ def plot_nuclide_group_dens_from_path(bucell, nuclide_list, path_to_simulation):
     path_to_simulation: str
         Path to simulation directory
     """
+
+    import matplotlib.pyplot as plt
+
     path = path_to_simulation + '/output_summary/{}_dens'.format(bucell)
 
     time_seq = read_time_seq(path)
@@ -296,6 +308,8 @@ def plot_nuclide_group_dens_from_path(bucell, nuclide_list, path_to_simulation):
 
 def plot_xs_time_evolution(bucell, nuclide, xs_name):
 
+    import matplotlib.pyplot as plt
+
     path = os.getcwd() +'/{}_xs_lib'.format(bucell)
 
     time_seq = read_time_seq(path)
@@ -317,6 +331,8 @@ def plot_xs_time_evolution(bucell, nuclide, xs_name):
 
 def plot_xs_bu_evolution(bucell_list, nuclide, xs_name):
 
+    import matplotlib.pyplot as plt
+
     index = 0
     for bucell in bucell_list:
         path = os.getcwd() +'/{}_xs_lib'.format(bucell)
@@ -358,6 +374,8 @@ def plot_xs_time_evolution_from_path(bucell, nuclide, xs_name, path):
         Path to simulation directory
     """
 
+    import matplotlib.pyplot as plt
+
     time_seq = read_time_seq()
     xs_seq = read_xs_seq(nuclide, xs_name, path)
 
@@ -391,6 +409,8 @@ def plot_xs_bu_evolution_from_path(bucell_list, nuclide, xs_name, path):
         Path to simulation directory
     """
 
+    import matplotlib.pyplot as plt
+
     index = 0
     for bucell in bucell_list:
         path_xs = path +'/output_summary/{}_xs_lib'.format(bucell)
@@ -434,6 +454,8 @@ def compare_xs_bu_evolution_from_path(bucell, nuclide, xs_name_list, path_list,
         List of the names of the different simulations
     """
 
+    import matplotlib.pyplot as plt
+
     bu_seq_list = []
     xs_seq_list = []
     for path in path_list:
@@ -482,6 +504,8 @@ def plot_kinf_from_path(path_to_simulation):
         Path to the simulation's directory
     """
 
+    import matplotlib.pyplot as plt
+
     path = path_to_simulation + '/output_summary/kinf'
 
     time_seq = read_time_seq(path)
@@ -498,6 +522,8 @@ def plot_kinf_from_path(path_to_simulation):
 
 def plot_flux(bucell):
 
+    import matplotlib.pyplot as plt
+
     path = os.getcwd() +'/{}_xs_lib'.format(bucell)
 
     time_seq = read_time_seq(path)
@@ -524,6 +550,8 @@ def plot_flux_from_path(bucell, path_to_simulation):
         Path to the simulation's directory
     """
 
+    import matplotlib.pyplot as plt
+
     path = path_to_simulation + '/output_summary/{}_dens'.format(bucell)
 
     time_seq = read_time_seq(path)
@@ -551,6 +579,9 @@ def plot_flux_spectrum_bu_evolution_from_path(bucell_list, steps_list, path):
     path: str
         Path to the simulation's directory
     """
+
+    import matplotlib.pyplot as plt
+
     bucell_index = 0
     for bucell in bucell_list:
         path_flux_spectrum = path +'/{}_flux_spectrum'.format(bucell)
@@ -590,6 +621,9 @@ def plot_lethargy_spectrum_bu_evolution_from_path(bucell_list, steps_list, path)
     path: str
         Path to the simulation's directory
     """
+
+    import matplotlib.pyplot as plt
+
     bucell_index = 0
     for bucell in bucell_list:
         path_flux_spectrum = path +'/output_summary/{}_flux_spectrum'.format(bucell)
@@ -642,6 +676,8 @@ def plot_xs_dens_flux(bucell, xs_nuclide, xs_name, dens_nuclide, xs_path, dens_p
         Path to the simulation's directory from which the nuclides density data should be extracted. The neutron flux will be taken from the same simulation.
     """
 
+    import matplotlib.pyplot as plt
+
     time_subseq = read_time_seq(dens_path)
     time_seq = read_time_seq(xs_path)
     xs_seq = read_xs_seq(xs_nuclide, xs_name, xs_path)
@@ -1504,6 +1540,8 @@ def rank_nuclide_per_reac_rate(bucell, step_list, path, file_name):
 
 def plot_matrix_from_compressed_matrix(path, step, cell):
 
+    import matplotlib.pyplot as plt
+
     path_to_xs = path +'/step_{}'.format(step) +'/{}_cell'.format(cell) +'/matrix/xs_mat'
     path_to_decay = path +'/step_{}'.format(step) +'/{}_cell'.format(cell) +'/matrix/decay_mat'
     file_xs = open(path_to_xs, 'r')
@@ -1565,6 +1603,9 @@ def plot_matrix_bysign_from_compressed_matrix(path, step, cell):
     cell: str
         Name of the BUCell
     """   
+
+    import matplotlib.pyplot as plt
+
     #plt.style.use('dark_background')
     path_to_xs = path +'/step_{}'.format(step) +'/{}_cell'.format(cell) +'/matrix/xs_mat'
     path_to_decay = path +'/step_{}'.format(step) +'/{}_cell'.format(cell) +'/matrix/decay_mat'
@@ -1645,6 +1686,9 @@ def plot_nuclide_chart_color_per_nuclear_data(decay_path, fy_path, path_to_xs_xm
     fy_path: str
         Path to a fission yield library
     """
+
+    import matplotlib.pyplot as plt
+
     fy_dict = d.read_fy_lib(fy_path)
     fy_unordered_keys = get_keylist_from_dict(fy_dict)
     fy_nucl_list = order_nuclide_per_z(fy_unordered_keys)
@@ -1932,6 +1976,8 @@ def plot_compare_two_nuclear_data_on_nuclide_chart(decay_path1, fy_path1,decay_p
         Path to the cross_sections.xml file in a cross section library
     """
 
+    import matplotlib.pyplot as plt
+
     fy_dict1 = d.read_fy_lib(fy_path1)
     fy_unordered_keys1 = get_keylist_from_dict(fy_dict1)
     fy_nucl_list1 = order_nuclide_per_z(fy_unordered_keys1)
@@ -2058,6 +2104,9 @@ def plot_compare_two_nuclear_data_on_nuclide_chart(decay_path1, fy_path1,decay_p
 
 def plot_nuclide_chart_compare_fy(lib1_path, lib2_path, fissile_parent):
 
+    import matplotlib.pyplot as plt
+    from .functions import MidpointNormalize
+
     fy_dict1 = d.read_fy_lib(lib1_path)
     fy_dict2 = d.read_fy_lib(lib2_path)
 
@@ -2257,6 +2306,8 @@ def plot_nuclide_chart_compare_fy(lib1_path, lib2_path, fissile_parent):
 
 def plot_compare_libs(lib1_path, lib2_path, fissile_parent):
 
+    import matplotlib.pyplot as plt
+
     fy_dict1 = d.read_fy_lib(lib1_path)
     fy_dict2 = d.read_fy_lib(lib2_path)
 
@@ -2350,6 +2401,8 @@ def plot_compare_libs(lib1_path, lib2_path, fissile_parent):
 
 def plot_compare_libs_sum_over_parents(lib1_path, lib2_path, parent_list):
 
+    import matplotlib.pyplot as plt
+
     fy_dict1 = d.read_fy_lib(lib1_path)
     fy_dict2 = d.read_fy_lib(lib2_path)
 
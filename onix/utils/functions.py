@@ -4,14 +4,19 @@ import os
 import shutil
 from onix.data import time_dic
 import onix.data as d
-import matplotlib.pyplot as plt
 import numpy as np
-import matplotlib as mpl
-import matplotlib.colors as colors
 import xml.etree.ElementTree as ET
 
 NA = 6.02214086e+23
 
+# Nuclide registry
+# Conversions between z-a-m ids, integer z-a-m ids and names are computed once per nuclide and then read from these dictionaries
+_zamid_zam_dict = {}
+_zamid_name_dict = {}
+_name_zamid_dict = {}
+_openmc_onix_name_dict = {}
+_onix_openmc_name_dict = {}
+
 def decay_to_halflife(decay_constant, unit):
     """Converts a decay constant into a half life in specified units.
 
@@ -211,7 +216,7 @@ def get_zamid_z(zamid):
         z-a-m id of a nuclide
     """
 
-    z = int(zamid[:-4])
+    z = zamid_to_zam(zamid)//10000
 
     return z
 
@@ -225,7 +230,7 @@ def get_name_z(name):
         Name of a nuclide
     """
     zamid = name_to_zamid(name)
-    z = int(zamid[:-4])
+    z = zamid_to_zam(zamid)//10000
 
     return z
 
@@ -238,7 +243,7 @@ def get_zamid_a(zamid):
     zamid: str
         z-a-m id of a nuclide
     """
-    a = int(zamid[-4:-1])
+    a = (zamid_to_zam(zamid)//10)%1000
 
     return a
 
@@ -251,8 +256,9 @@ def get_zamid_n(zamid):
     zamid: str
         z-a-m id of a nuclide
     """
-    a = int(zamid[-4:-1])
-    z = int(zamid[:-4])
+    zam = zamid_to_zam(zamid)
+    a = (zam//10)%1000
+    z = zam//10000
 
     return a - z
 
@@ -265,10 +271,27 @@ def get_zamid_s(zamid):
     zamid: str
         z-a-m id of a nuclide
     """
-    s = int(zamid[-1])
+    s = zamid_to_zam(zamid)%10
 
     return s
 
+def zamid_to_zam(zamid):
+
+    """Converts a nuclide's z-a-m id into an integer (zz*10000 + aaa*10 + m). Integer z-a-m ids are used to sort and compare nuclides.
+    
+    Parameters
+    ----------
+    zamid: str
+        z-a-m id of a nuclide
+    """
+    try:
+        return _zamid_zam_dict[zamid]
+    except KeyError:
+        zam = int(zamid)
+        _zamid_zam_dict[zamid] = zam
+
+        return zam
+
 def zamid_to_name(zamid):
 
     """Converts a nuclide's z-a-m id into the nuclide's name.
@@ -278,25 +301,23 @@ def zamid_to_name(zamid):
     zamid: str
         z-a-m id of a nuclide
     """
-    dic = d.nuc_name_dic
-    if len(zamid) == 5:
-        nz = int(zamid[0:1])
-        na = int(zamid[1:4])
-        state = int(zamid[4])
-    if len(zamid) == 6:
-        nz = int(zamid[0:2])
-        na = int(zamid[2:5])
-        state = int(zamid[5])
-    if len(zamid) == 7:
-        nz = int(zamid[0:3])
-        na = int(zamid[3:6])
-        state = int(zamid[6])
+    try:
+        return _zamid_name_dict[zamid]
+    except KeyError:
+        pass
+
+    zam = zamid_to_zam(zamid)
+    nz = zam//10000
+    na = (zam//10)%1000
+    state = zam%10
 
     if state == 0:
         nuc_name = '{}-{}'.format(d.nuc_zz_dic[nz], na) 
     else:
         nuc_name = '{}-{}*'.format(d.nuc_zz_dic[nz], na)
 
+    _zamid_name_dict[zamid] = nuc_name
+
     return nuc_name
 
 def name_to_zamid(name):
@@ -308,7 +329,10 @@ def name_to_zamid(name):
     name: str
         Name of a nuclide
     """
-    dic = d.nuc_name_dic
+    try:
+        return _name_zamid_dict[name]
+    except KeyError:
+        pass
 
     elt_name = name.split('-')[0]
     na = int(name.split('-')[1].replace('*',''))
@@ -319,6 +343,9 @@ def name_to_zamid(name):
     zzaaam = 10000*d.nuc_name_dic[elt_name] + na*10 + state
     zamid = str(zzaaam)
 
+    _name_zamid_dict[name] = zamid
+    _zamid_zam_dict[zamid] = zzaaam
+
     return zamid
 
 
@@ -602,6 +629,11 @@ def openmc_name_to_onix_name(name):
     name: str
         Name of a nuclide in OpenMC format ('U235_m1')
     """
+    try:
+        return _openmc_onix_name_dict[name]
+    except KeyError:
+        pass
+
     i = 0
     while not is_number(name[i]):
         i += 1
@@ -612,6 +644,7 @@ def openmc_name_to_onix_name(name):
     am = am.replace('n', '*') # used in jeff3.3
     onix_name = name[:i] + '-' + am
 
+    _openmc_onix_name_dict[name] = onix_name
 
 
     return onix_name
@@ -627,9 +660,16 @@ def onix_name_to_openmc_name(name):
     name: str
         Name of a nuclide in ONIX format ('U-235*')
     """
+    try:
+        return _onix_openmc_name_dict[name]
+    except KeyError:
+        pass
+
     openmc_name = name.replace('-', '')
     openmc_name = openmc_name.replace('*','_m1')
 
+    _onix_openmc_name_dict[name] = openmc_name
+
     return openmc_name
 
 def bu_namelist_to_mc_namelist(name_list):
@@ -677,16 +717,7 @@ def order_nuclide_per_z(nucl_list):
     nucl_list: List of str
         List of nuclides' z-a-m ids
     """
-    changed = True
-    while changed:
-        changed = False
-        for i in range(len(nucl_list) - 1):
-            zamid0 = int(nucl_list[i])
-            zamid1 = int(nucl_list[i+1])
-
-            if zamid0 > zamid1:
-                nucl_list[i], nucl_list[i+1] = nucl_list[i+1], nucl_list[i]
-                changed = True
+    nucl_list.sort(key = zamid_to_zam)
 
     return nucl_list
 
@@ -716,37 +747,45 @@ def order_nuclide_per_a(nucl_list):
     nucl_list: List of str
         List of nuclides' z-a-m ids
     """
-    changed = True
-    while changed:
-        changed = False
-        for i in range(len(nucl_list) - 1):
-            zamid0 = nucl_list[i]
-            zamid1 = nucl_list[i+1]
+    # z-a-m ids are compared as strings
+    nucl_list.sort()
 
+    return nucl_list
 
-            if zamid0 > zamid1:
-                nucl_list[i], nucl_list[i+1] = nucl_list[i+1], nucl_list[i]
-                changed = True
 
-    return nucl_list
+def _get_midpoint_normalize_class():
+    """Builds the MidpointNormalize class. matplotlib is only imported when the class is first accessed."""
 
+    import matplotlib.colors as colors
 
-# set the colormap and centre the colorbar
-class MidpointNormalize(colors.Normalize):
-    """
-    Normalise the colorbar so that diverging bars work there way either side from a prescribed midpoint value)
+    # set the colormap and centre the colorbar
+    class MidpointNormalize(colors.Normalize):
+        """
+        Normalise the colorbar so that diverging bars work there way either side from a prescribed midpoint value)
 
-    e.g. im=ax1.imshow(array, norm=MidpointNormalize(midpoint=0.,vmin=-100, vmax=100))
-    """
-    def __init__(self, vmin=None, vmax=None, midpoint=None, clip=False):
-        self.midpoint = midpoint
-        colors.Normalize.__init__(self, vmin, vmax, clip)
+        e.g. im=ax1.imshow(array, norm=MidpointNormalize(midpoint=0.,vmin=-100, vmax=100))
+        """
+        def __init__(self, vmin=None, vmax=None, midpoint=None, clip=False):
+            self.midpoint = midpoint
+            colors.Normalize.__init__(self, vmin, vmax, clip)
+
+        def __call__(self, value, clip=None):
+            # I'm ignoring masked values and all kinds of edge cases to make a
+            # simple example...
+            x, y = [self.vmin, self.midpoint, self.vmax], [0, 0.5, 1]
+            return np.ma.masked_array(np.interp(value, x, y), np.isnan(value))
+
+    return MidpointNormalize
+
+# matplotlib takes most of the import time of onix, MidpointNormalize is only built when it is first accessed
+def __getattr__(name):
+
+    if name == 'MidpointNormalize':
+        MidpointNormalize = _get_midpoint_normalize_class()
+        globals()[name] = MidpointNormalize
+        return MidpointNormalize
 
-    def __call__(self, value, clip=None):
-        # I'm ignoring masked values and all kinds of edge cases to make a
-        # simple example...
-        x, y = [self.vmin, self.midpoint, self.vmax], [0, 0.5, 1]
-        return np.ma.masked_array(np.interp(value, x, y), np.isnan(value))
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
 
 
 